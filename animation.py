@@ -0,0 +1,110 @@
+# 统一的动画时钟
+# 以前每个精灵自己倒计时轮播图片，哪怕它只有一张图也要每帧算一遍
+# 现在改成：每组图片对应一条动画轨道，所有会动的精灵共用一个时钟，
+# 由时钟和精灵开始播放的时间算出这一帧该显示哪张图，并在一次遍历中统一更新
+import pygame
+
+
+class AnimationTrack:
+    """
+    动画轨道：一组轮流播放的图片以及每张图片显示的时间
+    同一组图片（同一个列表里的同一些Surface）与同样的间隔只会生成一条轨道，供所有精灵共用
+    """
+
+    def __init__(self, images: list[pygame.Surface], frame_time: float):
+        """
+        创建一条动画轨道。请使用get_track获取轨道，不要直接创建
+        :param images: 轮播的图片，至少两张
+        :param frame_time: 每张图片显示的时间，单位：秒
+        """
+        self.images = tuple(images)
+        self.frame_time = frame_time
+
+    def frame(self, elapsed: float) -> pygame.Surface:
+        """
+        计算开始播放elapsed秒后应当显示的图片
+        :param elapsed: 从开始播放到现在的时间，单位：秒
+        :return: 应当显示的图片
+        """
+        return self.images[int(elapsed / self.frame_time) % len(self.images)]
+
+
+# 所有已经生成的动画轨道
+# 轨道本身引用了这些图片，所以图片不会被回收，id不会被复用
+_tracks = {}
+
+
+def get_track(images: list[pygame.Surface], frame_time: float) -> AnimationTrack:
+    """
+    获取一组图片对应的动画轨道，没有时创建一条
+    :param images: 轮播的图片
+    :param frame_time: 每张图片显示的时间，单位：秒
+    :return: 动画轨道
+    """
+    key = (tuple(id(image) for image in images), frame_time)
+    track = _tracks.get(key)
+    if track is None:
+        track = _tracks[key] = AnimationTrack(images, frame_time)
+    return track
+
+
+class AnimationClock:
+    """
+    全局动画时钟
+    只有图片多于一张的精灵会被登记在这里，只有一张图片的精灵完全不参与动画计算
+    用法：每帧（不暂停时）调用advance推进时间，再调用animate统一更新所有精灵的图片
+    """
+
+    def __init__(self):
+        # 时钟走过的时间，单位：秒。暂停时不走
+        self.time = 0.0
+        # 需要播放动画的精灵，精灵被kill时会自动从组中移除
+        self.animated = pygame.sprite.Group()
+
+    def register(self, sprite: pygame.sprite.Sprite, track: AnimationTrack) -> None:
+        """
+        让一个精灵从现在开始播放一条动画轨道
+        :param sprite: 精灵
+        :param track: 该精灵要播放的动画轨道
+        :return: 无
+        """
+        sprite.track = track
+        sprite.start_time = self.time
+        self.animated.add(sprite)
+
+    def unregister(self, sprite: pygame.sprite.Sprite) -> None:
+        """
+        让一个精灵停止播放动画，它的图片保持不变
+        :param sprite: 精灵
+        :return: 无
+        """
+        self.animated.remove(sprite)
+
+    def advance(self, dt: float) -> None:
+        """
+        推进时钟
+        :param dt: 距离上次推进的时间，单位：秒
+        :return: 无
+        """
+        self.time += dt
+
+    def animate(self) -> None:
+        """
+        一次性更新所有登记过的精灵的图片
+        :return: 无
+        """
+        now = self.time
+        for sprite in self.animated.sprites():
+            sprite.image = sprite.track.frame(now - sprite.start_time)
+
+    def reset(self) -> None:
+        """
+        清空所有登记的精灵，并把时间归零，新开一局时使用
+        :return: 无
+        """
+        self.animated.empty()
+        self.time = 0.0
+
+
+# 游戏里所有精灵共用的时钟
+CLOCK = AnimationClock()
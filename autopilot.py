@@ -0,0 +1,253 @@
+# 自动驾驶
+# 长时间的无人值守测试（压力测试，长跑测试，性能测试）需要有人一直玩游戏，而且要活得够久，打得到Boss，
+# 不然测到的永远只是第一波敌机，后期的弹幕，火球，Boss技能这些最吃性能的部分根本跑不到
+# Autopilot是一个输入来源（见inputs.py）：退出，暂停等事件照常来自真正的输入来源，移动与开火则由它自己决定
+#
+# 每一步模拟读取按键时做一次决策：
+#   1. 危险地图：把屏幕分成格子，把敌机，敌方子弹，Boss放出的火球与Boss本身按它们现在的速度往后推几个时刻，
+#      每个时刻一层，物体在那个时刻盖住的格子加上它的危险值。所有物体一次性画到几张平铺的列表里，不逐个判断
+#   2. 玩家可以往8个方向移动或者不动，分别算出在这几个时刻玩家会盖住的格子的危险值之和
+#   3. 再加上一点偏好：对准最近的敌机或Boss好开火，待在屏幕下方，离墙远一点。总分最低的方向就是这一步要按的键
+# 开火键与追踪弹键一直按着。一局结束后等一会儿自动点重玩按钮，可以一直玩下去
+import time
+
+import pygame
+
+import inputs
+from configure import CHASE_KEY, FIRE_KEY
+
+# 危险地图的格子大小，单位：像素
+CELL = 16
+# 往后推算的几个时刻，单位：秒，每个时刻一层危险地图
+LOOKAHEAD = (0.0, 0.1, 0.2, 0.35)
+# 越远的时刻越不确定，危险值打的折扣
+LOOKAHEAD_WEIGHT = (1.0, 0.8, 0.6, 0.4)
+# 物体的矩形向外扩大多少再画到地图上，留一点余量，单位：像素
+MARGIN = 8
+# 各种物体的危险值
+ENEMY_DANGER = 3
+BULLET_DANGER = 4
+NO_DISAPPEAR_DANGER = 6
+BOSS_DANGER = 8
+# 八个方向与不动，(x方向, y方向)
+DIRECTIONS = tuple((dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1))
+# 一局结束后过多久点重玩，单位：秒
+REPLAY_DELAY = 1.0
+
+
+class DangerMap:
+    """
+    按格子记录的危险值，每个时刻一层，每层是一个平铺的列表
+    """
+
+    def __init__(self, size: tuple[int, int], cell: int = CELL, layers: int = len(LOOKAHEAD)):
+        """
+        :param size: 屏幕的(宽, 高)
+        :param cell: 格子的边长，单位：像素
+        :param layers: 层数
+        """
+        self.cell = cell
+        self.columns = -(-size[0] // cell)
+        self.rows = -(-size[1] // cell)
+        self.layers = [[0.0] * (self.columns * self.rows) for _ in range(layers)]
+
+    def clear(self) -> None:
+        """
+        清空所有层
+        :return: 无
+        """
+        empty = [0.0] * (self.columns * self.rows)
+        for layer in self.layers:
+            layer[:] = empty
+
+    def _cells(self, left: float, top: float, right: float, bottom: float):
+        # 矩形盖住的格子在平铺列表中的下标，超出屏幕的部分不算
+        cell = self.cell
+        columns = self.columns
+        first_column = max(int(left // cell), 0)
+        last_column = min(int(right // cell), columns - 1)
+        first_row = max(int(top // cell), 0)
+        last_row = min(int(bottom // cell), self.rows - 1)
+        if first_column > last_column:
+            return ()
+        return [row * columns + column for row in range(first_row, last_row + 1)
+                for column in range(first_column, last_column + 1)]
+
+    def paint(self, threats, danger: float) -> None:
+        """
+        把一批物体按它们的速度推到每个时刻，画到对应的层上
+        :param threats: 每项为(左, 上, 宽, 高, x速度, y速度)，单位：像素与像素/秒
+        :param danger: 这批物体的危险值
+        :return: 无
+        """
+        for layer, ahead, weight in zip(self.layers, LOOKAHEAD, LOOKAHEAD_WEIGHT):
+            value = danger * weight
+            for left, top, width, height, vx, vy in threats:
+                left += vx * ahead - MARGIN
+                top += vy * ahead - MARGIN
+                for index in self._cells(left, top, left + width + 2 * MARGIN, top + height + 2 * MARGIN):
+                    layer[index] += value
+
+    def cost(self, layer: int, rect: tuple[float, float, float, float]) -> float:
+        """
+        一个矩形在某一层上盖住的危险值之和
+        :param layer: 第几层
+        :param rect: (左, 上, 宽, 高)
+        :return: 危险值之和
+        """
+        values = self.layers[layer]
+        left, top, width, height = rect
+        return sum(values[index] for index in self._cells(left, top, left + width, top + height))
+
+
+class Autopilot(inputs.InputSource):
+    """
+    自动驾驶的输入来源，包在另一个输入来源外面
+    退出，暂停，显示帧率等按下的键与鼠标点击来自被包住的输入来源，按住的键与鼠标按键由自动驾驶决定
+    """
+
+    def __init__(self, app, source: inputs.InputSource, area: pygame.Rect):
+        """
+        :param app: 游戏（main.MainApp），从它身上读取玩家，敌机，子弹与Boss
+        :param source: 真正的输入来源
+        :param area: 屏幕的矩形
+        """
+        super().__init__()
+        self.app = app
+        self.source = source
+        self.area = area
+        self.latency = source.latency
+        self.danger = DangerMap(area.size)
+        # 上一次决策时每个物体的位置，用来估计速度
+        self.positions = {}
+        # 这一局结束的时间，time.perf_counter()，没有结束时为None
+        self.over_since = None
+        # 最近一次决策的方向，调试用
+        self.direction = (0, 0)
+
+    def pump(self) -> None:
+        self.source.pump()
+        self.quit = self.source.quit
+        self.key_downs = self.source.key_downs
+        self.clicks = list(self.source.clicks)
+        app = self.app
+        player = app.player
+        if player is None or (player.alive() and app.boss_health > 0):
+            self.over_since = None
+            return
+        # 死了或者赢了，等一会儿再点重玩
+        now = time.perf_counter()
+        if self.over_since is None:
+            self.over_since = now
+        elif now - self.over_since >= REPLAY_DELAY:
+            self.clicks.append((pygame.BUTTON_LEFT, app.replay_button.rect.center))
+            self.over_since = None
+
+    def mouse(self) -> list[bool]:
+        return [False, False, False]
+
+    def keys(self) -> inputs.HeldKeys:
+        """
+        决定这一步按哪些键，每一步模拟调用一次
+        :return: 按住的键
+        """
+        held = inputs.HeldKeys((FIRE_KEY, CHASE_KEY))
+        player = self.app.player
+        if player is None or not player.alive():
+            return held
+        dx, dy = self.decide(player)
+        self.direction = (dx, dy)
+        if dx:
+            held.add(pygame.K_d if dx > 0 else pygame.K_a)
+        if dy:
+            held.add(pygame.K_s if dy > 0 else pygame.K_w)
+        return held
+
+    def _threats(self, sprites, step: float, positions: dict) -> list:
+        """
+        读出一批物体的矩形与速度
+        :param sprites: 物体
+        :param step: 距离上一次决策的时间，单位：秒
+        :param positions: 这次决策时每个物体的位置，会被填入这批物体
+        :return: 每项为(左, 上, 宽, 高, x速度, y速度)
+        """
+        previous = self.positions
+        threats = []
+        for sprite in sprites:
+            rect = sprite.rect
+            x = getattr(sprite, "x", rect.x)
+            y = getattr(sprite, "y", rect.y)
+            positions[sprite] = (x, y)
+            last = previous.get(sprite)
+            if last is None:
+                threats.append((x, y, rect.width, rect.height, 0.0, 0.0))
+            else:
+                threats.append((x, y, rect.width, rect.height, (x - last[0]) / step, (y - last[1]) / step))
+        return threats
+
+    def _target_x(self, player):
+        """
+        想要对准的x坐标：Boss，或者在玩家上方离玩家最近的敌机
+        :param player: 玩家
+        :return: x坐标，没有目标时为None
+        """
+        app = self.app
+        for boss in app.boss_group:
+            return boss.rect.centerx
+        best = None
+        best_y = None
+        for enemy in app.enemy:
+            rect = enemy.rect
+            if rect.bottom < 0 or not self.area.left <= rect.centerx <= self.area.right or rect.top > player.rect.top:
+                continue
+            if best_y is None or rect.bottom > best_y:
+                best_y = rect.bottom
+                best = rect.centerx
+        return best
+
+    def decide(self, player):
+        """
+        画出危险地图，给每个方向打分，选出分最低的方向
+        :param player: 玩家
+        :return: (x方向, y方向)，各为-1，0或1
+        """
+        app = self.app
+        step = app.timestep.step
+        danger = self.danger
+        danger.clear()
+        positions = {}
+        danger.paint(self._threats(app.enemy, step, positions), ENEMY_DANGER)
+        danger.paint(self._threats(app.enemy_bullet_group, step, positions), BULLET_DANGER)
+        danger.paint(self._threats(app.enemy_no_disappear_group, step, positions), NO_DISAPPEAR_DANGER)
+        danger.paint(self._threats(app.boss_group, step, positions), BOSS_DANGER)
+        self.positions = positions
+
+        area = self.area
+        rect = player.rect
+        width = rect.width
+        height = rect.height
+        target_x = self._target_x(player)
+        home_y = area.bottom - height * 2.5
+        best = (0, 0)
+        best_cost = None
+        for dx, dy in DIRECTIONS:
+            cost = 0.0
+            x = y = 0.0
+            for layer, ahead in enumerate(LOOKAHEAD):
+                # 一直按着这个方向，到这个时刻玩家在哪里（与Player.move一样限制在屏幕内）
+                x = min(max(player.x + dx * player.speed * ahead, area.left), area.right - width)
+                y = min(max(player.y + dy * player.speed * ahead, area.top), area.bottom - height)
+                cost += danger.cost(layer, (x, y, width, height))
+            # 危险最重要，偏好只在差不多安全的方向之间起作用
+            cost *= 10
+            center_x = x + width / 2
+            if target_x is not None:
+                cost += abs(center_x - target_x) / area.width * 4
+            cost += abs(y - home_y) / area.height * 2
+            wall = min(center_x - area.left, area.right - center_x)
+            if wall < width:
+                cost += (width - wall) / width
+            if best_cost is None or cost < best_cost:
+                best_cost = cost
+                best = (dx, dy)
+        return best
@@ -0,0 +1,453 @@
+# 性能测试
+# 用法：python benchmark.py render [--counts 100 400 1600] [--frames 300] [--driver software] [--output 结果.json]
+#       python benchmark.py micro [--counts 10 100 1000] [--cases Enemy.update ...] [--compare 上次的结果.json]
+#       python benchmark.py pacing [--modes tick precise] [--rate 120] [--frames 600] [--work 3]
+# render：让不同数量的精灵在屏幕上到处乱飞，分别用每一种绘制后端绘制同样的画面，比较每帧绘制的耗时
+#         每帧的耗时同时交给一个画质调节器，看游戏在这种负载下会把画质降到多少，用--output可以保存为JSON
+# micro：单独测试游戏循环里的热点函数（各种精灵的update，生成敌机，渲染文字，每一处碰撞检测），
+#        每个函数在几种不同的数量下测试，算出耗时随数量增长的阶数，某个函数不小心变成O(n²)时一眼就能看出来
+#        结果保存为JSON（默认放在benchmarks目录下），可以用--compare与之前的结果比较
+# pacing：用每一种帧率控制方式跑同样的帧（每帧假装干活一段时间），比较帧间隔偏差的直方图与等待时占用的CPU
+# 没有显示器时可以设置环境变量SDL_VIDEODRIVER=dummy，再加上--driver software让纹理绘制使用SDL的软件渲染器
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import time
+
+import pygame
+
+import collision
+import main as game
+import pacing
+import quality
+import render
+import timestep
+import widget
+
+
+def percentile(samples: list[float], percent: int) -> float:
+    """
+    计算样本的百分位数
+    :param samples: 样本
+    :param percent: 百分之几，1到99
+    :return: 百分位数
+    """
+    if len(samples) < 2:
+        return samples[0]
+    return statistics.quantiles(samples, n=100)[percent - 1]
+
+
+def render_scene(app: game.MainApp, count: int, seed: int = 0) -> render.BatchRenderUpdates:
+    """
+    生成一个绘制测试用的场景：count个使用游戏图片的精灵，随机分布在屏幕上，各自以随机的速度移动
+    同样的seed总是生成同样的场景，这样不同的绘制后端画的是完全一样的东西
+    :param app: 游戏，用它加载好的图片
+    :param count: 精灵数量
+    :param seed: 随机数种子
+    :return: 包含所有精灵的组
+    """
+    rng = random.Random(seed)
+    images = [app.plane_image, *app.enemy_images, app.shot_image, *app.enemy_shot_images,
+              app.fire_ball_image, app.explosion_image]
+    group = render.BatchRenderUpdates()
+    for index in range(count):
+        sprite = pygame.sprite.Sprite(group)
+        sprite.image = images[index % len(images)]
+        sprite.rect = sprite.image.get_rect(center=(rng.randrange(game.SCREEN_RECT.width),
+                                                    rng.randrange(game.SCREEN_RECT.height)))
+        sprite.velocity = (rng.randint(-4, 4), rng.randint(-4, 4))
+    return group
+
+
+def move_scene(group: render.BatchRenderUpdates) -> None:
+    """
+    让场景中的所有精灵走一步，走出屏幕的从另一边回来
+    :param group: render_scene生成的组
+    :return: 无
+    """
+    width, height = game.SCREEN_RECT.size
+    for sprite in group:
+        sprite.rect.x = (sprite.rect.x + sprite.velocity[0]) % width
+        sprite.rect.y = (sprite.rect.y + sprite.velocity[1]) % height
+
+
+def bench_render(backend: str, counts: list[int], frames: int) -> list[tuple]:
+    """
+    测试一种绘制后端
+    :param backend: 绘制后端名称
+    :param counts: 依次测试的精灵数量
+    :param frames: 每种数量绘制多少帧
+    :return: 每种数量的结果，每项为(精灵数量, 平均每帧毫秒数, 95%的帧不超过的毫秒数, 平均每帧blit次数,
+             画质变化记录)，画质变化记录即QualityGovernor.history，每项为(第几帧, 新的画质等级)
+    """
+    app = game.MainApp(backend)
+    results = []
+    for count in counts:
+        group = render_scene(app, count)
+        app.backend.reset(app.background)
+        times = []
+        blits = 0
+        # 每种数量都从满画质开始
+        governor = quality.QualityGovernor(game.MAX_RATE)
+        for _ in range(frames):
+            move_scene(group)
+            render.STATS.reset()
+            start = time.perf_counter()
+            app.backend.draw(group)
+            app.backend.present()
+            times.append((time.perf_counter() - start) * 1000)
+            governor.feed(times[-1])
+            blits += render.STATS.blits
+            # 不处理事件的话，窗口在一些系统上会被认为没有响应
+            pygame.event.pump()
+        results.append((count, statistics.fmean(times), percentile(times, 95), blits / frames, governor.history))
+    return results
+
+
+# 微型测试中模拟一步的时间，单位：秒
+STEP = 1 / 60
+# 所有微型测试，名称 -> 准备函数
+# 准备函数的参数为(游戏, 数量, 随机数生成器)，返回一个不带参数的函数，每调用一次就是被测的操作执行一次
+# 每一轮测试前都会重新准备，被测的操作可以随意修改准备好的精灵
+MICRO_CASES = {}
+
+
+def micro_case(name: str):
+    """
+    注册一个微型测试的装饰器
+    :param name: 测试的名称
+    :return: 装饰器
+    """
+    def register(prepare):
+        MICRO_CASES[name] = prepare
+        return prepare
+    return register
+
+
+def random_point(rng: random.Random, top: float = 0, bottom: float = 1) -> tuple[float, float]:
+    """
+    屏幕内的一个随机点
+    :param rng: 随机数生成器
+    :param top: 纵向范围的上界，占屏幕高度的比例
+    :param bottom: 纵向范围的下界，占屏幕高度的比例
+    :return: (x, y)
+    """
+    return (rng.uniform(0, game.SCREEN_RECT.width),
+            rng.uniform(top * game.SCREEN_RECT.height, bottom * game.SCREEN_RECT.height))
+
+
+def moving(sprites, rng: random.Random, speed: float = 300):
+    """
+    给精灵设置上一步的位置，让扫掠碰撞检测按它们在运动处理
+    :param sprites: 精灵
+    :param rng: 随机数生成器
+    :param speed: 速度的上限，单位：像素/秒
+    :return: 这些精灵
+    """
+    for sprite in sprites:
+        sprite.previous_position = (sprite.x - rng.uniform(-speed, speed) * STEP,
+                                    sprite.y - rng.uniform(-speed, speed) * STEP)
+    return sprites
+
+
+@micro_case("CommonSprite.update")
+def case_common_update(app, count, rng):
+    # 基类的update什么都不做，测的是精灵组逐个调用update本身的开销，其他update的耗时都应当与它比较
+    group = pygame.sprite.Group([game.CommonSprite([app.shot_image], random_point(rng)) for _ in range(count)])
+    return lambda: group.update(STEP)
+
+
+@micro_case("Enemy.update")
+def case_enemy_update(app, count, rng):
+    group = pygame.sprite.Group()
+    for _ in range(count):
+        game.Enemy([rng.choice(app.enemy_images)], group).set_position(*random_point(rng, 0, 0.5))
+    return lambda: group.update(STEP)
+
+
+@micro_case("HardEnemyBullet.update")
+def case_hard_bullet_update(app, count, rng):
+    group = pygame.sprite.Group([game.HardEnemyBullet(app.enemy_shot_images, random_point(rng), 1000)
+                                 for _ in range(count)])
+    player_position = random_point(rng)
+    return lambda: group.update(STEP, player_position)
+
+
+@micro_case("LargeFireBall.update")
+def case_large_fireball_update(app, count, rng):
+    group = pygame.sprite.Group()
+    for _ in range(count):
+        fireball = game.LargeFireBall(app.large_fireball_image, random_point(rng, 0, 0.3), None, None, group)
+        fireball.stay_time = 0
+    player_position = random_point(rng, 0.7, 1)
+    return lambda: group.update(STEP, player_position)
+
+
+@micro_case("spawn_simple_enemy")
+def case_spawn(app, count, rng):
+    # 生成count批敌机，每批的数量由难度决定
+    groups = [pygame.sprite.Group(), pygame.sprite.Group()]
+
+    def spawn():
+        for _ in range(count):
+            game.spawn_simple_enemy(groups, app.enemy_images, 3)
+    return spawn
+
+
+@micro_case("widget.Text.render")
+def case_text_render(app, count, rng):
+    texts = [widget.Text(f"Score: {rng.randrange(100000)}", random_point(rng), app.font) for _ in range(count)]
+
+    def render_all():
+        for text in texts:
+            text.render()
+    return render_all
+
+
+def collision_case(name: str, make_first, make_second, group_collide: bool):
+    """
+    注册一处碰撞检测的测试，与游戏循环中一样使用扫掠碰撞检测，但不删除碰到的精灵，这样每次调用的工作量相同
+    :param name: 测试的名称
+    :param make_first: 生成第一个参数的函数，参数为(游戏, 数量, 随机数生成器)
+    :param make_second: 生成第二个参数（组）的函数，参数同上
+    :param group_collide: True表示groupcollide（组对组），False表示spritecollide（一个精灵对组）
+    :return: 无
+    """
+    @micro_case(name)
+    def prepare(app, count, rng):
+        first = make_first(app, count, rng)
+        second = make_second(app, count, rng)
+        if group_collide:
+            return lambda: collision.groupcollide(first, second, False, False)
+        return lambda: collision.spritecollide(first, second, False)
+
+
+def make_player(app, count, rng):
+    player = game.Player([app.plane_image], game.SCREEN_RECT.center)
+    moving([player], rng)
+    return player
+
+
+def make_boss(app, count, rng):
+    boss = game.CommonSprite([app.boss_image], (game.SCREEN_RECT.centerx, 100))
+    return pygame.sprite.Group(moving([boss], rng))
+
+
+def make_group(images, top: float = 0, bottom: float = 1):
+    def make(app, count, rng):
+        image_list = images(app)
+        return pygame.sprite.Group(moving([game.CommonSprite([rng.choice(image_list)], random_point(rng, top, bottom))
+                                           for _ in range(count)], rng))
+    return make
+
+
+enemies = make_group(lambda app: app.enemy_images, 0, 0.6)
+player_bullets = make_group(lambda app: [app.shot_image])
+enemy_bullets = make_group(lambda app: app.enemy_shot_images)
+no_disappear = make_group(lambda app: [app.fire_ball_image, app.large_fireball_image])
+
+collision_case("collide.player-enemy", make_player, enemies, False)
+collision_case("collide.player-enemy_bullet", make_player, enemy_bullets, False)
+collision_case("collide.enemy-player_bullet", enemies, player_bullets, True)
+collision_case("collide.player_bullet-boss", player_bullets, make_boss, True)
+collision_case("collide.player-boss", make_player, make_boss, False)
+collision_case("collide.player-no_disappear", make_player, no_disappear, False)
+
+
+@micro_case("collide.chain_reaction")
+def case_chain_reaction(app, count, rng):
+    # count架敌机与count个爆炸，爆炸炸到的敌机又会继续炸下去
+    candidates = enemies(app, count, rng)
+    blasts = [random_point(rng) for _ in range(count)]
+    return lambda: collision.chain_reaction(blasts, candidates, app.blast_size)
+
+
+def scaling_exponent(counts: list[int], times: list[float]):
+    """
+    用最小二乘法拟合 耗时 ∝ 数量^k 中的k：1左右是线性，2左右是平方
+    :param counts: 数量
+    :param times: 对应的耗时
+    :return: k，少于两个有效点时为None
+    """
+    points = [(math.log(count), math.log(value)) for count, value in zip(counts, times) if count > 0 and value > 0]
+    if len(points) < 2:
+        return None
+    mean_x = statistics.fmean(x for x, _ in points)
+    mean_y = statistics.fmean(y for _, y in points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if spread == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+def bench_micro(names: list[str], counts: list[int], repeat: int, calls: int, seed: int = 0) -> dict:
+    """
+    运行微型测试
+    :param names: 要运行的测试的名称
+    :param counts: 依次测试的数量
+    :param repeat: 每种数量测几轮，每轮重新准备
+    :param calls: 每轮连续调用被测的操作多少次
+    :param seed: 随机数种子，同样的种子准备出同样的精灵
+    :return: 测试名称 -> {"counts": 数量, "samples": 每种数量每轮平均每次调用的毫秒数, "median"/"mean"/"min"/"stdev":
+             每种数量的统计, "per_entity_us": 每个物体的微秒数, "exponent": 增长的阶数}
+    """
+    app = game.MainApp("null")
+    results = {}
+    for name in names:
+        prepare = MICRO_CASES[name]
+        samples = []
+        for count in counts:
+            rng = random.Random(seed)
+            # 先准备并运行一轮不计时，让各种缓存（图片格式转换，属性读取器等）就位
+            prepare(app, count, rng)()
+            rounds = []
+            for _ in range(repeat):
+                operation = prepare(app, count, rng)
+                start = time.perf_counter()
+                for _ in range(calls):
+                    operation()
+                rounds.append((time.perf_counter() - start) * 1000 / calls)
+            samples.append(rounds)
+            animation_clock_reset()
+        medians = [statistics.median(rounds) for rounds in samples]
+        results[name] = {
+            "counts": counts,
+            "samples": samples,
+            "median": medians,
+            "mean": [statistics.fmean(rounds) for rounds in samples],
+            "min": [min(rounds) for rounds in samples],
+            "stdev": [statistics.stdev(rounds) if len(rounds) > 1 else 0.0 for rounds in samples],
+            "per_entity_us": [median * 1000 / count for median, count in zip(medians, counts)],
+            "exponent": scaling_exponent(counts, medians),
+        }
+    return results
+
+
+def animation_clock_reset() -> None:
+    # 准备的精灵中有多张图片的会注册到全局的动画时钟上，每种数量测完清掉，不影响下一种
+    game.animation.CLOCK.reset()
+
+
+def print_micro(results: dict, previous: dict = None) -> None:
+    """
+    打印微型测试的结果
+    :param results: bench_micro的返回值
+    :param previous: 之前保存的结果，不为None时显示这次与之前的耗时比
+    :return: 无
+    """
+    print(f"{'测试':<30}{'数量':>7}{'中位数(ms)':>12}{'最快(ms)':>11}{'标准差':>9}{'每个(us)':>10}"
+          f"{'对比':>8}")
+    for name, result in results.items():
+        old = (previous or {}).get(name)
+        old_medians = dict(zip(old["counts"], old["median"])) if old else {}
+        for index, count in enumerate(result["counts"]):
+            median = result["median"][index]
+            ratio = f"{median / old_medians[count]:.2f}x" if old_medians.get(count) else "-"
+            print(f"{name if index == 0 else '':<30}{count:>7}{median:>12.4f}{result['min'][index]:>11.4f}"
+                  f"{result['stdev'][index]:>9.4f}{result['per_entity_us'][index]:>10.3f}{ratio:>8}")
+        exponent = result["exponent"]
+        if exponent is not None:
+            warning = "  <- 增长比线性快得多，检查是否有O(n²)" if exponent > 1.5 else ""
+            print(f"{'':<30}增长阶数 {exponent:.2f}{warning}")
+
+
+def bench_pacing(mode: str, rate: float, frames: int, work: float) -> tuple[pacing.DeviationHistogram, float]:
+    """
+    测试一种帧率控制方式
+    :param mode: 帧率控制方式，见pacing.MODES
+    :param rate: 帧率上限
+    :param frames: 跑多少帧
+    :param work: 每帧假装干活多久，单位：毫秒，实际在0.5到1.5倍之间随机
+    :return: (偏差直方图，等待时CPU占用的比例)
+    """
+    pacer = pacing.FramePacer(mode)
+    rng = random.Random(0)
+    busy = 0.0
+    waited = 0.0
+    pacer.tick(rate)
+    for _ in range(frames):
+        end = time.perf_counter() + work * rng.uniform(0.5, 1.5) / 1000
+        while time.perf_counter() < end:
+            pass
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        pacer.tick(rate)
+        waited += time.perf_counter() - wall
+        busy += time.process_time() - cpu
+    return pacer.histogram, busy / waited if waited else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="飞机大战性能测试")
+    commands = parser.add_subparsers(dest="command", required=True)
+    render_parser = commands.add_parser("render", help="比较各个绘制后端绘制同样画面的耗时")
+    render_parser.add_argument("--counts", type=int, nargs="+", default=[100, 400, 1600], help="精灵数量")
+    render_parser.add_argument("--frames", type=int, default=300, help="每种数量绘制多少帧")
+    render_parser.add_argument("--backends", nargs="+", default=list(render.BACKENDS), help="要测试的绘制后端")
+    render_parser.add_argument("--driver", default=None, help="纹理绘制使用的SDL渲染器，比如software")
+    render_parser.add_argument("--output", default=None, help="结果（包括画质变化记录）保存到哪个文件，默认不保存")
+    micro_parser = commands.add_parser("micro", help="单独测试热点函数在不同数量下的耗时")
+    micro_parser.add_argument("--counts", type=int, nargs="+", default=[10, 100, 1000], help="物体数量")
+    micro_parser.add_argument("--cases", nargs="+", default=list(MICRO_CASES), choices=list(MICRO_CASES),
+                              metavar="CASE", help=f"要运行的测试，可用的有：{', '.join(MICRO_CASES)}")
+    micro_parser.add_argument("--repeat", type=int, default=7, help="每种数量测几轮")
+    micro_parser.add_argument("--calls", type=int, default=10, help="每轮连续调用多少次")
+    micro_parser.add_argument("--output", default=None,
+                              help="结果保存到哪个文件，默认为benchmarks/micro-时间.json，为-时不保存")
+    micro_parser.add_argument("--compare", default=None, help="与之前保存的结果比较")
+    pacing_parser = commands.add_parser("pacing", help="比较各种帧率控制方式的帧间隔偏差")
+    pacing_parser.add_argument("--modes", nargs="+", default=["tick", "precise"], choices=pacing.MODES,
+                               help="要测试的帧率控制方式")
+    pacing_parser.add_argument("--rate", type=float, default=120, help="帧率上限")
+    pacing_parser.add_argument("--frames", type=int, default=600, help="每种方式跑多少帧")
+    pacing_parser.add_argument("--work", type=float, default=3, help="每帧假装干活多少毫秒")
+    args = parser.parse_args()
+
+    if args.command == "micro":
+        previous = None
+        if args.compare is not None:
+            with open(args.compare, encoding="utf-8") as file:
+                previous = json.load(file)["results"]
+        results = bench_micro(args.cases, args.counts, args.repeat, args.calls)
+        print_micro(results, previous)
+        if args.output != "-":
+            path = args.output or os.path.join("benchmarks", time.strftime("micro-%Y%m%d-%H%M%S.json"))
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump({"time": time.time(), "repeat": args.repeat, "calls": args.calls, "results": results},
+                          file, ensure_ascii=False, indent=1)
+            print(f"结果已保存到{path}")
+    elif args.command == "pacing":
+        for mode in args.modes:
+            histogram, cpu = bench_pacing(mode, args.rate, args.frames, args.work)
+            summary = histogram.summary()
+            print(f"{mode}: 平均偏差{summary['mean_ms']:.3f}ms, P95 {summary['p95_ms']:.2f}ms, "
+                  f"P99 {summary['p99_ms']:.2f}ms, 最大{summary['max_ms']:.2f}ms, "
+                  f"晚{summary['late']}帧/早{summary['early']}帧, 等待时CPU占用{cpu * 100:.0f}%")
+            for line in histogram.format():
+                print(line)
+    elif args.command == "render":
+        game.RENDER_DRIVER = args.driver
+        print(f"{'后端':<10}{'精灵数':>8}{'平均(ms)':>12}{'P95(ms)':>12}{'blit/帧':>10}{'最低画质':>10}")
+        results = {}
+        for backend in args.backends:
+            results[backend] = []
+            for count, mean, p95, blits, history in bench_render(backend, args.counts, args.frames):
+                lowest = max(level for _, level in history)
+                print(f"{backend:<10}{count:>8}{mean:>12.3f}{p95:>12.3f}{blits:>10.0f}{lowest:>10}")
+                results[backend].append({"count": count, "mean_ms": mean, "p95_ms": p95, "blits": blits,
+                                         "quality_history": history})
+        if args.output is not None:
+            os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+            with open(args.output, "w", encoding="utf-8") as file:
+                json.dump({"time": time.time(), "frames": args.frames, "max_rate": game.MAX_RATE,
+                           "results": results}, file, ensure_ascii=False, indent=1)
+            print(f"结果已保存到{args.output}")
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+# 录像
+# 把游戏画面一帧一帧存下来，用来附在bug报告里或者做宣传视频
+# 游戏线程每帧只把画面复制到一张预先分配好的图片上（与屏幕格式相同，相当于一次内存复制），然后放进有上限的队列
+# 编码与写文件都在后台线程中完成：
+#   png：每帧一张PNG图片，压缩时zlib会释放GIL，不会拖慢游戏
+#   raw：所有帧连续写进一个文件，直接写图片的内存，不做任何转换
+#        可以用 ffmpeg -f rawvideo -pix_fmt bgr0 -s 宽x高 -r 帧率 -i frames.raw out.mp4 转成视频（具体参数见info.txt）
+# 后台线程来不及写的时候，预先分配的图片会用完，这时直接丢掉这一帧而不是让游戏等待，所以录像时游戏依然能保持MAX_RATE
+# 没有显示器时（SDL_VIDEODRIVER=dummy）同样可以录像
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+import pygame
+
+import log
+
+logger = log.get_logger("capture")
+
+FORMATS = ("png", "raw")
+
+
+def encode_png(surface: pygame.Surface, level: int = 3) -> bytes:
+    """
+    把图片编码为PNG（RGB，不带透明度）
+    :param surface: 图片
+    :param level: zlib压缩等级，越大文件越小，但越慢
+    :return: PNG文件的内容
+    """
+    width, height = surface.get_size()
+    pixels = pygame.image.tobytes(surface, "RGB")
+    stride = width * 3
+    # PNG的每一行前面有一个字节的过滤方式，0表示不过滤
+    rows = b"".join(b"\x00" + pixels[y * stride:(y + 1) * stride] for y in range(height))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows, level)) \
+        + chunk(b"IEND", b"")
+
+
+class FrameRecorder:
+    """
+    录像机
+    用法：
+        recorder = FrameRecorder("captures")
+        recorder.start(画面大小)
+        每帧（显示之前）：recorder.capture(backend)
+        recorder.stop()
+    """
+
+    def __init__(self, directory: str = "captures", image_format: str = "png", queue_size: int = 8,
+                 every: int = 1):
+        """
+        :param directory: 录像存放的目录，每次录像会在其中新建一个以时间命名的目录
+        :param image_format: "png"或"raw"
+        :param queue_size: 最多有多少帧在等待写入，超过时丢帧
+        :param every: 每隔几帧记录一帧
+        """
+        if image_format not in FORMATS:
+            raise ValueError(f"不支持的录像格式{image_format}，可用的有：{', '.join(FORMATS)}")
+        self.directory = directory
+        self.image_format = image_format
+        self.queue_size = queue_size
+        self.every = every
+        self.recording = False
+        self.path = None
+        self.queue = None
+        # 空闲的图片，游戏线程取出，后台线程写完后放回
+        self.free = deque()
+        self.worker = None
+        self.raw_file = None
+        self.frame_count = 0
+        self.captured = 0
+        self.dropped = 0
+        self.start_time = 0
+
+    def start(self, size: tuple[int, int]) -> None:
+        """
+        开始录像
+        :param size: 画面大小
+        :return: 无
+        """
+        if self.recording:
+            return
+        self.path = os.path.join(self.directory, time.strftime("%Y%m%d-%H%M%S"))
+        os.makedirs(self.path, exist_ok=True)
+        # 预先分配的图片与屏幕格式相同，复制画面时不需要转换
+        self.free = deque(pygame.Surface(size).convert() for _ in range(self.queue_size + 1))
+        self.queue = queue.Queue(self.queue_size)
+        if self.image_format == "raw":
+            self.raw_file = open(os.path.join(self.path, "frames.raw"), "wb")
+        self.frame_count = self.captured = self.dropped = 0
+        self.start_time = time.perf_counter()
+        self.recording = True
+        self.worker = threading.Thread(target=self._write_loop, name="capture writer", daemon=True)
+        self.worker.start()
+        logger.info("开始录像: %s", self.path)
+
+    def capture(self, backend) -> None:
+        """
+        记录当前画面，必须在backend.present()之前调用
+        :param backend: 绘制后端
+        :return: 无
+        """
+        if not self.recording:
+            return
+        self.frame_count += 1
+        if self.frame_count % self.every:
+            return
+        try:
+            surface = self.free.popleft()
+        except IndexError:
+            # 后台线程来不及写，丢掉这一帧
+            self.dropped += 1
+            return
+        backend.capture(surface)
+        self.queue.put_nowait((self.captured, surface))
+        self.captured += 1
+
+    def stop(self) -> None:
+        """
+        停止录像，等待所有帧写完
+        :return: 无
+        """
+        if not self.recording:
+            return
+        self.recording = False
+        self.queue.put(None)
+        self.worker.join()
+        duration = time.perf_counter() - self.start_time
+        width, height = self.free[0].get_size()
+        with open(os.path.join(self.path, "info.txt"), "w", encoding="utf-8") as file:
+            file.write(f"format: {self.image_format}\n")
+            file.write(f"size: {width}x{height}\n")
+            file.write(f"frames: {self.captured}\n")
+            file.write(f"dropped: {self.dropped}\n")
+            file.write(f"fps: {self.captured / duration if duration else 0:.2f}\n")
+            if self.image_format == "raw":
+                # 每个像素4字节，按内存中的顺序为蓝，绿，红，空（大多数平台的显示格式）
+                file.write(f"masks: {self.free[0].get_masks()}, pitch: {self.free[0].get_pitch()}\n")
+        if self.raw_file is not None:
+            self.raw_file.close()
+            self.raw_file = None
+        logger.info("录像结束: %s，共%d帧，丢弃%d帧", self.path, self.captured, self.dropped)
+
+    def toggle(self, size: tuple[int, int]) -> None:
+        """
+        没在录像时开始录像，正在录像时停止录像
+        :param size: 画面大小
+        :return: 无
+        """
+        if self.recording:
+            self.stop()
+        else:
+            self.start(size)
+
+    def _write_loop(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            index, surface = item
+            try:
+                if self.raw_file is not None:
+                    # 直接写图片的内存，不复制
+                    self.raw_file.write(surface.get_buffer())
+                else:
+                    with open(os.path.join(self.path, f"frame_{index:06d}.png"), "wb") as file:
+                        file.write(encode_png(surface))
+            except OSError as error:
+                logger.error("写入录像失败: %s", error)
+            self.free.append(surface)
@@ -0,0 +1,190 @@
+# 扫掠碰撞检测
+# 子弹500像素/秒，大火球越飞越快，一步模拟（1/60秒，卡顿或者降低模拟频率时更长）里它们可能移动比目标还长的距离
+# 只检查这一步结束时两个矩形是否重叠的话，快速的物体会直接“穿过”目标
+# 这里把两个物体在这一步里的运动看成直线（相对运动），检查移动的矩形扫过的区域是否碰到了另一个矩形（扫掠AABB）
+# 物体这一步之前的位置来自timestep.remember_positions记下的previous_position，没有记录的物体视为这一步没有移动
+# 有浮点位置（x, y属性，见main.CommonSprite）的精灵按浮点位置计算运动，矩形的大小仍然来自rect
+# 检查很多对精灵时，先用每个精灵这一步扫过的区域（之前与现在的矩形合起来）排除不可能碰到的，
+# 相对位移比物体本身还短时直接比较现在的矩形，只有剩下的才做扫掠检测
+# spritecollide/groupcollide与pygame.sprite中的同名函数用法相同（没有collided参数）
+#
+# 连锁爆炸（chain_reaction）：以前每个爆炸是一个精灵，要在之后0.05秒内的每一步里与所有敌机碰撞一次，
+# 炸到的敌机再产生新的爆炸精灵，下一步才轮到它们去炸别人，一条长长的连锁要好几步才炸完，炸多远还和模拟频率有关
+# 现在一步里的所有爆炸在这一步结束碰撞检测时一次结算：按广度优先把爆炸一圈圈向外传，直到没有新的敌机被炸到
+from collections import deque
+
+import pygame
+
+
+# 已经被删除的精灵的扫过区域换成这个空矩形，空矩形不与任何矩形重叠
+_NOWHERE = pygame.Rect(0, 0, 0, 0)
+
+
+def _motion(sprite) -> tuple:
+    """
+    精灵在这一步中的运动
+    :param sprite: 精灵
+    :return: (这一步扫过的矩形, 现在的x, 现在的y, x方向位移, y方向位移)
+             扫过的矩形包住这一步之前与现在的矩形，并向外多扩了一点，盖住浮点位置取整的误差
+    """
+    rect = sprite.rect
+    x = getattr(sprite, "x", None)
+    if x is None:
+        x, y = rect.topleft
+    else:
+        y = sprite.y
+    previous = getattr(sprite, "previous_position", None)
+    if previous is None:
+        return rect, x, y, 0, 0
+    dx = x - previous[0]
+    dy = y - previous[1]
+    if dx == 0 and dy == 0:
+        return rect, x, y, 0, 0
+    bounds = pygame.Rect(int(min(x, previous[0])) - 1, int(min(y, previous[1])) - 1,
+                         int(abs(dx)) + rect.w + 3, int(abs(dy)) + rect.h + 3)
+    return bounds, x, y, dx, dy
+
+
+def _hit(ra: pygame.Rect, motion_a: tuple, rb: pygame.Rect, motion_b: tuple) -> bool:
+    """
+    两个精灵在这一步中是否碰撞过
+    :param ra: 精灵a的矩形
+    :param motion_a: 精灵a的运动，见_motion
+    :param rb: 精灵b的矩形
+    :param motion_b: 精灵b的运动
+    :return: 是否碰撞过
+    """
+    bounds_a, ax, ay, dx, dy = motion_a
+    bounds_b, bx, by, bdx, bdy = motion_b
+    # 这一步扫过的区域都没有重叠，不可能碰到
+    if not bounds_a.colliderect(bounds_b):
+        return False
+    dx -= bdx
+    dy -= bdy
+    # 相对位移比两个物体中较小的那个还短，不会整个穿过对方，直接比较现在的位置
+    if abs(dx) < min(ra.w, rb.w) and abs(dy) < min(ra.h, rb.h):
+        return ra.colliderect(rb)
+
+    # 把b看作不动，a的左上角从(x, y)沿(dx, dy)移动到现在的位置
+    # a与b重叠，相当于a的左上角落在以b为中心、向左上方扩大了a的大小的矩形内（开区间）
+    x = ax - dx
+    y = ay - dy
+    enter = 0.0
+    leave = 1.0
+    if dx == 0:
+        if not bx - ra.w < x < bx + rb.w:
+            return False
+    else:
+        t1 = (bx - ra.w - x) / dx
+        t2 = (bx + rb.w - x) / dx
+        if t1 > t2:
+            t1, t2 = t2, t1
+        enter = max(enter, t1)
+        leave = min(leave, t2)
+        if enter >= leave:
+            return False
+    if dy == 0:
+        if not by - ra.h < y < by + rb.h:
+            return False
+    else:
+        t1 = (by - ra.h - y) / dy
+        t2 = (by + rb.h - y) / dy
+        if t1 > t2:
+            t1, t2 = t2, t1
+        enter = max(enter, t1)
+        leave = min(leave, t2)
+        if enter >= leave:
+            return False
+    return True
+
+
+def spritecollide(sprite, group, dokill: bool) -> list:
+    """
+    与pygame.sprite.spritecollide相同，但使用扫掠碰撞检测
+    :param sprite: 精灵
+    :param group: 精灵组
+    :param dokill: 是否删除组中碰到的精灵
+    :return: 组中碰到的精灵
+    """
+    rect = sprite.rect
+    motion = _motion(sprite)
+    bounds = motion[0]
+    hits = []
+    for other in group.sprites():
+        other_motion = _motion(other)
+        if bounds.colliderect(other_motion[0]) and _hit(rect, motion, other.rect, other_motion):
+            hits.append(other)
+    if dokill:
+        for other in hits:
+            other.kill()
+    return hits
+
+
+def groupcollide(group_a, group_b, dokill_a: bool, dokill_b: bool) -> dict:
+    """
+    与pygame.sprite.groupcollide相同，但使用扫掠碰撞检测
+    每个精灵的运动只计算一次；先用Rect.collidelistall找出扫过的区域有重叠的精灵，只有它们才需要仔细检查
+    :param group_a: 精灵组a
+    :param group_b: 精灵组b
+    :param dokill_a: 是否删除a中碰到的精灵
+    :param dokill_b: 是否删除b中碰到的精灵，被删除的精灵不会再碰到a中后面的精灵
+    :return: a中碰到的精灵到它碰到的b中的精灵列表的字典
+    """
+    others = group_b.sprites()
+    motions = [_motion(other) for other in others]
+    bounds = [motion[0] for motion in motions]
+    crashed = {}
+    for sprite in group_a.sprites():
+        motion = _motion(sprite)
+        candidates = motion[0].collidelistall(bounds)
+        if not candidates:
+            continue
+        rect = sprite.rect
+        hit = [index for index in candidates if _hit(rect, motion, others[index].rect, motions[index])]
+        if not hit:
+            continue
+        crashed[sprite] = [others[index] for index in hit]
+        if dokill_b:
+            for index in hit:
+                others[index].kill()
+                bounds[index] = _NOWHERE
+        if dokill_a:
+            sprite.kill()
+    return crashed
+
+
+def chain_reaction(blasts, candidates, size: tuple[int, int]) -> list:
+    """
+    结算连锁爆炸：被爆炸炸到的精灵也会爆炸，新的爆炸又会炸到别的精灵，直到没有新的精灵被炸到为止
+    候选的精灵先按格子分好（格子与爆炸范围一样大），每个爆炸只需要检查它盖住的几个格子
+    :param blasts: 这一步产生的爆炸的中心
+    :param candidates: 可以被炸到的精灵（不要包含无敌的精灵），每个最多被炸到一次
+    :param size: 爆炸范围的(宽, 高)，爆炸范围以爆炸中心为中心
+    :return: 被炸到的精灵，按被炸到的先后顺序。它们的中心就是它们产生的爆炸的中心
+    """
+    width, height = size
+    if not blasts or width <= 0 or height <= 0:
+        return []
+    # (格子x, 格子y) -> [精灵, ...]，精灵的矩形跨过几个格子就在几个格子里各放一份
+    cells = {}
+    for sprite in candidates:
+        rect = sprite.rect
+        for cx in range(rect.left // width, (rect.right - 1) // width + 1):
+            for cy in range(rect.top // height, (rect.bottom - 1) // height + 1):
+                cells.setdefault((cx, cy), []).append(sprite)
+    if not cells:
+        return []
+    hit = []
+    done = set()
+    queue = deque(blasts)
+    blast = pygame.Rect(0, 0, width, height)
+    while queue:
+        blast.center = queue.popleft()
+        for cx in range(blast.left // width, (blast.right - 1) // width + 1):
+            for cy in range(blast.top // height, (blast.bottom - 1) // height + 1):
+                for sprite in cells.get((cx, cy), ()):
+                    if sprite not in done and blast.colliderect(sprite.rect):
+                        done.add(sprite)
+                        hit.append(sprite)
+                        queue.append(sprite.rect.center)
+    return hit
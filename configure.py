@@ -14,6 +14,17 @@ PAUSE_KEY = pygame.K_e
 # 游戏物体移动计算与帧率无关，因此物体速度不会随帧率变化，帧率怎么改都无所谓
 MAX_RATE = 120
 
+# 帧率控制方式（见pacing.py）
+# "tick": 直接sleep到下一帧，与pygame.time.Clock.tick相同，帧间隔会抖动几毫秒
+# "precise": sleep到快到的时候，剩下的一点空转等待，帧间隔很准，空转占用的CPU有上限（默认）
+# "vsync": 与precise相同，但每帧对齐到屏幕刷新；纹理绘制还会开启真正的垂直同步
+FRAME_PACING = "precise"
+
+# 每秒模拟多少步
+# 游戏的模拟（移动，碰撞，开火等）按这个固定的频率进行，与帧率无关，绘制时会在两步之间插值
+# 帧率比它高时画面依然平滑，帧率比它低时游戏结果也不会改变
+SIM_RATE = 60
+
 # 显示帧率的按键
 # 游戏中按下该按键左上角显示帧率
 FPS_KEY = pygame.K_q
@@ -33,3 +44,70 @@ FULL_KEY = pygame.K_f
 # 追踪攻击按键
 # 追踪弹仅能在打Boss时释放
 CHASE_KEY = pygame.K_c
+
+# 倒带按键
+# 仅在Bug模式下可用，每按一次回到大约半秒之前的状态
+REWIND_KEY = pygame.K_r
+
+# 回到Boss放技能之前的按键
+# 仅在Bug模式下可用，回到Boss最近一次放技能之前的状态，方便反复练习或调试同一个技能
+CHECKPOINT_KEY = pygame.K_t
+
+# 每隔多少步模拟（见SIM_RATE）记录一次游戏状态快照，用于倒带，回到Boss放技能之前，以及查找卡顿开始的时间
+SNAPSHOT_INTERVAL = 30
+
+# 最多保存多少个快照，保存的快照越多，能倒带的时间越长
+SNAPSHOT_COUNT = 64
+
+# 卡顿的阈值，单位：毫秒
+# 记录快照时，如果上次快照以来最慢的一帧超过这么久，就在保存的快照中查找是从什么时候开始卡的，并写进日志
+# None: 不检查卡顿
+SPIKE_THRESHOLD = 50
+
+# 观战服务器端口
+# None: 不开启观战 数字：在该端口上等待观战者连接，观战者运行 python spectator.py 游戏所在电脑的地址 端口 即可观战
+SPECTATOR_PORT = None
+
+# 时间线记录文件
+# None: 不记录 文件名：把游戏循环每个阶段的耗时记录到该文件中，可以用 chrome://tracing 或 Perfetto 打开查看
+TRACE_FILE = None
+
+# 绘制后端
+# "software": 在窗口的画布上直接绘制，只更新变化的区域（默认）
+# "texture": 使用SDL的Renderer与纹理绘制，图片只上传一次，每帧整屏重画
+RENDER_BACKEND = "software"
+# 纹理绘制使用的SDL渲染器，比如"software"，"opengl"，None: 由SDL自动选择
+RENDER_DRIVER = None
+
+# 日志
+# 默认级别，可选 "debug", "info", "warning", "error"，None: 关闭所有日志
+LOG_LEVEL = "info"
+# 单独设置某些模块的级别，比如 {"main": "debug", "resource": None}，None表示关闭该模块的日志
+LOG_MODULES = {}
+# 日志文件，None: 写到标准错误
+LOG_FILE = None
+
+# 录像按键
+# 游戏中按下该按键开始录像，再按一次停止
+CAPTURE_KEY = pygame.K_F12
+# 录像存放的目录，每次录像会在其中新建一个以时间命名的目录
+CAPTURE_DIR = "captures"
+# 录像格式 "png": 每帧一张PNG图片 "raw": 所有帧的原始像素连续写进一个文件，可以用ffmpeg转成视频
+CAPTURE_FORMAT = "png"
+# 是否在游戏启动时就开始录像（没有显示器时录像用）
+CAPTURE_ON_START = False
+
+# 战绩数据库文件
+# 每局的得分，存活时间，死因等会记录在这个SQLite数据库里，用 python stats.py 查看排行榜与统计
+# None: 不记录
+STATS_FILE = "stats.db"
+
+# 分进程模式
+# True: 模拟在子进程中运行，主进程只负责输入与绘制，两者通过共享内存交换画面，可以同时用上两个CPU核心
+# False: 模拟与绘制都在同一个进程里（默认）
+SPLIT_PROCESS = False
+
+# 自动驾驶
+# True: 由内置的机器人控制移动与开火，一局结束后自动重玩，用于无人值守的长时间测试（见autopilot.py）
+# False: 由玩家控制（默认）
+AUTOPILOT = False
@@ -0,0 +1,260 @@
+# 编队
+# 以前普通敌机只会从屏幕上方直直往下飞，而且要等上一批全部死光了才来下一批，花样很少
+# 现在可以让一队敌机沿着一条曲线飞：曲线由若干段三次贝塞尔曲线首尾相连组成
+# 载入时把曲线按弧长等距采样成一张位置表，飞行时不再计算曲线，只需要查表（相邻两个采样点之间线性插值）
+# 同一个编队的飞机速度相同，每一步由编队整体推进一次：所有成员共用同一张表，每架飞机只是在曲线上落后前一架spacing像素
+# 编队中的飞机仍然是普通的敌机（参与碰撞，开火，计分，快照），只是自己的update不再移动
+# 添加新的编队只需要写一个描述，不需要修改敌机
+#
+# 描述中可用的键：
+#   points: 控制点，格式为[起点, 控制点1, 控制点2, 终点, 控制点1, 控制点2, 终点, ...]，每多三个点就多一段曲线
+#           坐标为飞机中心的像素坐标，起点与最后的终点一般放在屏幕外面
+#   count: 编队中有多少架飞机，默认为5
+#   spacing: 相邻两架飞机在曲线上相隔多远，单位：像素，默认为60
+#   speed: 飞行速度，单位：像素/秒，默认为200
+#   mirror: 为True时左右对称的曲线上同时再飞一队，默认为False
+#   difficulty: 从哪个难度开始出现，默认为0
+#   sample: 采样间距，单位：像素，默认为4
+import math
+import random
+
+import pygame
+
+# 把一段贝塞尔曲线近似成折线时分成多少小段，只在载入时使用
+SUBDIVISIONS = 64
+
+
+def _bezier(p0, p1, p2, p3, t: float) -> tuple[float, float]:
+    """
+    三次贝塞尔曲线上的一点
+    :param p0: 起点
+    :param p1: 控制点1
+    :param p2: 控制点2
+    :param p3: 终点
+    :param t: 参数，0为起点，1为终点
+    :return: (x, y)
+    """
+    u = 1 - t
+    a = u * u * u
+    b = 3 * u * u * t
+    c = 3 * u * t * t
+    d = t * t * t
+    return (a * p0[0] + b * p1[0] + c * p2[0] + d * p3[0],
+            a * p0[1] + b * p1[1] + c * p2[1] + d * p3[1])
+
+
+class FlightPath:
+    """
+    按弧长等距采样好的飞行路线
+    """
+
+    def __init__(self, name: str, points, sample: float = 4):
+        """
+        :param name: 路线的名称，出错时显示
+        :param points: 控制点，格式见文件开头
+        :param sample: 采样间距，单位：像素
+        """
+        if len(points) < 4 or (len(points) - 1) % 3 != 0:
+            raise ValueError(f"编队{name}的控制点数量应为3n+1（n>=1），现在是{len(points)}")
+        self.name = name
+        self.points = [tuple(point) for point in points]
+        self.sample = sample
+        # 先把曲线近似成很密的折线，并算出走到每个折点时走过的距离
+        polyline = [self.points[0]]
+        for start in range(0, len(self.points) - 1, 3):
+            p0, p1, p2, p3 = self.points[start:start + 4]
+            polyline.extend(_bezier(p0, p1, p2, p3, i / SUBDIVISIONS) for i in range(1, SUBDIVISIONS + 1))
+        lengths = [0.0]
+        for (x0, y0), (x1, y1) in zip(polyline, polyline[1:]):
+            lengths.append(lengths[-1] + math.hypot(x1 - x0, y1 - y0))
+        # 曲线的总长度，单位：像素
+        self.length = lengths[-1]
+        # 再沿着折线每隔sample像素取一个点，这就是位置表
+        self.xs = []
+        self.ys = []
+        segment = 0
+        for index in range(int(self.length / sample) + 1):
+            distance = index * sample
+            while segment < len(lengths) - 2 and lengths[segment + 1] < distance:
+                segment += 1
+            span = lengths[segment + 1] - lengths[segment]
+            t = (distance - lengths[segment]) / span if span else 0
+            (x0, y0), (x1, y1) = polyline[segment], polyline[segment + 1]
+            self.xs.append(x0 + (x1 - x0) * t)
+            self.ys.append(y0 + (y1 - y0) * t)
+        # 查表时用乘法代替除法
+        self.scale = 1 / sample
+        # 最后一个可以往后插值的下标
+        self.last = len(self.xs) - 2
+
+    def mirrored(self, width: float):
+        """
+        左右对称的路线
+        :param width: 屏幕的宽度
+        :return: 新的FlightPath
+        """
+        return FlightPath(self.name + " (mirror)", [(width - x, y) for x, y in self.points], self.sample)
+
+    def position(self, distance: float) -> tuple[float, float]:
+        """
+        沿路线走过distance像素之后所在的位置，超出两端时停在端点上
+        :param distance: 走过的距离，单位：像素
+        :return: (x, y)
+        """
+        scaled = min(max(distance, 0) * self.scale, self.last + 1)
+        index = min(int(scaled), self.last)
+        fraction = scaled - index
+        return (self.xs[index] + (self.xs[index + 1] - self.xs[index]) * fraction,
+                self.ys[index] + (self.ys[index + 1] - self.ys[index]) * fraction)
+
+
+class FormationType:
+    """
+    编译好的编队描述
+    """
+
+    def __init__(self, name: str, definition: dict, width: float):
+        """
+        :param name: 编队的名称，出错时显示
+        :param definition: 编队的描述，见文件开头
+        :param width: 屏幕的宽度，生成对称的路线时使用
+        """
+        if "points" not in definition:
+            raise ValueError(f"编队{name}没有控制点")
+        self.name = name
+        self.count = definition.get("count", 5)
+        self.spacing = definition.get("spacing", 60)
+        self.speed = definition.get("speed", 200)
+        self.difficulty = definition.get("difficulty", 0)
+        path = FlightPath(name, definition["points"], definition.get("sample", 4))
+        self.paths = [path, path.mirrored(width)] if definition.get("mirror", False) else [path]
+
+
+class Formation(pygame.sprite.Group):
+    """
+    一个正在飞行的编队，本身是一个精灵组，里面是它的所有成员
+    每个成员有自己的distance属性：沿路线走过的距离，还没有入场的成员为负数
+    成员被击落后自然离开这个组；倒带时会随着快照重新加回来，distance也一起恢复
+    """
+
+    def __init__(self, path: FlightPath, speed: float):
+        """
+        :param path: 飞行路线
+        :param speed: 飞行速度，单位：像素/秒
+        """
+        super().__init__()
+        self.path = path
+        self.speed = speed
+
+    def step(self, dt: float) -> None:
+        """
+        整个编队沿路线推进一步，飞完全程的成员会被删除
+        :param dt: 经过的时间，单位：秒
+        :return: 无
+        """
+        advance = self.speed * dt
+        path = self.path
+        xs = path.xs
+        ys = path.ys
+        scale = path.scale
+        last = path.last
+        for member in self.sprites():
+            distance = member.distance + advance
+            member.distance = distance
+            if distance < 0:
+                # 还没轮到它入场，在起点等着
+                continue
+            scaled = distance * scale
+            index = int(scaled)
+            if index > last:
+                member.kill()
+                continue
+            fraction = scaled - index
+            member.set_position(xs[index] + (xs[index + 1] - xs[index]) * fraction - member.half_width,
+                                ys[index] + (ys[index + 1] - ys[index]) * fraction - member.half_height)
+
+
+class Flights:
+    """
+    场上所有正在飞行的编队
+    用法：
+        flights.launch(编队, 创建一架飞机的函数, *精灵组)   # 出一波编队
+        flights.step(dt)                                      # 每步一次，在所有精灵update之前
+    """
+
+    def __init__(self):
+        self.formations = []
+
+    def __len__(self) -> int:
+        return len(self.formations)
+
+    def launch(self, formation_type: FormationType, create, *groups) -> list:
+        """
+        让一个编队入场：每条路线上飞一队
+        :param formation_type: 编译好的编队
+        :param create: 创建一架飞机的函数，参数为(飞机所属的编队, 飞机中心)，返回还没有加入任何组的飞机
+                       飞机需要有distance，half_width与half_height属性
+        :param groups: 飞机还要加入的组
+        :return: 所有飞机
+        """
+        members = []
+        for path in formation_type.paths:
+            formation = Formation(path, formation_type.speed)
+            start = path.position(0)
+            for index in range(formation_type.count):
+                member = create(formation, start)
+                member.distance = -index * formation_type.spacing
+                members.append(member)
+            formation.add(members[-formation_type.count:])
+            self.formations.append(formation)
+        for group in groups:
+            group.add(members)
+        return members
+
+    def step(self, dt: float) -> None:
+        """
+        推进所有编队，并丢掉已经没有成员的编队
+        :param dt: 经过的时间，单位：秒
+        :return: 无
+        """
+        for formation in self.formations:
+            formation.step(dt)
+        self.formations = [formation for formation in self.formations if formation]
+
+    def restore(self, enemies) -> None:
+        """
+        倒带之后调用：成员随快照回到了编队里，但编队本身可能已经被丢掉了，这里按成员重新找回来
+        :param enemies: 所有敌机
+        :return: 无
+        """
+        self.formations = list({sprite.formation: None for sprite in enemies
+                                if getattr(sprite, "formation", None) is not None})
+
+    def clear(self) -> None:
+        """
+        丢掉所有编队，新开一局时使用
+        :return: 无
+        """
+        self.formations = []
+
+
+def compile_formations(definitions: dict, width: float) -> dict:
+    """
+    编译一组编队
+    :param definitions: 编队名称到描述的字典
+    :param width: 屏幕的宽度
+    :return: 编队名称到FormationType的字典
+    """
+    return {name: FormationType(name, definition, width) for name, definition in definitions.items()}
+
+
+def choose(formations: dict, difficulty: int, rng=random):
+    """
+    随机选一个这个难度下可以出现的编队
+    :param formations: compile_formations的返回值
+    :param difficulty: 当前难度
+    :param rng: 随机数生成器
+    :return: FormationType，没有可以出现的编队时为None
+    """
+    available = [one for one in formations.values() if one.difficulty <= difficulty]
+    return rng.choice(available) if available else None
@@ -0,0 +1,207 @@
+# 输入来源
+# 以前游戏循环只从事件队列里取QUIT与KEYDOWN，MOUSEBUTTONUP要等重玩按钮出现时才有人取，鼠标移动等其他事件从来没人取，
+# 玩着玩着SDL的事件队列就满了；移动与开火则是在模拟时另外用pygame.key.get_pressed查询
+# 现在每帧开始时调用一次MainApp.input.pump()，把队列里的事件一次取完并分类：
+#   quit：这一帧有没有收到退出事件
+#   key_downs：这一帧按下的键，按顺序
+#   clicks：这一帧鼠标松开的按键与位置，交给按钮处理（见widget.Button.handle）
+#   keys()与mouse()：按住的键与鼠标按键，由按下/松开事件维护，不再另外查询
+# 输入可以来自两个地方：
+#   LocalInput：本进程的事件队列
+#   RemoteInput：分进程模式下模拟进程使用，事件在绘制进程里取出，通过管道发过来（见split.py）
+#
+# 同时记录输入延迟：从取出一个按键/鼠标事件，到第一次显示出它的效果的那一帧显示出来，经过了多久（见LatencyMeter）
+import time
+from collections import deque
+
+import pygame
+
+# 需要转发给模拟进程的事件，其他事件（窗口，鼠标移动等）只在绘制进程里处理
+FORWARDED_EVENTS = (pygame.QUIT, pygame.KEYDOWN, pygame.KEYUP, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP,
+                    pygame.WINDOWFOCUSLOST)
+
+
+class HeldKeys(set):
+    """
+    按住的键，可以和pygame.key.get_pressed()的结果一样用键码取下标
+    """
+
+    def __getitem__(self, key: int) -> bool:
+        return key in self
+
+
+class LatencyMeter:
+    """
+    输入延迟统计
+    pygame 2的事件不带SDL的时间戳，所以从事件被取出的时间算起，事件在队列中等待的时间（最多一帧）不计入
+    用法：
+        取出事件时调用arrived
+        事件生效时（模拟推进了一步，或者暂停/结束界面处理了它）调用consume
+        这一帧显示出来之后调用presented，得到这一帧显示出效果的所有输入的延迟
+    """
+
+    def __init__(self, capacity: int = 1024):
+        """
+        :param capacity: 最多保留最近多少次输入的延迟
+        """
+        # 还没有生效的输入被取出的时间，time.perf_counter()
+        self.waiting = []
+        # 已经生效，等着被显示出来的输入
+        self.consumed = []
+        # 最近的延迟，单位：毫秒
+        self.samples = deque(maxlen=capacity)
+
+    def arrived(self, arrived_at: float) -> None:
+        """
+        记录一个输入
+        :param arrived_at: 取出事件的时间，time.perf_counter()
+        :return: 无
+        """
+        self.waiting.append(arrived_at)
+
+    def consume(self) -> None:
+        """
+        目前所有的输入都已经生效，下一次显示的画面就会体现出来
+        :return: 无
+        """
+        if self.waiting:
+            self.consumed.extend(self.waiting)
+            self.waiting.clear()
+
+    def presented(self) -> list[float]:
+        """
+        这一帧已经显示出来了
+        :return: 这一帧显示出效果的输入的延迟，单位：毫秒
+        """
+        if not self.consumed:
+            return []
+        now = time.perf_counter()
+        latencies = [(now - arrived_at) * 1000 for arrived_at in self.consumed]
+        self.consumed.clear()
+        self.samples.extend(latencies)
+        return latencies
+
+    def summary(self):
+        """
+        最近的输入延迟
+        :return: (次数, 中位数, 95%分位数, 最大值)，单位：毫秒，没有记录时为None
+        """
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return (len(ordered), ordered[len(ordered) // 2], ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)],
+                ordered[-1])
+
+
+class InputSource:
+    """
+    输入来源的基类，负责把事件分类，子类只需要实现_drain
+    基类本身没有事件来源，_drain返回空列表；自己决定按键的来源（比如autopilot.Autopilot）可以不实现_drain
+    """
+
+    def __init__(self):
+        self.held = HeldKeys()
+        self.buttons = [False, False, False]
+        self.quit = False
+        self.key_downs = []
+        self.clicks = []
+        self.latency = LatencyMeter()
+
+    def _drain(self):
+        """
+        取出这一帧的所有事件
+        :return: 每项为(事件, 取出的时间)
+        """
+        return []
+
+    def pump(self) -> None:
+        """
+        每帧开始时调用一次：取出所有事件并分类，上一帧的分类结果会被清空
+        :return: 无
+        """
+        self.quit = False
+        self.key_downs = []
+        self.clicks = []
+        for event, arrived_at in self._drain():
+            event_type = event.type
+            if event_type == pygame.KEYDOWN:
+                self.held.add(event.key)
+                self.key_downs.append(event.key)
+                self.latency.arrived(arrived_at)
+            elif event_type == pygame.KEYUP:
+                self.held.discard(event.key)
+                self.latency.arrived(arrived_at)
+            elif event_type == pygame.MOUSEBUTTONDOWN:
+                if 1 <= event.button <= 3:
+                    self.buttons[event.button - 1] = True
+                self.latency.arrived(arrived_at)
+            elif event_type == pygame.MOUSEBUTTONUP:
+                if 1 <= event.button <= 3:
+                    self.buttons[event.button - 1] = False
+                self.clicks.append((event.button, event.pos))
+                self.latency.arrived(arrived_at)
+            elif event_type == pygame.QUIT:
+                self.quit = True
+            elif event_type == pygame.WINDOWFOCUSLOST:
+                # 窗口失去焦点后收不到松开的事件，全部当作松开
+                self.held.clear()
+                self.buttons = [False, False, False]
+
+    def keys(self) -> HeldKeys:
+        """
+        :return: 现在按着哪些键，用键码取下标
+        """
+        return self.held
+
+    def mouse(self) -> list[bool]:
+        """
+        :return: 鼠标左，中，右键是否按着
+        """
+        return self.buttons
+
+
+class LocalInput(InputSource):
+    """
+    本进程的键盘与鼠标
+    """
+
+    def _drain(self):
+        now = time.perf_counter()
+        return [(event, now) for event in pygame.event.get()]
+
+
+class RemoteInput(InputSource):
+    """
+    从管道另一头发过来的键盘与鼠标
+    每条消息是一个事件列表，每项为(事件类型, 事件属性的字典, 取出的时间)，见encode_events
+    time.perf_counter在同一台电脑的不同进程之间是可以比较的，所以输入延迟从绘制进程取出事件时算起
+    """
+
+    def __init__(self, connection):
+        """
+        :param connection: multiprocessing的管道的接收端
+        """
+        super().__init__()
+        self.connection = connection
+
+    def _drain(self):
+        # 管道断开（绘制进程退出了）时当作收到了退出事件
+        events = []
+        try:
+            while self.connection.poll():
+                events.extend((pygame.event.Event(event_type, attributes), arrived_at)
+                              for event_type, attributes, arrived_at in self.connection.recv())
+        except (EOFError, OSError):
+            events.append((pygame.event.Event(pygame.QUIT), time.perf_counter()))
+        return events
+
+
+def encode_events(events, arrived_at: float) -> list[tuple[int, dict, float]]:
+    """
+    挑出需要转发的事件，转换成可以通过管道发送的形式
+    :param events: pygame的事件
+    :param arrived_at: 取出这些事件的时间，time.perf_counter()
+    :return: 每项为(事件类型, 事件属性的字典, 取出的时间)
+    """
+    return [(event.type, {name: value for name, value in event.dict.items() if name != "window"}, arrived_at)
+            for event in events if event.type in FORWARDED_EVENTS]
@@ -0,0 +1,225 @@
+# 日志
+# 以前到处直接print，每一帧都往终端写东西，终端慢的时候整个游戏都跟着卡
+# 现在：记录日志时只把(时间, 级别, 模块, 格式, 参数)放进内存里的环形缓冲区，格式化与写出都由后台线程完成
+# 每个模块有自己的开关与级别，被关掉的日志调用只多一次属性比较
+# 用法：
+#     logger = log.get_logger("main")
+#     logger.debug("追踪弹冷却: %.2f", cd)   # 参数在后台线程中才会格式化
+import atexit
+import sys
+import threading
+import time
+from collections import deque
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+# 比所有级别都高，设置为这个级别相当于关闭该模块的日志
+OFF = 100
+
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR", OFF: "OFF"}
+
+
+def parse_level(level) -> int:
+    """
+    把级别名称转换为级别
+    :param level: 级别，可以是整数，名称（不区分大小写），或者None（表示关闭）
+    :return: 级别
+    """
+    if level is None:
+        return OFF
+    if isinstance(level, int):
+        return level
+    for value, name in LEVEL_NAMES.items():
+        if name == level.upper():
+            return value
+    raise ValueError(f"没有名为{level}的日志级别")
+
+
+class Logger:
+    """
+    一个模块的日志记录器，请使用get_logger获取
+    """
+
+    def __init__(self, name: str, level: int):
+        """
+        :param name: 模块名
+        :param level: 低于这个级别的日志不会被记录
+        """
+        self.name = name
+        self.level = level
+
+    def log(self, level: int, message: str, *args) -> None:
+        """
+        记录一条日志
+        :param level: 级别
+        :param message: 内容，可以包含%格式，由args填充
+        :param args: 格式参数
+        :return: 无
+        """
+        if level < self.level:
+            return
+        WRITER.push((time.time(), level, self.name, message, args))
+
+    def debug(self, message: str, *args) -> None:
+        """记录一条调试日志，参数同log"""
+        if DEBUG < self.level:
+            return
+        WRITER.push((time.time(), DEBUG, self.name, message, args))
+
+    def info(self, message: str, *args) -> None:
+        """记录一条普通日志，参数同log"""
+        if INFO < self.level:
+            return
+        WRITER.push((time.time(), INFO, self.name, message, args))
+
+    def warning(self, message: str, *args) -> None:
+        """记录一条警告，参数同log"""
+        if WARNING < self.level:
+            return
+        WRITER.push((time.time(), WARNING, self.name, message, args))
+
+    def error(self, message: str, *args) -> None:
+        """记录一条错误，参数同log"""
+        if ERROR < self.level:
+            return
+        WRITER.push((time.time(), ERROR, self.name, message, args))
+
+
+class LogWriter:
+    """
+    后台写日志的线程
+    记录先放进固定大小的环形缓冲区（deque的append与popleft是线程安全的，不需要加锁），
+    写得不够快时最旧的记录会被丢掉，而不是让游戏等待
+    """
+
+    def __init__(self, capacity: int = 4096, flush_interval: float = 0.2):
+        """
+        :param capacity: 缓冲区最多存放多少条记录
+        :param flush_interval: 最多隔这么多秒写一次
+        """
+        self.buffer = deque(maxlen=capacity)
+        self.flush_interval = flush_interval
+        self.stream = sys.stderr
+        self.wake = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def push(self, record: tuple) -> None:
+        """
+        放入一条记录，第一次放入时启动后台线程
+        :param record: (时间, 级别, 模块, 格式, 参数)
+        :return: 无
+        """
+        self.buffer.append(record)
+        if self.thread is None:
+            self.start()
+
+    def start(self) -> None:
+        """
+        启动后台线程
+        :return: 无
+        """
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._write_loop, name="log writer", daemon=True)
+                self.thread.start()
+
+    def set_stream(self, stream) -> None:
+        """
+        更改日志写到哪里
+        :param stream: 有write与flush方法的对象，比如打开的文件
+        :return: 无
+        """
+        self.flush()
+        self.stream = stream
+
+    def _write_loop(self) -> None:
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
+
+    @staticmethod
+    def format(record: tuple) -> str:
+        created, level, name, message, args = record
+        if args:
+            try:
+                message = message % args
+            except (TypeError, ValueError):
+                message = f"{message} {args}"
+        clock = time.strftime("%H:%M:%S", time.localtime(created))
+        return f"{clock}.{int(created % 1 * 1000):03d} {LEVEL_NAMES.get(level, level)} {name}: {message}\n"
+
+    def flush(self) -> None:
+        """
+        把缓冲区中的记录全部写出
+        :return: 无
+        """
+        buffer = self.buffer
+        lines = []
+        while buffer:
+            lines.append(self.format(buffer.popleft()))
+        if lines:
+            with self.lock:
+                self.stream.write("".join(lines))
+                self.stream.flush()
+
+
+WRITER = LogWriter()
+# 程序退出前把还没写出的日志写完
+atexit.register(WRITER.flush)
+
+# 所有模块的日志记录器
+_loggers = {}
+# 没有单独设置的模块使用的级别
+_default_level = INFO
+# 单独设置过级别的模块
+_module_levels = {}
+
+
+def get_logger(name: str) -> Logger:
+    """
+    获取模块的日志记录器
+    :param name: 模块名，一般传入__name__
+    :return: 日志记录器
+    """
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = _loggers[name] = Logger(name, _module_levels.get(name, _default_level))
+    return logger
+
+
+def set_level(level, name: str = None) -> None:
+    """
+    设置日志级别
+    :param level: 级别，见parse_level
+    :param name: 模块名，为None时设置所有没有单独设置过的模块
+    :return: 无
+    """
+    global _default_level
+    level = parse_level(level)
+    if name is None:
+        _default_level = level
+        for logger in _loggers.values():
+            if logger.name not in _module_levels:
+                logger.level = level
+    else:
+        _module_levels[name] = level
+        get_logger(name).level = level
+
+
+def configure(level=INFO, modules: dict = None, file: str = None) -> None:
+    """
+    一次性设置所有日志选项
+    :param level: 默认级别
+    :param modules: 模块名到级别的字典，级别为None表示关闭该模块的日志
+    :param file: 日志文件，为None时写到标准错误
+    :return: 无
+    """
+    set_level(level)
+    for name, module_level in (modules or {}).items():
+        set_level(module_level, name)
+    if file is not None:
+        WRITER.set_stream(open(file, "a", encoding="utf-8"))
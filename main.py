@@ -1,3 +1,4 @@
+import itertools
 import math
 import random
 import threading
@@ -5,10 +6,31 @@ import time
 
 import pygame.sprite
 
+import animation
+import autopilot
+import capture
+import collision
+import formation
+import inputs
+import log
+import pacing
+import particle
+import pattern
+import quality
+import render
 import resource
+import snapshot
+import spatial
+import spectator
+import split
+import stats
+import timestep
+import tracing
 import widget
 from configure import *
 
+logger = log.get_logger("main")
+
 if not pygame.get_init():
     pygame.init()
 # 窗口的尺寸（宽，高）
@@ -26,15 +48,49 @@ DIFFICULTY = {0: {'speed': (150, 200), "batch": (1, 3), "full_time": 0.5, "fire"
               3: {'speed': (175, 250), "batch": (3, 5), "full_time": 0.25, "fire": True, "chase": True},
               }
 
+# Boss的弹幕，描述的格式见pattern.py
+BOSS_PATTERNS = pattern.compile_patterns({
+    # 向四周发射18颗火球
+    "fire_balls": {"kind": "ring", "count": 18, "angle": 0},
+    # 从三个位置向玩家连发25轮子弹
+    "many_bullets": {"kind": "aimed", "offsets": [(-30, 0), (0, 0), (30, 0)], "volleys": 25, "interval": 0.05},
+})
+
+# 敌机编队，描述的格式见formation.py
+FORMATIONS = formation.compile_formations({
+    # 从左上方斜插进来，在屏幕中间兜一个弯，从右边飞走，右边对称地再来一队
+    "swoop": {"points": [(-60, 60), (200, 20), (360, 420), (700, 260)], "count": 5, "spacing": 70, "speed": 220,
+              "mirror": True},
+    # 从上方正中俯冲下来，左右各绕一个圈，再从下方飞走
+    "loop": {"points": [(320, -60), (320, 220), (100, 320), (100, 160), (100, 0), (540, 0), (540, 160),
+                        (540, 320), (320, 220), (320, 560)], "count": 6, "spacing": 65, "speed": 240},
+    # 从左边进场，走两级台阶，从右边飞走
+    "stairs": {"points": [(-60, 60), (220, 60), (200, 180), (320, 180), (440, 180), (420, 300), (700, 300)],
+               "count": 6, "spacing": 60, "speed": 260, "difficulty": 1},
+}, SCREEN_RECT.width)
+# 一波敌机全部消灭之后，下一波是编队的概率
+FORMATION_CHANCE = 0.35
+
+# 什么都不画的空图片，需要隐藏某个精灵的时候用
+EMPTY_SURFACE = pygame.Surface((0, 0))
+# 给每个精灵分配一个编号，观战服务器用它区分不同的精灵
+SERIALS = itertools.count()
+
 
 class CommonSprite(pygame.sprite.Sprite):
     """
     该游戏中所有sprite的基类，支持每隔一段时间轮播图片
+    精灵的位置以浮点数的左上角坐标self.x，self.y为准，self.rect只是它取整后的结果，用于碰撞检测与绘制
+    以前直接移动整数的rect，每一步不足一像素的部分都被截掉，慢的东西走不动，Boss左右飘的时候一顿一顿的
+    移动精灵请用move_by或set_position；直接修改了rect的话，要调用sync_position让浮点位置跟上
     """
+    # 记录快照（见snapshot.py）时，除了位置之外还需要保存的属性
+    state_fields = ()
 
     def __init__(self, images, center, change_time: float = None, *group):
         """
         创建一个sprite，并在图片多于一张时每change_time更换一次图片
+        图片的轮播由全局的动画时钟animation.CLOCK统一负责，只有一张图片的精灵不参与轮播
         注意：每张图片的尺寸最好相同，不然会出现碰撞体积和图片看起来不一样的情况
         :param images: 该精灵的图片，必须是一个列表，可以只有一张。多于一张时图片将会轮播
         :param center: 修正精灵的中心坐标。精灵碰撞矩形的中心会在这里
@@ -42,41 +98,71 @@ class CommonSprite(pygame.sprite.Sprite):
         :param group: 该精灵所要添加到的组，可以有任意多个
         """
         super().__init__(*group)
+        self.serial = next(SERIALS)
         if isinstance(images, pygame.Surface):
             images = [images]
         self.images = images
-        self.image_number = 0
-        self.image = images[self.image_number]
+        self.image = images[0]
         self.rect = self.image.get_rect()
-        self.rect.center = center
-        # 每隔多久轮播一次图片，单位：秒
-        if not isinstance(change_time, float):
-            self.total_change_time = 0.2
-        else:
-            self.total_change_time = change_time
-        self.change_time = self.total_change_time
+        self.set_position(center[0] - self.rect.width / 2, center[1] - self.rect.height / 2)
+        if len(images) > 1:
+            # 每隔多久轮播一次图片，单位：秒
+            if not isinstance(change_time, float):
+                change_time = 0.2
+            animation.CLOCK.register(self, animation.get_track(images, change_time))
+
+    def move_by(self, dx: float, dy: float) -> None:
+        """
+        移动精灵，不足一像素的部分会累积下来
+        :param dx: x方向移动的距离，单位：像素
+        :param dy: y方向移动的距离，单位：像素
+        :return: 无
+        """
+        self.x += dx
+        self.y += dy
+        self.rect.topleft = (round(self.x), round(self.y))
 
-    def update(self, dt, *args) -> None:
+    def set_position(self, x: float, y: float) -> None:
         """
-        该方法应当被每帧调用以更新图片
-        :param dt: 距离上次调用的间隔（秒）
-        :return:无
+        把精灵的左上角放到(x, y)
+        :param x: x坐标
+        :param y: y坐标
+        :return: 无
         """
-        if len(self.images) == 1:
-            return
-        self.change_time -= dt
-        if self.change_time <= 0:
-            self.change_time = self.total_change_time
-            self.image_number = (self.image_number + 1) % len(self.images)
-            self.image = self.images[self.image_number]
+        self.x = x
+        self.y = y
+        self.rect.topleft = (round(x), round(y))
+
+    def sync_position(self) -> None:
+        """
+        直接修改了rect（改中心，贴边等）之后调用，让浮点位置与rect一致
+        :return: 无
+        """
+        self.x, self.y = self.rect.topleft
+
+    def get_state(self) -> tuple:
+        """
+        读出记录快照时需要保存的属性
+        :return: 由state_fields中的属性组成的元组
+        """
+        return snapshot.get_state(self)
+
+    def set_state(self, state: tuple) -> None:
+        """
+        把快照中保存的属性写回自己
+        :param state: get_state的返回值
+        :return: 无
+        """
+        snapshot.set_state(self, state)
 
 
 class Player(CommonSprite):
     """
     代表玩家的飞机
     """
+    state_fields = ('speed', 'fire_cd', 'total_fire_cd', 'chase_cd', 'total_chase_cd')
 
-    def __init__(self, images, center, fire=None, *group):
+    def __init__(self, images, center, exhaust: particle.ParticleBuffer = None, *group):
         super().__init__(images, center, None, *group)
         # 减小玩家的碰撞箱，降低撞到敌机的可能
         self.rect.width = 60
@@ -84,11 +170,11 @@ class Player(CommonSprite):
         # 图片视觉上中心与rect中心不一致，需要修正rect的位置
         # 记住！！更改飞机图片后要再次校准！
         self.rect.centerx += 15
+        self.sync_position()
         # 速度：300像素每秒
         self.speed = 300
-        # 飞机的尾焰，在飞机向上飞行时才会出现
-        # 注意：更改尾焰图片后要再次校准！
-        self.fire_sprite = CommonSprite([fire], (self.rect.centerx, self.rect.centery + 35))
+        # 飞机的尾焰粒子，在飞机向上飞行时才会喷出
+        self.exhaust = exhaust
         # 开火cd，单位：秒
         self.total_fire_cd = 0.25
         self.fire_cd = 0
@@ -108,24 +194,15 @@ class Player(CommonSprite):
         """
         vertical_direction = 1 if vertical_direction > 0 else -1 if vertical_direction < 0 else 0
         horizontal_direction = 1 if horizontal_direction > 0 else -1 if horizontal_direction < 0 else 0
-        self.rect.move_ip(self.speed * vertical_direction * dt, self.speed * horizontal_direction * dt)
-        # clamp是指把自己的矩形限制在屏幕矩形内，可以防止自己飞出屏幕
-        self.rect = self.rect.clamp(SCREEN_RECT)
-        # 如果飞机在向上飞，就渲染尾焰
-        if horizontal_direction == -1:
-            self.groups()[0].add(self.fire_sprite)
-            self.fire_sprite.rect.centerx = self.rect.centerx + 30
-            self.fire_sprite.rect.centery = self.rect.centery + 75
-        # 飞机不向上飞了，把尾焰从渲染组(all_objects)里移除掉
-        else:
-            self.groups()[0].remove(self.fire_sprite)
-
-    def kill(self):
-        # 玩家死亡时，把尾焰也移除掉
-        # 不然向上飞行的时候死掉会有个尾焰留下来
-        self.fire_sprite.kill()
-        # 必须先干掉尾焰，再干掉自己
-        super().kill()
+        # 把自己的矩形限制在屏幕矩形内，可以防止自己飞出屏幕
+        self.set_position(min(max(self.x + self.speed * vertical_direction * dt, SCREEN_RECT.left),
+                              SCREEN_RECT.right - self.rect.width),
+                          min(max(self.y + self.speed * horizontal_direction * dt, SCREEN_RECT.top),
+                              SCREEN_RECT.bottom - self.rect.height))
+        # 如果飞机在向上飞，就从飞机尾部向下喷出尾焰
+        # 注意：更改飞机或尾焰图片后要再次校准喷出的位置！
+        if horizontal_direction == -1 and self.exhaust is not None:
+            self.exhaust.burst(self.rect.centerx + 30, self.rect.centery + 65, 2, (150, 250), (0.08, 0.15), 90, 20)
 
     def fire(self, images, *group) -> None:
         """
@@ -139,22 +216,29 @@ class Player(CommonSprite):
             # 生成子弹
             PlayerBullet(images, self.rect.midtop, *group)
 
-    def chase_fire(self, images, *group) -> None:
+    def chase_fire(self, images, targets: spatial.NearestGrid, *group) -> None:
+        """
+        我方发射追踪弹
+        :param images: 追踪弹图片
+        :param targets: 追踪弹可以选择的目标
+        :param group: 追踪弹所要添加到的组，可以有任意多个
+        :return: 无
+        """
         if self.chase_cd <= 0:
             self.chase_cd = self.total_chase_cd
-            ChaseBullet(images, self.rect.midtop, *group)
+            ChaseBullet(images, self.rect.midtop, targets, *group)
 
     def update(self, dt, *args):
-        super().update(dt, *args)
         self.fire_cd -= dt
         self.chase_cd -= dt
-        print(self.chase_cd)
+        logger.debug("追踪弹冷却: %.2f", self.chase_cd)
 
 
 class Enemy(CommonSprite):
     """
     代表敌人的飞机
     """
+    state_fields = ('speed', 'full_time', 'fire_cd', 'total_fire_cd', 'chase', 'can_fire')
 
     def __init__(self, images: list[pygame.Surface], *group):
         """
@@ -181,6 +265,8 @@ class Enemy(CommonSprite):
         self.bullets = []
         # 发射的子弹是否为追踪弹
         self.chase = False
+        # 是否允许开火
+        self.can_fire = True
 
     def update(self, dt, *args) -> None:
         """
@@ -188,32 +274,24 @@ class Enemy(CommonSprite):
         :param dt: 两次调用该函数的间隔（用来计算应当移动的距离）
         :return:无
         """
-        super().update(dt, *args)
         self.full_time -= dt
         self.fire_cd -= dt
-        self.rect.move_ip(0, self.speed * dt)
+        # 校正敌机位置，防止它出现半边跑出屏幕的情况
+        self.set_position(min(max(self.x, 0), SCREEN_RECT.right - self.rect.width), max(self.y + self.speed * dt, 0))
         # 如果敌机向下飞出屏幕，就把它删掉
         if self.rect.top >= SCREEN_RECT.bottom:
             self.kill()
-        # 校正敌机位置，防止它出现半边跑出屏幕的情况
-        if self.rect.top < 0:
-            self.rect.top = 0
-        if self.rect.left < 0:
-            self.rect.left = 0
-        if self.rect.right > SCREEN_RECT.right:
-            self.rect.right = SCREEN_RECT.right
 
     def fire(self, images, *group) -> None:
         """
         敌机发射子弹。
-        如果该难度下敌机不允许发射子弹，那么spawn_simple_enemy函数会用一个接受两个参数但啥也不干的函数代替本函数，
-        以禁用开火功能
+        如果该难度下敌机不允许发射子弹，那么spawn_simple_enemy函数会把self.can_fire设为False，以禁用开火功能
         :param images: 子弹图片，需要是列表，可以只有一张。存在多张时轮播
         :param group: 子弹所要添加到的组，可以有任意多个
         :return: 无
         """
         # 当开火cd为0时，才能开火
-        if self.fire_cd <= 0:
+        if self.can_fire and self.fire_cd <= 0:
             self.fire_cd = self.total_fire_cd
             # 如果允许飞机发射追踪弹，则产生追踪弹
             if self.chase:
@@ -235,10 +313,49 @@ class Enemy(CommonSprite):
         super().kill()
 
 
+class FormationEnemy(Enemy):
+    """
+    编队中的敌机，位置由所在的编队（formation.Formation）统一推进，自己不移动，也不会被限制在屏幕内
+    """
+    state_fields = Enemy.state_fields + ('distance',)
+
+    def __init__(self, images: list[pygame.Surface], group: formation.Formation, center, difficulty: int = 0):
+        """
+        :param images: 敌机图片
+        :param group: 这架飞机所属的编队
+        :param center: 入场前所在的位置（路线的起点）
+        :param difficulty: 难度，决定开火与无敌时间，与spawn_simple_enemy一致
+        """
+        super().__init__(images)
+        self.formation = group
+        # 编队按中心查表，这里记下中心到左上角的距离
+        self.half_width = self.rect.width / 2
+        self.half_height = self.rect.height / 2
+        self.set_position(center[0] - self.half_width, center[1] - self.half_height)
+        # 沿路线走过的距离，由编队设置与推进
+        self.distance = 0
+        self.full_time = DIFFICULTY[difficulty]['full_time']
+        self.can_fire = DIFFICULTY[difficulty]['fire']
+        self.chase = DIFFICULTY[difficulty]['chase']
+        if self.chase:
+            self.total_fire_cd = self.fire_cd = 1.5
+
+    def update(self, dt, *args) -> None:
+        self.full_time -= dt
+        self.fire_cd -= dt
+
+    def fire(self, images, *group) -> None:
+        # 还没入场（在屏幕外等着）时不开火
+        if self.distance >= 0:
+            super().fire(images, *group)
+
+
 class Boss(CommonSprite):
     """
     可怕的大boss
     """
+    # 技能冷却skill_cds是每帧原地修改的列表，单独在get_state里复制
+    state_fields = ('direction', 'main_cd', 'left_limit', 'right_limit')
 
     def __init__(self, images, bullet_image, fire_ball_image, large_fireball_image, group, bullet_group,
                  no_disappear_bullet_group, boss_group, plane_images):
@@ -267,18 +384,26 @@ class Boss(CommonSprite):
         self.large_fireball_image = large_fireball_image
         self.player_position = None
         self.plane_images = plane_images
+        # 选好技能，马上要放技能之前调用，传入技能编号。主程序用它记录检查点
+        self.on_skill = None
+
+    def get_state(self) -> tuple:
+        return super().get_state() + (tuple(self.skill_cds),)
+
+    def set_state(self, state: tuple) -> None:
+        super().set_state(state[:-1])
+        self.skill_cds = list(state[-1])
 
     def update(self, dt, player_position=None, *args, **kwargs) -> None:
-        super().update(dt)
         self.player_position = player_position
-        self.rect.move_ip(random.randint(0, 200) * dt * self.direction, 0)
-        if self.rect.right >= self.right_limit:
-            self.rect.right = self.right_limit
+        x = self.x + random.randint(0, 200) * dt * self.direction
+        if x + self.rect.width >= self.right_limit:
+            x = self.right_limit - self.rect.width
             self.direction = -self.direction
-        if self.rect.left <= self.left_limit:
-            self.rect.left = self.left_limit
+        if x <= self.left_limit:
+            x = self.left_limit
             self.direction = -self.direction
-        self.rect.clamp(SCREEN_RECT)
+        self.set_position(x, self.y)
 
         for i in range(len(self.skill_cds)):
             self.skill_cds[i] -= dt
@@ -290,7 +415,10 @@ class Boss(CommonSprite):
                 available.append(i + 1)
         if available and random.random() < 0.1 and self.main_cd <= 0:
             ch = random.choice(available)
-            threading.Thread(target=self.skills[ch], daemon=True).start()
+            if self.on_skill is not None:
+                self.on_skill(ch)
+            threading.Thread(target=tracing.TRACER.wrap(self.skills[ch], f"skill {self.skills[ch].__name__}"),
+                             daemon=True).start()
             self.skill_cds[ch - 1] = self.skill_total[ch - 1]
             self.main_cd = self.total_main_cd
 
@@ -305,14 +433,32 @@ class Boss(CommonSprite):
         HardEnemyBullet(self.bullet_image, (self.rect.centerx, self.rect.centery), 1.5,
                         *self.bullet_group).speed = 300
 
+    def fire_pattern(self, bullet_pattern: pattern.BulletPattern, images) -> None:
+        """
+        发射一种弹幕，每一轮之间等待弹幕规定的时间
+        :param bullet_pattern: 编译好的弹幕，见pattern.py
+        :param images: 子弹的图片
+        :return: 无
+        """
+        def create(center, direction, speed):
+            bullet = FireBall(images, center, direction, self.boss_group)
+            bullet.speed = speed
+            return bullet
+
+        for volley in range(bullet_pattern.volleys):
+            # 这一局已经结束（Boss被移出了所有组），就不要再往重复使用的组里加子弹了
+            if not self.alive():
+                return
+            aim = pattern.aim_at(self.rect.center, self.player_position) if bullet_pattern.aimed else None
+            bullet_pattern.spawn(volley, self.rect.center, aim, create, *self.bullet_group)
+            if bullet_pattern.interval:
+                time.sleep(bullet_pattern.interval)
+
     def fire_balls(self):
         """
         发射火球
         """
-        for i in range(0, 360, 20):
-            FireBall(self.fire_ball_image, self.rect.center, (math.cos(math.radians(i)), math.sin(math.radians(i))),
-                     self.boss_group,
-                     *self.bullet_group)
+        self.fire_pattern(BOSS_PATTERNS["fire_balls"], self.fire_ball_image)
 
     def normal_attack(self):
         """
@@ -320,28 +466,15 @@ class Boss(CommonSprite):
         :return: 无
         """
         for i in range(10):
+            # 这一局已经结束（Boss被移出了所有组），就不要再往重复使用的组里加子弹了
+            if not self.alive():
+                return
             EnemyBullet(self.bullet_image, (self.rect.centerx, self.rect.centery), *self.bullet_group)
             time.sleep(0.75)
 
     def many_bullets(self):
         """发射大量子弹"""
-        for i in range(0, 25):
-            if self.player_position is not None:
-                dis = math.sqrt((self.player_position[0] - self.rect.centerx) ** 2 + (
-                        self.player_position[1] - self.rect.centery) ** 2)
-                x = (self.player_position[0] - self.rect.centerx) / dis
-                y = (self.player_position[1] - self.rect.centery) / dis
-            else:
-                x = 0
-                y = 1
-            a = FireBall(self.bullet_image, (self.rect.centerx - 30, self.rect.centery), (x, y), self.boss_group,
-                         *self.bullet_group)
-            b = FireBall(self.bullet_image, (self.rect.centerx, self.rect.centery), (x, y), self.boss_group,
-                         *self.bullet_group)
-            c = FireBall(self.bullet_image, (self.rect.centerx + 30, self.rect.centery), (x, y), self.boss_group,
-                         *self.bullet_group)
-            a.speed = b.speed = c.speed = 300
-            time.sleep(0.05)
+        self.fire_pattern(BOSS_PATTERNS["many_bullets"], self.bullet_image)
 
     def large_fireball(self):
         """
@@ -369,6 +502,7 @@ class Boss(CommonSprite):
 
 class FireBall(CommonSprite):
     """大火球！"""
+    state_fields = ('speed', 'position')
 
     def __init__(self, images, center, position, boss_group, *group):
         super().__init__(images, center, boss_group, *group)
@@ -376,13 +510,14 @@ class FireBall(CommonSprite):
         self.position = position
 
     def update(self, dt, *args) -> None:
-        super().update(dt)
-        self.rect.move_ip(self.speed * dt * self.position[0], self.speed * dt * self.position[1])
+        self.move_by(self.speed * dt * self.position[0], self.speed * dt * self.position[1])
         if self.rect.top > SCREEN_RECT.bottom or self.rect.bottom < SCREEN_RECT.top or self.rect.left > SCREEN_RECT.right or self.rect.right < SCREEN_RECT.left:
             self.kill()
 
 
 class LargeFireBall(CommonSprite):
+    state_fields = ('speed', 'stay_time', 'stay', 'towards')
+
     def __init__(self, images, center, boss, boss_group, *group):
         super().__init__(images, center, boss_group, *group)
         self.speed = 0
@@ -390,23 +525,23 @@ class LargeFireBall(CommonSprite):
         self.stay_time = 1.5
         self.stay = True
         self.boss = boss
-        self.towards = [0, 1]
+        self.towards = (0, 1)
 
     def update(self, dt, player_position=None, *args) -> None:
-        super().update(dt)
         self.stay_time -= dt
         if self.stay_time <= 0:
             if self.stay:
                 self.stay = False
-                self.towards[0] = (player_position[0] - self.rect.centerx) / math.sqrt(
-                    (player_position[0] - self.rect.centerx) ** 2 + (player_position[1] - self.rect.centery) ** 2)
-                self.towards[1] = (player_position[1] - self.rect.centery) / math.sqrt(
-                    (player_position[0] - self.rect.centerx) ** 2 + (player_position[1] - self.rect.centery) ** 2)
+                dis = math.sqrt((player_position[0] - self.rect.centerx) ** 2 +
+                                (player_position[1] - self.rect.centery) ** 2)
+                self.towards = ((player_position[0] - self.rect.centerx) / dis,
+                                (player_position[1] - self.rect.centery) / dis)
 
             self.speed += self.a * dt
-            self.rect.move_ip(self.speed * dt * self.towards[0], self.speed * dt * self.towards[1])
+            self.move_by(self.speed * dt * self.towards[0], self.speed * dt * self.towards[1])
         else:
             self.rect.update(self.boss.rect)
+            self.set_position(self.boss.x, self.boss.y)
         if self.rect.top > SCREEN_RECT.bottom:
             self.kill()
 
@@ -415,10 +550,12 @@ class BossPlane(Enemy):
     """
     Boss召唤出的小替身飞机，无敌，一段时间后自动死亡
     """
+    state_fields = Enemy.state_fields + ('live_time',)
 
     def __init__(self, images, center, boss: Boss, group, bullet_images, bullet_group):
         super().__init__(images, *group)
         self.rect.center = center
+        self.sync_position()
         self.live_time = 15
         self.boss = boss
         self.fire_cd = self.total_fire_cd = 1
@@ -434,51 +571,13 @@ class BossPlane(Enemy):
         self.fire(self.bullet_image, self.bullet_group)
 
 
-class Explosion(CommonSprite):
-    """
-    爆炸特效
-    在我方或敌方飞机坏掉的时候都会出现该特效
-    由于敌方飞机可能会叠起来出，因此爆炸特效还有个功能：爆炸特效在产生0.05s内会摧毁所有碰撞到特效的敌机
-    （问就是为了降低难度）
-    """
-
-    def __init__(self, images, center, *group):
-        """
-        创建一个爆炸特效
-        :param images: 爆炸特效图片，必须是个列表，可以只有一张。多于一张时，图片将会轮播
-        :param center: 爆炸特效的中心位置
-        :param group: 爆炸特效所要添加到的组，可以有任意多个
-        """
-        # 爆炸特效是由一张图片和它的倒过来的图片轮播产生的
-        # 轮播时间固定为0.2
-        super().__init__(images, center, 0.2, *group)
-        self.life_time = 0.5  # 单位：秒
-        # 测试中发现一个bug，由于后期飞机飞行速度过快，导致后出来的所有飞机全都被爆炸特效炸没了
-        # 所以加了一个时间限制，爆炸特效仅会在这段时间内引发连锁爆炸
-        # 剩下的0.45秒只有特效，不会再摧毁敌机
-        # 这个chain_time是在主函数里调用并判断是否要连锁爆炸的
-        self.chain_time = 0.05
-
-    def update(self, dt, *args):
-        """
-        更新爆炸特效的状态，从出现到消失
-        :param dt: 每两次调用间隔
-        :return: 无
-        """
-        super().update(dt, *args)
-        self.life_time -= dt
-        self.chain_time -= dt
-        # 如果爆炸特效的持续时间到了，就删了
-        if self.life_time <= 0:
-            self.kill()
-
-
 class PlayerBullet(CommonSprite):
     """
     我方用来击打敌方的子弹
     为啥敌我子弹要区分呢？因为它们的飞行方向不一样
     而且我方可没有追踪弹这种开挂级别的东西（
     """
+    state_fields = ('speed', 'damage')
 
     def __init__(self, images, center, *group):
         center = list(center)
@@ -491,9 +590,8 @@ class PlayerBullet(CommonSprite):
         self.damage = 1
 
     def update(self, dt, *args) -> None:
-        super().update(dt, *args)
         # 向上以每秒500像素的速度飞行
-        self.rect.move_ip(0, self.speed * dt)
+        self.move_by(0, self.speed * dt)
         # 如果飞出屏幕边界，就删了
         # 因为它只能向上飞，不存在从左/右侧离开了屏幕的情况
         if self.rect.bottom < SCREEN_RECT.top:
@@ -501,26 +599,39 @@ class PlayerBullet(CommonSprite):
 
 
 class ChaseBullet(PlayerBullet):
-    def __init__(self, images, center, *group):
+    """
+    我方的追踪弹，每一步都飞向离自己最近的敌机或Boss，没有目标时直线向上飞
+    """
+
+    def __init__(self, images, center, targets: spatial.NearestGrid, *group):
+        """
+        :param images: 追踪弹图片
+        :param center: 发射位置
+        :param targets: 可以选择的目标，由主程序每一步重建
+        :param group: 追踪弹所要添加到的组，可以有任意多个
+        """
         super().__init__(images, center, *group)
-        print(group)
+        self.targets = targets
+        logger.debug("追踪弹加入了组: %s", group)
 
-    def update(self, dt, _=None, boss_position=None, *args):
+    def update(self, dt, *args):
 
         self.damage = 50
-        if boss_position is None:
+        target = self.targets.nearest(*self.rect.center)
+        if target is None:
             super().update(dt, *args)
             return
-        else:
-            dis = math.sqrt((self.rect.centerx - boss_position[0]) ** 2 +
-                            (self.rect.centery - boss_position[1]) ** 2)
-            # 如果子弹追踪时间没有结束，就按计算出的方向移动
-            self.rect.move_ip(-self.speed * dt * (boss_position[0] - self.rect.centerx) / dis,
-                              -self.speed * dt * (boss_position[1] - self.rect.centery) / dis)
-            # 如果子弹出界就删掉
-            if self.rect.top >= SCREEN_RECT.bottom or self.rect.bottom <= SCREEN_RECT.top or \
-                    self.rect.left >= SCREEN_RECT.right or self.rect.right <= SCREEN_RECT.left:
-                self.kill()
+        target_x, target_y = target.rect.center
+        dis = math.sqrt((self.rect.centerx - target_x) ** 2 + (self.rect.centery - target_y) ** 2)
+        if dis == 0:
+            return
+        # 朝目标移动（self.speed是负数）
+        self.move_by(-self.speed * dt * (target_x - self.rect.centerx) / dis,
+                     -self.speed * dt * (target_y - self.rect.centery) / dis)
+        # 如果子弹出界就删掉
+        if self.rect.top >= SCREEN_RECT.bottom or self.rect.bottom <= SCREEN_RECT.top or \
+                self.rect.left >= SCREEN_RECT.right or self.rect.right <= SCREEN_RECT.left:
+            self.kill()
 
 
 class EnemyBullet(CommonSprite):
@@ -528,6 +639,7 @@ class EnemyBullet(CommonSprite):
     敌方飞机可以发射的子弹
     这种是不追踪的，直线飞行。该类有一个子类是可以追踪我方的
     """
+    state_fields = ('speed',)
 
     def __init__(self, images, center, *group):
         center = list(center)
@@ -540,8 +652,7 @@ class EnemyBullet(CommonSprite):
         self.speed = 300
 
     def update(self, dt, *args) -> None:
-        super().update(dt, *args)
-        self.rect.move_ip(0, self.speed * dt)
+        self.move_by(0, self.speed * dt)
         # 因为这种子弹只会向下走，只需要看它是否从下侧离开屏幕就行了
         if self.rect.top >= SCREEN_RECT.bottom:
             self.kill()
@@ -553,6 +664,7 @@ class HardEnemyBullet(EnemyBullet):
     该子弹会追踪我方飞机，原理为：每帧获取我方飞机的位置，并计算自己应当向哪个方向飞行
     简直是战神级别，把作者打死了好多次（
     """
+    state_fields = ('speed', 'chase_time', 'dx', 'dy')
 
     def __init__(self, images, center, chase_time: float = None, *group):
         super().__init__(images, center, *group)
@@ -561,7 +673,7 @@ class HardEnemyBullet(EnemyBullet):
         if chase_time is None:
             chase_time = 1
         self.chase_time = chase_time
-        # 这个用来存储追踪的最后一帧的方向，子弹失去追踪特性之后会一直沿这个方向飞行
+        # 这个用来存储追踪的最后一帧的速度（像素/秒），子弹失去追踪特性之后会一直沿这个方向飞行
         self.dx = self.dy = None
         self.speed = 250
 
@@ -573,25 +685,25 @@ class HardEnemyBullet(EnemyBullet):
         if self.chase_time <= 0:
             # 追踪时间到了，就不追踪了，直接按追踪最后一帧确定的方向飞行
             # 这里提前判断self.chase_time，假如子弹不追踪了，就能少点计算量
-            self.rect.move_ip(self.dx, self.dy)
+            self.move_by(self.dx * dt, self.dy * dt)
         else:
             # 如果有传入我方飞机的位置，就追踪
             self.chase_time -= dt
             # dis是子弹到我方的距离，用来求cosa与sina
             dis = math.sqrt((self.rect.centerx - player_position[0]) ** 2 +
                             (self.rect.centery - player_position[1]) ** 2)
-            # dx 相当于cosa * ds, dy相当于sina * ds
-            # ds是一帧内子弹可以移动的长度
-            dx = self.speed * dt * (player_position[0] - self.rect.centerx) / dis
-            dy = self.speed * dt * (player_position[1] - self.rect.centery) / dis
+            # dx 相当于cosa * v, dy相当于sina * v
+            # v是子弹的速度
+            dx = self.speed * (player_position[0] - self.rect.centerx) / dis
+            dy = self.speed * (player_position[1] - self.rect.centery) / dis
             # 如果子弹追踪时间没有结束，就按计算出的方向移动
             if self.chase_time >= 0 and self.dx is None and self.dy is None:
-                self.rect.move_ip(dx, dy)
+                self.move_by(dx * dt, dy * dt)
             # 子弹的追踪时间刚刚结束，还没有存储最后一帧的信息，就存一下最后一帧子弹运行的方向
             elif self.dx is None and self.dy is None:
                 self.dx = dx
                 self.dy = dy
-                self.rect.move_ip(dx, dy)
+                self.move_by(dx * dt, dy * dt)
         # 如果子弹出界就删掉
         if self.rect.top >= SCREEN_RECT.bottom or self.rect.bottom <= SCREEN_RECT.top or \
                 self.rect.left >= SCREEN_RECT.right or self.rect.right <= SCREEN_RECT.left:
@@ -612,12 +724,12 @@ class HardEnemyBullet(EnemyBullet):
             # modifier表示子弹在我方上面还是下面, 1表示在下面，-1表示在上面
             modifier = -1 if self.rect.centery > player_position[1] else 1
             # 仅仅在y轴上移动
-            self.rect.move_ip(0, self.speed * dt * modifier)
+            self.move_by(0, self.speed * dt * modifier)
         else:
             # -1: 在右边，1: 在左边
             modifier = -1 if self.rect.centerx > player_position[0] else 1
             # 仅仅在x轴上移动
-            self.rect.move_ip(self.speed * dt * modifier, 0)
+            self.move_by(self.speed * dt * modifier, 0)
 
 
 class ScoreBoard(widget.Text):
@@ -724,6 +836,8 @@ class Background(pygame.sprite.Sprite):
         self.image = image
         self.rect = self.image.get_rect()
         self.speed = speed
+        # 和CommonSprite一样，以浮点数的位置为准，慢速滚动时才不会一顿一顿的
+        self.y = 0.0
 
     def update(self, dt: float, *args) -> None:
         """
@@ -731,9 +845,10 @@ class Background(pygame.sprite.Sprite):
         :param dt: 每两次调用的间隔
         :return: 无
         """
-        self.rect.top += self.speed * dt
-        if self.rect.top >= SCREEN_RECT.bottom:
-            self.rect.top = 0
+        self.y += self.speed * dt
+        if self.y >= SCREEN_RECT.bottom:
+            self.y = 0.0
+        self.rect.top = round(self.y)
 
 
 def spawn_simple_enemy(groups: list[pygame.sprite.Group], images: list[pygame.Surface], difficulty: int = 0) -> None:
@@ -752,9 +867,7 @@ def spawn_simple_enemy(groups: list[pygame.sprite.Group], images: list[pygame.Su
         e.speed = random.randint(*DIFFICULTY[difficulty]['speed'])
         e.full_time = DIFFICULTY[difficulty]['full_time']
         # 如果难度不允许飞机攻击，则禁用攻击方法
-        # 用一个接受无限个参数但啥也不干的函数替代掉飞机的fire方法
-        if not DIFFICULTY[difficulty]['fire']:
-            e.fire = lambda *a: a
+        e.can_fire = DIFFICULTY[difficulty]['fire']
         e.chase = DIFFICULTY[difficulty]['chase']
         if e.chase:
             e.total_fire_cd = e.fire_cd = 1.5
@@ -765,35 +878,52 @@ class MainApp:
     游戏主程序
     """
 
-    def __init__(self):
+    def __init__(self, backend: str = None):
         """
         加载游戏资源，创建游戏屏幕
+        :param backend: 绘制后端的名称，见render.BACKENDS，为None时使用配置中的RENDER_BACKEND
         """
-        # 屏幕，在多局游戏中重复使用
-        self.screen = pygame.display.set_mode(SCREEN_RECT.size, 0,
-                                              pygame.display.mode_ok(SCREEN_RECT.size, 0, 32))
+        log.configure(LOG_LEVEL, LOG_MODULES, LOG_FILE)
+        # 需要记录时间线的话，从加载资源开始记录
+        if TRACE_FILE is not None:
+            tracing.TRACER.start(TRACE_FILE)
         pygame.display.set_caption("飞机大战")
+        # 绘制后端，负责创建窗口与绘制，在多局游戏中重复使用
+        self.backend = render.create_backend(backend or RENDER_BACKEND, SCREEN_RECT.size, RENDER_DRIVER,
+                                             FRAME_PACING == "vsync")
         # 这张图是示例里的aliens.py用的，感觉很适合主题就拿来了
-        self.background_image = resource.load("./data/background.gif", True)
-        self.background = pygame.surface.Surface(SCREEN_RECT.size)
+        # 所有图片加载后都经过resource.prepare转换为绘制最快的格式
+        self.background_image = resource.prepare(resource.load("./data/background.gif", True), True)
+        self.background = resource.prepare(pygame.surface.Surface(SCREEN_RECT.size), True)
 
         # 加载游戏资源，这样重新开始游戏时不用再加载了
-        self.plane_image = resource.load("./data/plane_1.png", True).convert_alpha()
-        self.enemy_images = [resource.load(f"./data/enemy_{i}.png", True).convert_alpha() for i in range(1, 4)]
-        self.boss_image = resource.load(f"./data/boss.png", True).convert_alpha()
+        self.plane_image = resource.prepare(resource.load("./data/plane_1.png", True))
+        self.enemy_images = [resource.prepare(resource.load(f"./data/enemy_{i}.png", True)) for i in range(1, 4)]
+        self.boss_image = resource.prepare(resource.load(f"./data/boss.png", True))
         self.total_boss_health = 1000
         self.boss_health = 1000
-        self.score = 0
+        # 第一次进入Boss战时的得分。Boss战中死亡后重玩会直接从Boss战开始，得分也恢复成这个值，胜利后清零
+        self.boss_entry_score = 0
         self.boss_fight = False
 
-        self.explosion_image = resource.load("./data/explosion_1.gif", True).convert_alpha()
-        self.shot_image = resource.load('./data/shot.gif', True).convert_alpha()
-
-        self.fire_ball_image = resource.load("./data/fire_ball.png", False, self.shot_image).convert_alpha()
-        self.large_fireball_image = resource.load("./data/fireball_128.png", False, self.shot_image).convert_alpha()
+        explosion_image = resource.load("./data/explosion_1.gif", True)
+        self.explosion_image = resource.prepare(explosion_image)
+        # 爆炸特效是由一张图片和它的倒过来的图片轮播产生的，翻转后的图片只需要生成一次
+        self.explosion_images = [self.explosion_image,
+                                 resource.prepare(pygame.transform.flip(explosion_image, 1, 1))]
+        # 爆炸能炸到多大的范围，与爆炸图片一样大
+        self.blast_size = self.explosion_image.get_size()
+        shot_image = resource.load('./data/shot.gif', True)
+        self.shot_image = resource.prepare(shot_image)
+        # 敌方子弹是倒过来的我方子弹，同样只生成一次
+        self.enemy_shot_images = [resource.prepare(pygame.transform.flip(shot_image, 1, 1))]
+
+        self.fire_ball_image = resource.prepare(resource.load("./data/fire_ball.png", False, self.shot_image))
+        self.large_fireball_image = resource.prepare(resource.load("./data/fireball_128.png", False,
+                                                                   self.shot_image))
 
         # 加载即使丢失也能用其他资源代替的资源
-        self.fire_image = resource.load("data/fire.png", False, pygame.Surface((0, 0))).convert_alpha()
+        self.fire_image = resource.prepare(resource.load("data/fire.png", False, pygame.Surface((0, 0))))
         # 这两个用的是字体，但大小不同
         self.font = resource.load("./data/Kenney Pixel.ttf", False, pygame.font.SysFont("arial", 30), 45)
         self.font_large = resource.load("./data/Kenney Pixel.ttf", False, pygame.font.SysFont("arial", 45), 80)
@@ -805,19 +935,167 @@ class MainApp:
 
         pygame.display.set_icon(self.plane_image)
 
+        # 画质调节器，游戏卡顿时自动降低特效质量
+        self.governor = quality.QualityGovernor(MAX_RATE)
+        # 粒子系统：爆炸与尾焰，按添加的顺序绘制
+        self.particles = particle.ParticleSystem()
+        # 爆炸的火光，就是原来的爆炸特效：在原地轮播两张图片
+        self.flash = self.particles.add(particle.ParticleBuffer(self.explosion_images, 0.2, 256))
+        # 爆炸时四散的碎片，是缩小的爆炸图片，画在火光上面
+        self.debris_images = [resource.prepare(pygame.transform.scale(explosion_image, (size, size)))
+                              for size in (8, 16)]
+        self.debris = [self.particles.add(particle.ParticleBuffer(image)) for image in self.debris_images]
+        # 尾焰，尾焰图片丢失时没有尾焰
+        self.exhaust = None
+        self.exhaust_image = self.fire_image
+        if self.fire_image.get_width() and self.fire_image.get_height():
+            self.exhaust_image = resource.prepare(pygame.transform.scale(self.fire_image, (20, 20)))
+            self.exhaust = self.particles.add(particle.ParticleBuffer(self.exhaust_image, capacity=512))
+        # 游戏状态快照，用于倒带与回到Boss放技能之前
+        self.snapshots = snapshot.SnapshotRing(SNAPSHOT_COUNT, SNAPSHOT_INTERVAL)
+        # 这一次卡顿是否已经写进日志，连续卡顿只报告一次
+        self.spike_reported = False
+        # 观战服务器，没有设置端口时不开启
+        self.spectators = None
+        if SPECTATOR_PORT is not None:
+            try:
+                self.spectators = spectator.SpectatorServer(SPECTATOR_PORT).start()
+            except OSError as error:
+                # 端口被占用等情况下不开观战，游戏照常进行
+                logger.error("无法在端口%s上启动观战服务器，本次不开放观战: %s", SPECTATOR_PORT, error)
+        # 分进程模式下，模拟进程每帧把画面要用的状态写进共享内存，见split.py
+        self.frame_publisher = None
+        # 键盘与鼠标的状态从这里读，分进程模式下的模拟进程会换成从管道接收的输入
+        self.input = inputs.LocalInput()
+        if AUTOPILOT:
+            self.input = autopilot.Autopilot(self, self.input, SCREEN_RECT)
+
+        # 追踪弹选择目标用的网格
+        self.targets = spatial.NearestGrid()
+        # 正在飞行的敌机编队
+        self.flights = formation.Flights()
+        # 帧率控制，每一局都用同一个，帧间隔的偏差统计会一直累积到退出
+        self.pacer = pacing.FramePacer(FRAME_PACING)
+        # 固定步长模拟，与帧率无关
+        self.timestep = timestep.FixedTimestep(SIM_RATE)
+        # 战绩数据库，没有设置文件时不记录
+        self.stats = None
+        if STATS_FILE is not None:
+            self.stats = stats.StatsStore(STATS_FILE).start()
+
+        # 录像机，跨局保留，按下录像键开始/停止
+        self.recorder = capture.FrameRecorder(CAPTURE_DIR, CAPTURE_FORMAT)
+        if CAPTURE_ON_START:
+            self.recorder.start(SCREEN_RECT.size)
+
         # 这个控制变量很特殊，必须放在start外面，不然实现不了重玩
         self.running = False
+        # 重玩按钮被按下后设为True，当前这局结束后由run开始新的一局
+        self.replay = False
+        # 帧率显示的状态跨局保留
+        self.show_fps = False
 
-    def start(self):
         # 由于这张图片特别窄（左右距离小），但左右侧衔接很自然，所以不断从左向右绘制该图片，直至它填满屏幕
+        # 背景每局都一样，只需要拼一次
         for tile in range(0, SCREEN_RECT.width, self.background_image.get_width()):
             # blit:把self.background_image画到self.background这个画布上，位置是(tile, 0)
             self.background.blit(self.background_image, (tile, 0))
-        # 把self.background画到self.screen上,相当于直接把背景涂上去
+
+        # 各个精灵组在多局游戏中重复使用，每局开始时清空
+        # 存放在游戏正常运行时所有需要更新的对象
+        self.all_objects = render.BatchRenderUpdates()
+        # 存放需要在玩家死后更新的对象，一般是爆炸特效和失败界面，平时不会更新这些内容
+        self.after_player_dead = render.BatchRenderUpdates()
+        # 存放玩家胜利后还需要更新的对象，一般只有胜利界面
+        self.after_player_win = render.BatchRenderUpdates()
+        # 存放暂停时允许更新的对象，一般只有帧率显示器和暂停界面
+        self.paused_objects = render.BatchRenderUpdates()
+        self.boss_render_group = render.BatchRenderUpdates()
+        # 敌人
+        self.enemy = pygame.sprite.Group()
+        # 爆炸特效
+        # 这一步产生的爆炸的中心，碰撞检测最后一次性结算连锁爆炸（见collision.chain_reaction）
+        self.blasts = []
+        # 子弹
+        self.player_bullet_group = pygame.sprite.Group()
+        # 敌方子弹组
+        self.enemy_bullet_group = pygame.sprite.Group()
+        # 碰到我方也不会消失的子弹组
+        self.enemy_no_disappear_group = pygame.sprite.Group()
+        # boss
+        self.boss_group = pygame.sprite.Group()
+        # 我方与敌方子弹组分开是为了方便碰撞检测
+
+        # 界面上的控件也只创建一次，每局开始时放回对应的组里
+        # 记分板
+        self.score_board = ScoreBoard((70, 50), self.font)
+        # 胜利界面
+        # 先写个差不多长度的文字，反正不显示（因为需要在创建时计算rect的位置）
+        self.win_menu = widget.Text(text="You Win! Score: 0", center=SCREEN_RECT.center, font=self.font_large,
+                                    color=(255, 0, 0),
+                                    font_size=50)
+        # 失败界面
+        self.lose_menu = widget.Text(text="You Lose!", center=SCREEN_RECT.center, font=self.font_large,
+                                     color=(255, 0, 0), font_size=50)  # 仅在失败界面展示
+        # 暂停界面
+        self.paused_menu = widget.Text(text="Paused", center=SCREEN_RECT.center, font=self.font_large,
+                                       color=(0, 0, 255), font_size=50)  # 仅在暂停时展示
+        # 重玩按钮
+        self.replay_button = widget.Button(center=(SCREEN_RECT.centerx, SCREEN_RECT.centery + 100), text="Replay",
+                                           font=self.font,
+                                           command=self.replay_game)  # 在胜利或失败界面展示
+        # 用于显示帧率的对象
+        self.fps_view = FPSView((50, SCREEN_RECT.height - 35), self.font)
+        # 血条
+        self.health_bar = BossHealthBar((SCREEN_RECT.width / 2, 25), self.total_boss_health, self.font)
+
+    def new_session(self) -> None:
+        """
+        结束上一局遗留的所有内容，准备开始新的一局
+        精灵组，控件与预先渲染好的图片全部重复使用，只清空组里的内容
+        :return: 无
+        """
+        for group in (self.all_objects, self.after_player_dead, self.after_player_win, self.paused_objects,
+                      self.boss_render_group, self.enemy, self.player_bullet_group,
+                      self.enemy_bullet_group, self.enemy_no_disappear_group, self.boss_group):
+            group.empty()
+        # 上一局剩下的粒子不再显示，剩下的动画也不再播放，快照也没用了
+        self.particles.empty()
+        self.flights.clear()
+        self.blasts.clear()
+        animation.CLOCK.reset()
+        self.snapshots.clear()
+        self.spike_reported = False
+        self.player = None
+        self.boss = None
+
+        # 把控件放回它们该在的组里
+        self.score_board.score = 0
+        self.all_objects.add(self.score_board, self.fps_view)
+        self.after_player_win.add(self.win_menu, self.replay_button, self.health_bar)
+        self.after_player_dead.add(self.lose_menu, self.replay_button)
+        self.paused_objects.add(self.paused_menu, self.fps_view)
+        self.boss_render_group.add(self.health_bar)
+
+    def run(self) -> None:
+        """
+        运行游戏，直到玩家退出
+        每局游戏结束后，如果玩家按下了重玩按钮，就在这里开始新的一局，而不是在上一局里面套一层新的游戏循环
+        :return: 无
+        """
+        while self.start():
+            pass
+
+    def start(self) -> bool:
+        """
+        开始一局游戏，直到这一局结束
+        :return: 这一局结束后是否要再玩一局
+        """
+        self.new_session()
+        self.replay = False
+        # 把self.background画到屏幕上,相当于直接把背景涂上去
         # 背景的绘制必须每局游戏前都来一次，不然会发现上局游戏的飞机和爆炸特效啥的还留在这当背景（
-        self.screen.blit(self.background, (0, 0))
-        # 先更新一次屏幕
-        pygame.display.flip()
+        self.backend.reset(self.background)
 
         # 加载背景音乐，并尝试播放
         resource.load_bgm("./data/mus_anothermedium.ogg", False)
@@ -835,313 +1113,332 @@ class MainApp:
         playing = True
         # 初始没有胜利
         win = False
-        # 初始不全屏
-        fullscreen = False
         # 调试模式
         debug = False
-        # 存放在游戏正常运行时所有需要更新的对象
-        all_objects = pygame.sprite.RenderUpdates()
-        # 存放需要在玩家死后更新的对象，一般是爆炸特效和失败界面，平时不会更新这些内容
-        after_player_dead = pygame.sprite.RenderUpdates()
-        # 存放玩家胜利后还需要更新的对象，一般只有胜利界面
-        after_player_win = pygame.sprite.RenderUpdates()
-        # 存放暂停时允许更新的对象，一般只有帧率显示器和暂停界面
-        paused_objects = pygame.sprite.RenderUpdates()
-
-        boss_render_group = pygame.sprite.RenderUpdates()
+        # 循环中频繁使用的组，先存成局部变量
+        all_objects = self.all_objects
+        after_player_dead = self.after_player_dead
+        after_player_win = self.after_player_win
+        paused_objects = self.paused_objects
+        boss_render_group = self.boss_render_group
+        enemy = self.enemy
+        player_bullet_group = self.player_bullet_group
+        enemy_bullet_group = self.enemy_bullet_group
+        enemy_no_disappear_group = self.enemy_no_disappear_group
+        boss_group = self.boss_group
+        score_board = self.score_board
+        fps_view = self.fps_view
+        health_bar = self.health_bar
+        # 记录每一帧各个阶段的耗时（没有打开记录时什么都不做）
+        tracer = tracing.TRACER
         # 用于控制帧率
-        clock = pygame.time.Clock()
-        # 初始不展示帧率
-        show_fps = False
+        clock = self.pacer
         # 每帧间隔，初始设为0
         diff = 0
-
-        # 初始化游戏对象
-        # 记分板
-        score_board = ScoreBoard((70, 50), self.font, all_objects)
-        # 胜利界面
-        # 先写个差不多长度的文字，反正不显示（因为需要在创建时计算rect的位置）
-        win_menu = widget.Text(text="You Win! Score: 0", center=SCREEN_RECT.center, font=self.font_large,
-                               color=(255, 0, 0),
-                               font_size=50,
-                               group=[after_player_win])
-        # 失败界面
-        widget.Text(text="You Lose!", center=SCREEN_RECT.center, font=self.font_large, color=(255, 0, 0), font_size=50,
-                    group=[after_player_dead])  # 仅在失败界面展示
-        # 暂停界面
-        widget.Text(text="Paused", center=SCREEN_RECT.center, font=self.font_large, color=(0, 0, 255), font_size=50,
-                    group=[paused_objects])  # 仅在暂停时展示
-        # 重玩按钮
-        widget.Button(center=(SCREEN_RECT.centerx, SCREEN_RECT.centery + 100), text="Replay",
-                      group=[after_player_win, after_player_dead],
-                      font=self.font,
-                      command=self.replay_game)  # 在胜利或失败界面展示
-        # 用于显示帧率的对象
-        fps_view = FPSView((50, SCREEN_RECT.height - 35), self.font, all_objects, paused_objects)
-        # 血条
-        health_bar = BossHealthBar((SCREEN_RECT.width / 2, 25), self.total_boss_health, self.font, boss_render_group,
-                                   after_player_win)
+        # 模拟一步的时间，单位：秒
+        step = self.timestep.step
+        self.timestep.reset()
         # 难度，默认为0
         difficulty = 0
+        # 这一局开始的时间，存活时间（不算暂停），死因，以及这一局的战绩是否已经记录
+        started_at = time.time()
+        survival_time = 0
+        death_cause = None
+        run_recorded = False
+        # 这一局是否开过Bug模式
+        cheated = False
         # 玩家
-        player = Player([self.plane_image], SCREEN_RECT.center, self.fire_image, all_objects)
-        # 敌人
-        enemy = pygame.sprite.Group()
-        # 爆炸特效
-        explosion_group = pygame.sprite.Group()
-        # 子弹
-        player_bullet_group = pygame.sprite.Group()
-        # 敌方子弹组
-        enemy_bullet_group = pygame.sprite.Group()
-        # 碰到我方也不会消失的子弹组
-        enemy_no_disappear_group = pygame.sprite.Group()
-        # boss
-        boss_group = pygame.sprite.Group()
-        # 我方与敌方子弹组分开是为了方便碰撞检测
+        player = self.player = Player([self.plane_image], SCREEN_RECT.center, self.exhaust, all_objects)
         multi_keys = []
 
         # 游戏正式开始
         while self.running:
-            # 每一帧待更新的区域
-            dirty_rects = []
-            # 这部分专门处理事件
-            events = pygame.event.get(pygame.QUIT)
-            if events:
+            tracer.begin("frame")
+            render.STATS.reset()
+            tracer.begin("events")
+            # 这部分专门处理事件：每帧把事件队列一次取完，分好类再处理
+            self.input.pump()
+            if self.input.quit:
                 # 在一轮循环结束后退出游戏
                 self.running = False
             multi_keys = [] if pygame.K_b and pygame.K_u and pygame.K_g in multi_keys else multi_keys
-            for key_event in pygame.event.get(pygame.KEYDOWN):
+            for key in self.input.key_downs:
                 # 如果按下的按键为配置文件中的暂停键，那么切换暂停状态
                 # 只有游戏没有结束（没有输赢）的时候才能暂停
-                multi_keys.append(key_event.key)
-                if key_event.key == PAUSE_KEY and playing:
+                multi_keys.append(key)
+                if key == PAUSE_KEY and playing:
                     paused = not paused
-                if key_event.key == FPS_KEY:
-                    show_fps = not show_fps
-                if key_event.key == QUIT_KEY:
+                if key == FPS_KEY:
+                    self.show_fps = not self.show_fps
+                if key == CAPTURE_KEY:
+                    self.recorder.toggle(SCREEN_RECT.size)
+                if key == QUIT_KEY:
                     self.running = False
-                if key_event.key == FULL_KEY:
+                # Bug模式下可以倒带，死了也能倒回去接着玩
+                if key == REWIND_KEY and debug and not paused:
+                    rewound = self.snapshots.rewind()
+                    if rewound is not None:
+                        self.restore_snapshot(rewound)
+                        playing = player.alive()
+                        win = False
+                # Bug模式下可以回到Boss最近一次放技能之前
+                if key == CHECKPOINT_KEY and debug and not paused:
+                    saved = self.snapshots.last_checkpoint("skill")
+                    if saved is not None:
+                        self.restore_snapshot(saved)
+                        playing = player.alive()
+                        win = False
+                if key == FULL_KEY:
                     # 进行强制暂停，防止玩家在切换屏幕的时候寄掉
                     if playing:
                         paused = True
-                    if not fullscreen:
-                        screen_backup = self.screen.copy()
-                        self.screen = pygame.display.set_mode(SCREEN_RECT.size, pygame.FULLSCREEN,
-                                                              pygame.display.mode_ok(SCREEN_RECT.size,
-                                                                                     pygame.FULLSCREEN, 32)
-                                                              )
-                        self.screen.blit(screen_backup, (0, 0))
-                    else:
-                        screen_backup = self.screen.copy()
-                        self.screen = pygame.display.set_mode(SCREEN_RECT.size, 0,
-                                                              pygame.display.mode_ok(SCREEN_RECT.size, 0, 32))
-                        self.screen.blit(screen_backup, (0, 0))
-                    fullscreen = not fullscreen
+                    self.backend.toggle_fullscreen()
                     # 切换屏幕后绘制一帧，不然除了那个暂停界面之外其他屏幕都是黑的
-                    dirty_rects.extend(all_objects.draw(self.screen))
+                    self.backend.redraw(all_objects)
 
             if pygame.K_b in multi_keys and pygame.K_u in multi_keys and pygame.K_g in multi_keys:
-                print("debug")
                 debug = not debug
+                cheated = cheated or debug
+                logger.info("调试模式: %s", "开" if debug else "关")
+            # 暂停或这一局结束时，输入在这一帧就处理完了；游戏进行中要等模拟推进一步才生效
+            if paused or not playing:
+                self.input.latency.consume()
+            tracer.end()
+            # 没有暂停时推进动画时钟，并一次性更新所有动画的图片
+            tracer.begin("animate")
+            if not paused:
+                animation.CLOCK.advance(diff / 1000)
+                animation.CLOCK.animate()
+                # 粒子只是装饰，跟着帧走就行，玩家死后或胜利后也继续动
+                self.particles.update(diff / 1000)
+            tracer.end()
             # 暂停时相当于除了处理时间外，其他所有内容停止运行
             # 这里检查目前是否在暂停，如果不在暂停才令游戏运行
             # 下面是游戏循环主要内容：
             if not paused and playing:
                 # 清除可能存在的暂停界面，不然会很难看
-                paused_objects.clear(self.screen, self.background)
-                keys_pressed = pygame.key.get_pressed()
-                # 玩家移动, 注意diff单位为毫秒
-                # 这里加减可以实现：按住a与d时不动，只按a/只按d才动
-                player.move(keys_pressed[pygame.K_d] - keys_pressed[pygame.K_a]
-                            + keys_pressed[pygame.K_RIGHT] - keys_pressed[pygame.K_LEFT],
-                            keys_pressed[pygame.K_s] - keys_pressed[pygame.K_w]
-                            + keys_pressed[pygame.K_DOWN] - keys_pressed[pygame.K_UP],
-                            diff / 1000)
-
-                # 更新所有非暂停时更新的游戏对象
-                if not self.boss_fight:
-                    all_objects.update(diff / 1000, player.rect.center)
-                else:
-                    try:
-                        all_objects.update(diff / 1000, player.rect.center, boss.rect.center)
-                    except UnboundLocalError:
-                        all_objects.update(diff / 1000, player.rect.center)
-
-                # 以下为碰撞检测
-                # 四个部分： 玩家与敌机的碰撞，玩家与敌方子弹的碰撞，敌机与我方子弹的碰撞，敌机与爆炸特效的碰撞
-
-                # 如果玩家撞到敌机，游戏结束
-                for one_enemy in pygame.sprite.spritecollide(player, enemy, True):
-                    # 在敌机的中心位置生成爆炸特效
-                    Explosion([self.explosion_image, pygame.transform.flip(self.explosion_image, 1, 1)],
-                              one_enemy.rect.center,
-                              after_player_dead, explosion_group)
-                    # 在玩家的中心位置生成爆炸特效
-                    Explosion([self.explosion_image, pygame.transform.flip(self.explosion_image, 1, 1)],
-                              player.rect.center,
-                              after_player_dead, explosion_group)
-                    # 玩家死亡, 调试模式下无敌
-                    if not debug:
-                        player.kill()
-                        playing = False
-
-                # 如果敌方子弹撞到玩家，游戏结束
-                for one_enemy in pygame.sprite.spritecollide(player, enemy_bullet_group, True):
-                    # 在玩家的中心位置生成爆炸特效
-                    Explosion([self.explosion_image, pygame.transform.flip(self.explosion_image, 1, 1)],
-                              (player.rect.centerx + 15, player.rect.centery),
-                              after_player_dead, explosion_group, all_objects)
-                    one_enemy.kill()
-                    if not debug:
-                        player.kill()
-                        playing = False
-
-                # 下面这两部分为：敌机尝试开火，玩家尝试使用键盘开火
-                # 敌机开火
-                for one_enemy in enemy.sprites():
-                    one_enemy.fire([pygame.transform.flip(self.shot_image, 1, 1)], all_objects, enemy_bullet_group)
-
-                # 玩家开火
-                # 鼠标控制开火:
-                # 只要鼠标左键按下并且cd为0，就可以开火
-                # 这样只要一直按住鼠标左键就能一直用最大速度开火
-                if keys_pressed[FIRE_KEY] or pygame.mouse.get_pressed(3)[0]:
-                    player.fire([self.shot_image], player_bullet_group, all_objects)
-                    if self.shot_sound is not None:
-                        self.shot_sound.play()
-
-                # 玩家子弹与敌机的碰撞检测
-                for one_enemy in pygame.sprite.groupcollide(enemy, player_bullet_group, False, True).keys():
-                    # 判断敌机是否无敌
-                    if one_enemy.full_time <= 0:
-                        # 加分，在敌机中心生成爆炸特效
-                        score_board.score += 10
-                        Explosion([self.explosion_image, pygame.transform.flip(self.explosion_image, 1, 1)],
-                                  one_enemy.rect.center,
-                                  all_objects, explosion_group)
-                        one_enemy.kill()
-
-                # 敌机与爆炸特效的碰撞检测
-                for one_enemy in pygame.sprite.groupcollide(enemy, explosion_group, False, True).keys():
-                    # 检查敌机是否无敌
-                    if one_enemy.full_time <= 0:
-                        # 加分，在敌机中心生成爆炸效果
-                        score_board.score += 10
-                        Explosion([self.explosion_image, pygame.transform.flip(self.explosion_image, 1, 1)],
-                                  one_enemy.rect.center,
-                                  all_objects, explosion_group)
-                        one_enemy.kill()
-
-                #  判断爆炸特效能引发连锁爆炸的时间是否结束，结束的话就把爆炸特效从可碰撞物体列表里移除
-                for explosion_sprite in explosion_group.sprites():
-                    if explosion_sprite.chain_time <= 0:
-                        explosion_group.remove(explosion_sprite)
-
-                # 检测成绩调整难度
-                if 200 > score_board.score >= 100:
-                    difficulty = 1
-                elif 300 > score_board.score >= 200:
-                    difficulty = 2
-                elif 350 > score_board.score >= 300:
-                    difficulty = 3
-                if score_board.score >= 350 and not self.boss_fight:
-                    self.boss_fight = True
-
-                # Boss战相关内容
-                # 为了减低难度，Boss血量是一个全局变量，跨游戏继承
-                # 只要打到了boss，就算死了也会直接进入boss战
-                if self.boss_fight and len(boss_group) == 0:
-                    # 尝试切换音乐
-                    resource.load_bgm("./data/asgore.mp3", False)
-                    try:
-                        pygame.mixer.music.set_volume(0.3)
-                        pygame.mixer.music.play(-1, 0, 5000)
-                    except pygame.error:
-                        pass
-                    boss = Boss(images=[self.boss_image], bullet_image=[pygame.transform.flip(self.shot_image, 1, 1)],
-                                fire_ball_image=[self.fire_ball_image], large_fireball_image=self.large_fireball_image,
-                                group=(boss_group, boss_render_group),
-                                no_disappear_bullet_group=[all_objects, enemy_no_disappear_group, boss_render_group,
-                                                           after_player_dead],
-                                bullet_group=[all_objects, enemy_bullet_group, boss_render_group],
-                                boss_group=boss_group,
-                                plane_images=self.enemy_images)
-                    if self.score != 0:
-                        score_board.score = self.score
-                    else:
-                        self.score = score_board.score
-                # Boss死亡，我方胜利
-                if self.boss_health <= 0:
-                    Explosion([self.explosion_image, pygame.transform.flip(self.explosion_image, 1, 1)],
-                              boss_group.sprites()[0].rect.center,
-                              all_objects, explosion_group, after_player_win)
-                    boss_group.sprites()[0].kill()
-                    self.score += 200
-                    playing = False
-                    win = True
-                    win_menu.text = f"You win! Score: {self.score}"
-                # Boss存在时的内容
-                if self.boss_fight:
-                    # 更新boss血条
-                    health_bar.health = self.boss_health
-                    # 我方子弹cd减少
-                    player.total_fire_cd = 0.05
-                    player.total_chase_cd = 5
-
-                    keys = pygame.key.get_pressed()
-                    if keys[CHASE_KEY] or pygame.mouse.get_pressed(3)[2]:
-                        player.chase_fire(self.fire_ball_image, player_bullet_group, all_objects)
-
-                    # Boss与我方子弹碰撞
-                    bullets = pygame.sprite.groupcollide(player_bullet_group, boss_group, False, False)
-                    for bullet in bullets.keys():
-                        self.boss_health -= bullet.damage
-                        bullet.kill()
-
-                    # Boss与我方碰撞
-                    if pygame.sprite.spritecollide(player, boss_group, False):
-                        Explosion([self.explosion_image, pygame.transform.flip(self.explosion_image, 1, 1)],
-                                  player.rect.center,
-                                  after_player_dead, explosion_group, all_objects)
+                self.backend.erase(paused_objects)
+                self.snapshots.frame(diff)
+                # 按固定的步长推进模拟：这一帧的时间不够一步就不推进，够好几步就推进好几步
+                for _ in range(self.timestep.advance(diff / 1000)):
+                    # 记下每个物体这一步之前的位置，绘制时在前后两步的位置之间插值
+                    timestep.remember_positions(all_objects, boss_render_group)
+                    survival_time += step
+                    tracer.begin("update")
+                    keys_pressed = self.input.keys()
+                    self.input.latency.consume()
+                    # 玩家移动, 注意diff单位为毫秒
+                    # 这里加减可以实现：按住a与d时不动，只按a/只按d才动
+                    player.move(keys_pressed[pygame.K_d] - keys_pressed[pygame.K_a]
+                                + keys_pressed[pygame.K_RIGHT] - keys_pressed[pygame.K_LEFT],
+                                keys_pressed[pygame.K_s] - keys_pressed[pygame.K_w]
+                                + keys_pressed[pygame.K_DOWN] - keys_pressed[pygame.K_UP],
+                                step)
+
+                    # 追踪弹的目标：所有敌机与Boss，每一步按它们现在的位置重建一次
+                    self.targets.rebuild(itertools.chain(enemy, boss_group))
+                    # 编队中的敌机由编队整体推进，它们自己的update只处理计时器
+                    self.flights.step(step)
+                    # 更新所有非暂停时更新的游戏对象
+                    all_objects.update(step, player.rect.center)
+
+                    tracer.end()
+                    tracer.begin("collision")
+                    # 以下为碰撞检测
+                    # 四个部分： 玩家与敌机的碰撞，玩家与敌方子弹的碰撞，敌机与我方子弹的碰撞，连锁爆炸
+
+                    # 如果玩家撞到敌机，游戏结束
+                    for one_enemy in collision.spritecollide(player, enemy, True):
+                        # 在敌机的中心位置生成爆炸特效
+                        self.explode(one_enemy.rect.center)
+                        # 在玩家的中心位置生成爆炸特效
+                        self.explode(player.rect.center)
+                        # 玩家死亡, 调试模式下无敌
                         if not debug:
                             player.kill()
                             playing = False
-                        self.boss_health -= 10
-                    # Boss发出的不消失的攻击内容与我方碰撞
-                    if pygame.sprite.spritecollide(player, enemy_no_disappear_group, False):
-                        Explosion([self.explosion_image, pygame.transform.flip(self.explosion_image, 1, 1)],
-                                  player.rect.center,
-                                  after_player_dead, explosion_group, all_objects)
+                            death_cause = "撞上敌机"
+
+                    # 如果敌方子弹撞到玩家，游戏结束
+                    for one_enemy in collision.spritecollide(player, enemy_bullet_group, True):
+                        # 在玩家的中心位置生成爆炸特效
+                        self.explode((player.rect.centerx + 15, player.rect.centery))
+                        one_enemy.kill()
                         if not debug:
                             player.kill()
                             playing = False
+                            death_cause = "敌机子弹"
+
+                    tracer.end()
+                    tracer.begin("fire")
+                    # 下面这两部分为：敌机尝试开火，玩家尝试使用键盘开火
+                    # 敌机开火
+                    for one_enemy in enemy.sprites():
+                        one_enemy.fire(self.enemy_shot_images, all_objects, enemy_bullet_group)
+
+                    # 玩家开火
+                    # 鼠标控制开火:
+                    # 只要鼠标左键按下并且cd为0，就可以开火
+                    # 这样只要一直按住鼠标左键就能一直用最大速度开火
+                    if keys_pressed[FIRE_KEY] or self.input.mouse()[0]:
+                        player.fire([self.shot_image], player_bullet_group, all_objects)
+                        if self.shot_sound is not None:
+                            self.shot_sound.play()
+
+                    tracer.end()
+                    tracer.begin("collision")
+                    # 玩家子弹与敌机的碰撞检测
+                    for one_enemy in collision.groupcollide(enemy, player_bullet_group, False, True).keys():
+                        # 判断敌机是否无敌
+                        if one_enemy.full_time <= 0:
+                            # 加分，在敌机中心生成爆炸特效
+                            score_board.score += 10
+                            self.explode(one_enemy.rect.center)
+                            one_enemy.kill()
+
+                    # 连锁爆炸：这一步的所有爆炸一次结算完，被炸到的敌机（无敌的除外）加分并在原地爆炸
+                    chained = collision.chain_reaction(self.blasts, [one_enemy for one_enemy in enemy
+                                                                     if one_enemy.full_time <= 0], self.blast_size)
+                    self.blasts.clear()
+                    score_board.score += 10 * len(chained)
+                    for one_enemy in chained:
+                        one_enemy.kill()
+                    self.show_explosions([one_enemy.rect.center for one_enemy in chained])
+
+                    tracer.end()
+                    tracer.begin("boss")
+                    # 检测成绩调整难度
+                    if 200 > score_board.score >= 100:
+                        difficulty = 1
+                    elif 300 > score_board.score >= 200:
+                        difficulty = 2
+                    elif 350 > score_board.score >= 300:
+                        difficulty = 3
+                    if score_board.score >= 350 and not self.boss_fight:
+                        self.boss_fight = True
+
+                    # Boss战相关内容
+                    # 为了减低难度，Boss血量是一个全局变量，跨游戏继承
+                    # 只要打到了boss，就算死了也会直接进入boss战
+                    if self.boss_fight and len(boss_group) == 0:
+                        # 尝试切换音乐
+                        resource.load_bgm("./data/asgore.mp3", False)
+                        try:
+                            pygame.mixer.music.set_volume(0.3)
+                            pygame.mixer.music.play(-1, 0, 5000)
+                        except pygame.error:
+                            pass
+                        self.boss = Boss(images=[self.boss_image], bullet_image=self.enemy_shot_images,
+                                         fire_ball_image=[self.fire_ball_image],
+                                         large_fireball_image=self.large_fireball_image,
+                                         group=(boss_group, boss_render_group),
+                                         no_disappear_bullet_group=[all_objects, enemy_no_disappear_group,
+                                                                    boss_render_group, after_player_dead],
+                                         bullet_group=[all_objects, enemy_bullet_group, boss_render_group],
+                                         boss_group=boss_group,
+                                         plane_images=self.enemy_images)
+                        self.boss.on_skill = self.checkpoint_skill
+                        if self.boss_entry_score != 0:
+                            score_board.score = self.boss_entry_score
+                        else:
+                            self.boss_entry_score = score_board.score
+                    # Boss死亡，我方胜利
+                    if self.boss_health <= 0:
+                        self.explode(boss_group.sprites()[0].rect.center)
+                        boss_group.sprites()[0].kill()
+                        score_board.score += 200
+                        playing = False
+                        win = True
+                        self.win_menu.text = f"You win! Score: {score_board.score}"
+                    # Boss存在时的内容
+                    if self.boss_fight:
+                        # 更新boss血条
+                        health_bar.health = self.boss_health
+                        # 我方子弹cd减少
+                        player.total_fire_cd = 0.05
+                        player.total_chase_cd = 5
+
+                        if keys_pressed[CHASE_KEY] or self.input.mouse()[2]:
+                            player.chase_fire(self.fire_ball_image, self.targets, player_bullet_group, all_objects)
+
+                        # Boss与我方子弹碰撞
+                        bullets = collision.groupcollide(player_bullet_group, boss_group, False, False)
+                        for bullet in bullets.keys():
+                            self.boss_health -= bullet.damage
+                            bullet.kill()
+
+                        # Boss与我方碰撞
+                        if collision.spritecollide(player, boss_group, False):
+                            self.explode(player.rect.center)
+                            if not debug:
+                                player.kill()
+                                playing = False
+                                death_cause = "撞上Boss"
+                            self.boss_health -= 10
+                        # Boss发出的不消失的攻击内容与我方碰撞
+                        if collision.spritecollide(player, enemy_no_disappear_group, False):
+                            self.explode(player.rect.center)
+                            if not debug:
+                                player.kill()
+                                playing = False
+                                death_cause = "Boss技能"
+
+                    # 这一局刚刚结束（死亡或胜利），记录战绩
+                    if not playing and not run_recorded:
+                        run_recorded = True
+                        self.record_run(started_at, difficulty, survival_time,
+                                        stats.WIN if win else stats.DEATH, death_cause, cheated)
+
+                    tracer.end()
+                    tracer.begin("spawn")
+                    # 如果敌人全都寄了，就再召唤一批
+                    if len(enemy) == 0 and not self.boss_fight:
+                        self.spawn_wave(difficulty)
 
-                # 如果敌人全都寄了，就再召唤一批
-                if len(enemy) == 0 and not self.boss_fight:
-                    spawn_simple_enemy([enemy, all_objects], self.enemy_images, difficulty)
-
+                    # 更新Boss相关内容
+                    if self.boss_fight:
+                        boss_group.update(step, player.rect.center, self.boss.rect.center)
+                    tracer.end()
+                    tracer.begin("snapshot")
+                    # 游戏进行中时，每隔一段时间记录一次快照
+                    if playing:
+                        self.snapshots.tick(self.capture_snapshot)
+                        self.check_spike()
+                    tracer.end()
+                    # 这一步结束了游戏，剩下的时间不用再模拟了
+                    if not playing:
+                        break
+
+                tracer.begin("draw")
                 # 这里是绘制所有物体
+                # 先把物体临时挪到插值后的位置，画完再挪回去
+                moved = timestep.interpolate_positions((all_objects, boss_render_group), self.timestep.alpha)
                 # 先清除掉上一帧画的东西，再画这一帧的东西
-                all_objects.clear(self.screen, self.background)
-                # 把这一帧修改了的区域放到脏区域里
-                dirty_rects.extend(all_objects.draw(self.screen))
+                # 粒子画在最上面，但要最先擦除，不然会擦掉这一帧刚画好的精灵
+                self.backend.erase(self.particles)
+                self.backend.draw(all_objects)
                 if self.boss_fight:
-                    # 更新Boss相关内容
-                    boss_group.update(diff / 1000, player.rect.center, boss.rect.center)
-                    boss_render_group.clear(self.screen, self.background)
-                    dirty_rects.extend(boss_render_group.draw(self.screen))
+                    self.backend.draw(boss_render_group)
+                self.backend.redraw(self.particles)
+                timestep.restore_positions(moved)
+                tracer.end()
 
+            tracer.begin("overlay")
             # 绘制帧率(如果设置了要显示帧率)
-            if show_fps:
+            if self.show_fps:
                 fps_view.fps = "{:.2f}".format(clock.get_fps())
             else:
-                fps_view.image = pygame.Surface((0, 0))
+                fps_view.image = EMPTY_SURFACE
+
+            # 游戏结束后爆炸的粒子照样要画完
+            if not playing:
+                self.backend.draw(self.particles)
 
             # 玩家死后只允许部分内容（after_player_dead组中的）被更新
             if not playing and not win:
                 after_player_dead.update(diff / 1000)
-                after_player_dead.clear(self.screen, self.background)
-                dirty_rects.extend(after_player_dead.draw(self.screen))
+                self.replay_button.handle(self.input.clicks)
+                self.backend.draw(after_player_dead)
                 if self.boss_fight:
                     try:
                         pygame.mixer.music.stop()
@@ -1151,43 +1448,229 @@ class MainApp:
             # 玩家赢后只允许after_player_win组中的内容被更新
             if not playing and win:
                 after_player_win.update(diff / 1000)
-                after_player_win.clear(self.screen, self.background)
-                dirty_rects.extend(after_player_win.draw(self.screen))
+                self.replay_button.handle(self.input.clicks)
+                self.backend.draw(after_player_win)
 
             # 暂停时仅允许paused_objects组中的内容被更新
             if paused:
-                paused_objects.clear(self.screen, self.background)
                 paused_objects.update(diff / 1000)
-                dirty_rects.extend(paused_objects.draw(self.screen))
-
-            # 统一更新脏区域
-            pygame.display.update(dirty_rects)
+                self.backend.draw(paused_objects)
+
+            tracer.end()
+            tracer.begin("spectator")
+            # 把这一帧的状态发给观战者
+            if self.spectators is not None:
+                self.spectators.publish(self, playing, win)
+            if self.frame_publisher is not None:
+                self.frame_publisher.publish(self, playing, win, paused, clock.get_fps(), self.timestep.alpha)
+
+            tracer.end()
+            # 记录这一帧一共blit了多少次，提交花了多久
+            tracer.counter("render", {"blits": render.STATS.blits, "submit_ms": render.STATS.submit_time})
+            # 录像时记录这一帧，必须在显示之前
+            tracer.begin("capture")
+            self.recorder.capture(self.backend)
+            tracer.end()
+            # 统一把这一帧画的内容显示出来
+            tracer.begin("present")
+            self.backend.present()
+            # 这一帧显示出了哪些输入的效果
+            latencies = self.input.latency.presented()
+            if latencies:
+                tracer.counter("input", {"latency_ms": max(latencies)})
+            tracer.end()
+            tracer.begin("tick")
             # 根据配置限制帧率
             if MAX_RATE is not None:
                 diff = clock.tick(MAX_RATE)
             else:
                 # 只计算上一帧到这一帧的时间间隔，不等待
                 diff = clock.tick()
+            # 把这一帧实际干活的耗时（不含为了限制帧率而等待的时间）告诉画质调节器
+            self.governor.feed(clock.get_rawtime())
+            tracer.counter("pacing", {"frame_ms": clock.frame_time, "deviation_ms": clock.deviation})
+            tracer.counter("quality", {"level": self.governor.level})
+            tracer.end()
+            tracer.end()
+        # 游戏进行中途退出的也记录下来
+        if not run_recorded:
+            self.record_run(started_at, difficulty, survival_time, stats.QUIT, None, cheated)
+        return self.replay
+
+    def record_run(self, started_at: float, difficulty: int, survival_time: float, outcome: str,
+                   death_cause: str = None, debug: bool = False) -> None:
+        """
+        把这一局的战绩交给战绩数据库（不会等待写入）
+        :param started_at: 这一局开始的时间，time.time()
+        :param difficulty: 这一局到达的难度
+        :param survival_time: 存活时间，单位：秒
+        :param outcome: 结局，见stats.WIN/DEATH/QUIT
+        :param death_cause: 死因
+        :param debug: 这一局是否开过Bug模式
+        :return: 无
+        """
+        if self.stats is None:
+            return
+        self.stats.record(stats.RunRecord(started_at, difficulty, self.score_board.score, survival_time,
+                                          self.boss_fight, max(self.boss_health, 0), outcome, death_cause,
+                                          debug))
+
+    def capture_snapshot(self, tick: int = 0, frame_time: float = 0, label: str = None) -> snapshot.Snapshot:
+        """
+        记录当前这一局的模拟状态：玩家，敌机，双方子弹，Boss与Boss放出的东西，以及Boss血量与得分
+        爆炸特效只是装饰，不记录
+        :param tick: 这是第几步模拟
+        :param frame_time: 上次快照以来最慢的一帧的耗时，单位：毫秒
+        :param label: 快照的说明
+        :return: 快照
+        """
+        entities = snapshot.capture_sprites((self.enemy, self.player_bullet_group, self.enemy_bullet_group,
+                                             self.enemy_no_disappear_group, self.boss_group, [self.player]))
+        return snapshot.Snapshot(tick, frame_time, self.boss_health, self.score_board.score, self.boss_fight,
+                                 self.boss, entities, label)
+
+    def checkpoint_skill(self, skill: int) -> None:
+        """
+        Boss放技能之前调用，记录一个检查点
+        :param skill: 技能编号
+        :return: 无
+        """
+        self.snapshots.checkpoint(self.capture_snapshot(self.snapshots.tick_count, label=f"skill {skill}"))
+
+    def check_spike(self) -> None:
+        """
+        刚记录了快照时调用：如果最新的快照中有卡顿，就在保存的快照中找出从哪里开始卡的，并写进日志
+        :return: 无
+        """
+        snapshots = self.snapshots
+        if SPIKE_THRESHOLD is None or not len(snapshots) or snapshots.tick_count % snapshots.interval:
+            return
+        latest = snapshots[-1]
+        if latest.frame_time <= SPIKE_THRESHOLD:
+            self.spike_reported = False
+            return
+        if self.spike_reported:
+            return
+        self.spike_reported = True
+        start = snapshots.find_spike_start(SPIKE_THRESHOLD)
+        logger.warning("卡顿: 最慢的一帧%.1fms，从第%d步（%.1f秒前）开始变卡，那时最慢的一帧%.1fms",
+                       latest.frame_time, start.tick, (snapshots.tick_count - start.tick) / SIM_RATE,
+                       start.frame_time)
+
+    def restore_snapshot(self, saved: snapshot.Snapshot) -> None:
+        """
+        把这一局恢复到快照记录时的状态
+        注意：已经开始执行的Boss技能（在其他线程里）不会被撤销
+        :param saved: 快照
+        :return: 无
+        """
+        for group in (self.enemy, self.player_bullet_group, self.enemy_bullet_group, self.enemy_no_disappear_group,
+                      self.boss_group):
+            for sprite in group.sprites():
+                sprite.kill()
+        self.player.kill()
+        self.blasts.clear()
+        snapshot.restore_sprites(saved.entities)
+        self.flights.restore(self.enemy)
+        self.boss_health = saved.boss_health
+        self.score_board.score = saved.score
+        self.boss_fight = saved.boss_fight
+        self.boss = saved.boss
+        # 恢复后的位置就是插值的起点，不要从倒带前的位置滑过来
+        timestep.remember_positions(self.all_objects, self.boss_render_group)
+
+    def spawn_wave(self, difficulty: int) -> None:
+        """
+        上一波敌机全部消灭后，召唤下一波：有时是一个编队，其他时候是一批普通的敌机
+        :param difficulty: 当前难度
+        :return: 无
+        """
+        chosen = formation.choose(FORMATIONS, difficulty) if random.random() < FORMATION_CHANCE else None
+        if chosen is None:
+            spawn_simple_enemy([self.enemy, self.all_objects], self.enemy_images, difficulty)
+            return
+
+        def create(group, center):
+            return FormationEnemy([random.choice(self.enemy_images)], group, center, difficulty)
+        self.flights.launch(chosen, create, self.enemy, self.all_objects)
+
+    def explode(self, center) -> None:
+        """
+        在center处产生一个爆炸：记下爆炸的位置，等这一步的碰撞检测最后一起结算连锁爆炸，并显示火光与碎片粒子
+        :param center: 爆炸的中心位置
+        :return: 无
+        """
+        self.blasts.append(center)
+        self.show_explosions((center,))
+
+    def show_explosions(self, centers) -> None:
+        """
+        在每个位置显示爆炸的火光与碎片粒子，只是特效，不会炸到东西。粒子的画质由画质调节器决定
+        :param centers: 爆炸的中心位置
+        :return: 无
+        """
+        if not centers:
+            return
+        self.flash.set_images(self.governor.explosion_images(self.explosion_images))
+        debris_counts = [self.governor.particle_count(count) for count in (24, 8)]
+        for center in centers:
+            # 和已有的火光重叠：让已有的那个重新开始计时，新的不显示
+            target = self.governor.merge_target(center, self.flash)
+            if target is not None:
+                self.flash.restart(target)
+                continue
+            # 装饰用的特效太多了，新的不显示
+            if self.governor.over_cap(len(self.flash)):
+                return
+            self.flash.emit(center[0], center[1], life=0.5)
+            for buffer, count in zip(self.debris, debris_counts):
+                buffer.burst(center[0], center[1], count, (60, 260), (0.3, 0.6))
 
     def replay_game(self, *_) -> None:
         """
         重新开始游戏，被replay按钮调用
+        这里只结束当前这一局，新的一局由run在当前这局的游戏循环退出后开始
         :return:无
         """
         self.running = False
+        self.replay = True
         if self.boss_health <= 0:
             self.boss_health = self.total_boss_health
-            self.score = 0
+            self.boss_entry_score = 0
             self.boss_fight = False
         if self.boss_fight:
             # 死亡惩罚
             self.boss_health = min(self.boss_health + 25, self.total_boss_health)
-        self.start()
+
+    def close(self) -> None:
+        """
+        停止录像与观战服务器，写完战绩与时间线，退出游戏前调用
+        :return: 无
+        """
+        self.recorder.stop()
+        if self.spectators is not None:
+            self.spectators.stop()
+            self.spectators = None
+        if self.stats is not None:
+            self.stats.close()
+        tracing.TRACER.stop()
+        summary = self.input.latency.summary()
+        if summary is not None:
+            logger.info("输入延迟: %d次, 中位数%.1fms, 95%%分位%.1fms, 最大%.1fms", *summary)
+        pacing_summary = self.pacer.histogram.summary()
+        if pacing_summary["frames"]:
+            logger.info("帧间隔偏差: %d帧, 平均%.2fms, 95%%不超过%.2fms, 最大%.2fms, 晚%d帧, 早%d帧",
+                        pacing_summary["frames"], pacing_summary["mean_ms"], pacing_summary["p95_ms"],
+                        pacing_summary["max_ms"], pacing_summary["late"], pacing_summary["early"])
 
 
 def main():
     game = MainApp()
-    game.start()
+    if SPLIT_PROCESS:
+        split.run(game)
+    else:
+        game.run()
+    game.close()
     pygame.quit()
 
 
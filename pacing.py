@@ -0,0 +1,257 @@
+# 帧率控制
+# 以前用pygame.time.Clock.tick(MAX_RATE)限制帧率，它靠操作系统的sleep等待，而sleep经常晚醒几毫秒，
+# 结果每帧的间隔忽长忽短（120帧时一帧只有8.3毫秒，晚几毫秒就很明显了），而且没有任何数据说明帧到底匀不匀
+# Clock.tick_busy_loop倒是准，但它整段时间都在空转，一个CPU核心直接跑满
+# FramePacer的做法：
+#   1. 按截止时间等待：每一帧的截止时间是上一帧的截止时间加上一帧的时长，而不是“上一帧结束后再等一帧”，误差不会累积
+#   2. 先用sleep睡到离截止时间还差一点的时候，剩下的一点用空转等到截止时间
+#      还差多少就不睡了，取决于最近sleep一般晚醒多久（自动估计）；空转的时间不超过一帧时长的一小部分，CPU占用有上限
+#   3. 垂直同步模式：截止时间对齐到屏幕刷新的时刻，一帧的时长是刷新间隔的整数倍；纹理绘制还会让显示本身等待刷新
+# 每一帧的实际间隔与目标间隔的偏差记在DeviationHistogram里，时间线（tracing.py）与性能测试（benchmark.py pacing）都可以读取
+import math
+import time
+
+import pygame
+
+# 可以使用的模式
+# tick：与以前一样，直接sleep到截止时间
+# precise：sleep加上有上限的空转
+# vsync：与precise相同，但截止时间对齐到屏幕刷新
+MODES = ("tick", "precise", "vsync")
+# 每帧空转的时间最多占一帧时长的多少
+SPIN_LIMIT = 0.15
+# 偏差直方图每个桶的上界，单位：毫秒，最后一个桶没有上界
+BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16)
+# 拿不到屏幕刷新率时假设的刷新率
+DEFAULT_REFRESH_RATE = 60
+
+
+def refresh_rate() -> int:
+    """
+    获取屏幕的刷新率
+    pygame-ce有display.get_current_refresh_rate，pygame没有，这时使用DEFAULT_REFRESH_RATE
+    :return: 刷新率，单位：赫兹
+    """
+    getter = getattr(pygame.display, "get_current_refresh_rate", None)
+    if getter is not None:
+        try:
+            rate = getter()
+        except pygame.error:
+            rate = 0
+        if rate:
+            return rate
+    return DEFAULT_REFRESH_RATE
+
+
+class DeviationHistogram:
+    """
+    帧间隔偏差的直方图：实际间隔比目标间隔长（晚了）或短（早了）多少毫秒
+    """
+
+    def __init__(self):
+        # 每个桶里有多少帧，与BUCKETS一一对应，最后多一个桶放超过最大上界的
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0
+        # 偏差的绝对值之和，算平均值用
+        self.absolute_sum = 0.0
+        self.largest = 0.0
+        # 晚了的帧数与早了的帧数
+        self.late = 0
+        self.early = 0
+
+    def add(self, deviation: float) -> None:
+        """
+        记录一帧
+        :param deviation: 实际间隔减去目标间隔，单位：毫秒
+        :return: 无
+        """
+        size = abs(deviation)
+        index = 0
+        for bound in BUCKETS:
+            if size <= bound:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.total += 1
+        self.absolute_sum += size
+        self.largest = max(self.largest, size)
+        if deviation > 0:
+            self.late += 1
+        elif deviation < 0:
+            self.early += 1
+
+    def clear(self) -> None:
+        """
+        清空所有记录
+        :return: 无
+        """
+        self.__init__()
+
+    def percentile(self, percent: float) -> float:
+        """
+        偏差的分位数（按桶估计，返回所在的桶的上界，但不超过记录到的最大偏差）
+        :param percent: 百分比，比如95
+        :return: 单位：毫秒，没有记录时为0，落在最后一个桶时为记录到的最大偏差
+        """
+        if not self.total:
+            return 0.0
+        needed = self.total * percent / 100
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= needed:
+                return min(float(bound), self.largest)
+        return self.largest
+
+    def summary(self) -> dict:
+        """
+        整理成可以写进JSON或时间线的字典
+        :return: {"frames", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms", "late", "early",
+                  "buckets": [(上界, 帧数), ...]}，最后一个桶的上界为None
+        """
+        return {
+            "frames": self.total,
+            "mean_ms": self.absolute_sum / self.total if self.total else 0.0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "max_ms": self.largest,
+            "late": self.late,
+            "early": self.early,
+            "buckets": list(zip((*BUCKETS, None), self.counts)),
+        }
+
+    def format(self) -> list[str]:
+        """
+        画成文字的直方图
+        :return: 每个桶一行
+        """
+        lines = []
+        lower = 0
+        widest = max(self.counts) or 1
+        for bound, count in zip((*BUCKETS, None), self.counts):
+            label = f"{lower}-{bound}ms" if bound is not None else f">{lower}ms"
+            share = count / self.total * 100 if self.total else 0
+            lines.append(f"{label:>12} {count:>7} {share:>6.1f}% {'#' * round(count / widest * 40)}")
+            lower = bound
+        return lines
+
+
+class FramePacer:
+    """
+    帧率控制器，可以直接替换pygame.time.Clock（tick，get_fps，get_rawtime）
+    用法：
+        pacer = FramePacer("precise")
+        while 游戏在运行:
+            ...                           # 处理这一帧
+            diff = pacer.tick(MAX_RATE)   # 等到下一帧该开始的时候，返回这一帧的时长（毫秒）
+    """
+
+    def __init__(self, mode: str = "precise", spin_limit: float = SPIN_LIMIT, refresh: int = None):
+        """
+        :param mode: 模式，见MODES
+        :param spin_limit: 每帧空转的时间最多占一帧时长的多少
+        :param refresh: 垂直同步模式下屏幕的刷新率，为None时自动获取
+        """
+        if mode not in MODES:
+            raise ValueError(f"没有名为{mode}的帧率控制模式，可用的有：{', '.join(MODES)}")
+        self.mode = mode
+        self.spin_limit = spin_limit
+        self.refresh = refresh if refresh is not None else refresh_rate() if mode == "vsync" else None
+        self.histogram = DeviationHistogram()
+        # 上一帧开始的时间与这一帧的截止时间，time.perf_counter()
+        self.last = None
+        self.deadline = None
+        # 垂直同步模式下刷新时刻的基准，所有截止时间都与它相差刷新间隔的整数倍
+        self.phase = None
+        # 上一次tick的结果：这一帧的时长与实际干活的时长，单位：毫秒
+        self.frame_time = 0.0
+        self.raw_time = 0.0
+        # 最近一次的偏差，单位：毫秒
+        self.deviation = 0.0
+        # sleep一般会晚醒多久，单位：秒，自动估计
+        self.oversleep = 0.001
+        # 最近10帧的时长，算帧率用
+        self.recent = []
+
+    def interval(self, rate: float) -> float:
+        """
+        一帧应有的时长
+        :param rate: 帧率上限
+        :return: 单位：秒
+        """
+        interval = 1 / rate
+        if self.mode == "vsync":
+            period = 1 / self.refresh
+            # 不超过帧率上限的最接近的刷新间隔的整数倍
+            interval = max(math.ceil(interval / period - 1e-6), 1) * period
+        return interval
+
+    def _wait(self, deadline: float, interval: float) -> None:
+        """
+        等到deadline
+        :param deadline: 截止时间，time.perf_counter()
+        :param interval: 一帧的时长，决定空转的上限
+        :return: 无
+        """
+        now = time.perf_counter()
+        if self.mode == "tick":
+            if deadline > now:
+                time.sleep(deadline - now)
+            return
+        spin = min(self.oversleep * 1.5 + 0.0002, interval * self.spin_limit)
+        remaining = deadline - now - spin
+        if remaining > 0:
+            time.sleep(remaining)
+            woke = time.perf_counter()
+            # 实际睡的时间比要求的长多少，取一个缓慢变化的平均
+            late = max(woke - now - remaining, 0)
+            self.oversleep += (late - self.oversleep) * 0.1
+        while time.perf_counter() < deadline:
+            pass
+
+    def tick(self, rate: float = None) -> float:
+        """
+        每帧结束时调用：等到下一帧该开始的时候，记录这一帧的偏差
+        :param rate: 帧率上限，为None时不等待
+        :return: 这一帧的时长，单位：毫秒。与Clock.tick不同，不取整，模拟不会因为每帧丢掉零头而变慢
+        """
+        start = time.perf_counter()
+        if self.last is None:
+            self.last = self.phase = start
+        self.raw_time = (start - self.last) * 1000
+        if rate:
+            interval = self.interval(rate)
+            if self.deadline is None or start - self.deadline > interval:
+                # 第一帧，或者这一帧晚了一整帧以上：不追赶，从现在重新开始算截止时间
+                self.deadline = start + interval
+                if self.mode == "vsync":
+                    # 对齐到之后最近的一次刷新
+                    period = 1 / self.refresh
+                    self.deadline = self.phase + math.ceil((self.deadline - self.phase) / period) * period
+            self._wait(self.deadline, interval)
+            now = time.perf_counter()
+            self.deviation = ((now - self.last) - interval) * 1000
+            self.histogram.add(self.deviation)
+            self.deadline += interval
+        else:
+            now = start
+        self.frame_time = (now - self.last) * 1000
+        self.last = now
+        self.recent.append(self.frame_time)
+        if len(self.recent) > 10:
+            del self.recent[0]
+        return self.frame_time
+
+    def get_fps(self) -> float:
+        """
+        :return: 最近10帧的平均帧率
+        """
+        total = sum(self.recent)
+        return len(self.recent) * 1000 / total if total else 0.0
+
+    def get_rawtime(self) -> float:
+        """
+        :return: 上一帧实际干活的时长（不含等待），单位：毫秒
+        """
+        return self.raw_time
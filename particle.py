@@ -0,0 +1,318 @@
+# 粒子系统
+# 以前每个爆炸特效都是一个完整的精灵：要进渲染组，要注册动画，要参与插值，画的时候一个精灵一次blit
+# 玩家的尾焰也是一个精灵，向上飞时每帧加进渲染组，不向上飞时每帧移出去
+# 现在这些纯装饰的东西都是粒子：
+#   同一种粒子放在同一个ParticleBuffer里，位置，速度，出生与死亡的时间各存一个列表（而不是每个粒子一个对象）
+#   更新时位置的两个列表各用一次列表推导整体算完；只有最早的死亡时间到了，才一次性剔除所有死掉的粒子
+#   绘制时同一张图片的所有粒子一次blits提交，更新屏幕时每种粒子只有一个脏矩形
+#   擦除时按格子擦，成千上万个挤在一起的粒子也只需要擦几十上百个格子
+# 粒子只负责好看，不参与碰撞，也不记录进快照
+import itertools
+import math
+import random
+import time
+
+import pygame
+
+import render
+import resource
+
+# 擦除用的格子大小，单位：像素
+CELL = 32
+
+
+class ParticleBuffer:
+    """
+    同一种粒子的缓冲区
+    图片多于一张时，每个粒子按自己的年龄轮播图片（所有图片大小必须相同）
+    """
+
+    def __init__(self, images, frame_time: float = 0.2, capacity: int = 4096):
+        """
+        :param images: 粒子的图片，可以是一张图片，也可以是一个列表
+        :param frame_time: 多张图片时每张显示多久，单位：秒
+        :param capacity: 最多同时存在多少个粒子，满了之后新的粒子直接丢弃
+        """
+        if isinstance(images, pygame.Surface):
+            images = [images]
+        self.images = images
+        self.frame_time = frame_time
+        self.capacity = capacity
+        self.width, self.height = images[0].get_size()
+        # 发射时传入的是粒子的中心，存下的是左上角，绘制时不用再换算
+        self.half_width = self.width // 2
+        self.half_height = self.height // 2
+        # 这个缓冲区自己的时钟，单位：秒。粒子的年龄就是时钟减去出生时间，更新时不用逐个增加年龄
+        self.clock = 0.0
+        self.x = []
+        self.y = []
+        self.vx = []
+        self.vy = []
+        self.born = []
+        self.death = []
+        # 最早的死亡时间，时钟没走到这里就不用检查有没有粒子死掉
+        self.next_death = math.inf
+        # 粒子不参与游戏逻辑，用单独的随机数生成器，不影响游戏本身的随机序列
+        self.random = random.Random()
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def set_images(self, images) -> None:
+        """
+        更换粒子的图片，降画质时使用，大小必须与原来相同
+        :param images: 新的图片
+        :return: 无
+        """
+        if isinstance(images, pygame.Surface):
+            images = [images]
+        self.images = images
+
+    def emit(self, x: float, y: float, vx: float = 0, vy: float = 0, life: float = 0.5) -> bool:
+        """
+        发射一个粒子
+        :param x: 中心的x坐标
+        :param y: 中心的y坐标
+        :param vx: x方向速度，单位：像素/秒
+        :param vy: y方向速度，单位：像素/秒
+        :param life: 寿命，单位：秒
+        :return: 是否发射成功（缓冲区满了时失败）
+        """
+        if len(self.x) >= self.capacity:
+            return False
+        self.x.append(x - self.half_width)
+        self.y.append(y - self.half_height)
+        self.vx.append(vx)
+        self.vy.append(vy)
+        self.born.append(self.clock)
+        self.death.append(self.clock + life)
+        self.next_death = min(self.next_death, self.clock + life)
+        return True
+
+    def burst(self, x: float, y: float, count: int, speed: tuple[float, float], life: tuple[float, float],
+              angle: float = 0, spread: float = 360) -> int:
+        """
+        从同一点向一个扇形内随机的方向发射一批粒子
+        :param x: 中心的x坐标
+        :param y: 中心的y坐标
+        :param count: 粒子数量
+        :param speed: 速度的范围，单位：像素/秒
+        :param life: 寿命的范围，单位：秒
+        :param angle: 扇形的中心方向，单位：度，0度向右，90度向下
+        :param spread: 扇形的张角，单位：度，360为四面八方
+        :return: 实际发射的数量
+        """
+        count = max(0, min(count, self.capacity - len(self.x)))
+        if not count:
+            return 0
+        uniform = self.random.uniform
+        start = math.radians(angle - spread / 2)
+        end = start + math.radians(spread)
+        angles = [uniform(start, end) for _ in range(count)]
+        speeds = [uniform(*speed) for _ in range(count)]
+        deaths = [self.clock + uniform(*life) for _ in range(count)]
+        self.x.extend([x - self.half_width] * count)
+        self.y.extend([y - self.half_height] * count)
+        self.vx.extend([math.cos(a) * s for a, s in zip(angles, speeds)])
+        self.vy.extend([math.sin(a) * s for a, s in zip(angles, speeds)])
+        self.born.extend([self.clock] * count)
+        self.death.extend(deaths)
+        self.next_death = min(self.next_death, min(deaths))
+        return count
+
+    def find_near(self, x: float, y: float, distance: float):
+        """
+        找到一个中心在(x, y)附近的粒子
+        :param x: x坐标
+        :param y: y坐标
+        :param distance: x与y方向上的距离都不超过这个值才算附近
+        :return: 粒子的下标，没有时为None
+        """
+        x -= self.half_width
+        y -= self.half_height
+        for index, (px, py) in enumerate(zip(self.x, self.y)):
+            if abs(px - x) <= distance and abs(py - y) <= distance:
+                return index
+        return None
+
+    def restart(self, index: int) -> None:
+        """
+        让一个粒子重新开始计算寿命
+        :param index: 粒子的下标
+        :return: 无
+        """
+        life = self.death[index] - self.born[index]
+        self.born[index] = self.clock
+        self.death[index] = self.clock + life
+
+    def update(self, dt: float) -> None:
+        """
+        推进所有粒子，并剔除寿命到了的粒子
+        :param dt: 经过的时间，单位：秒
+        :return: 无
+        """
+        self.clock += dt
+        if not self.x:
+            return
+        self.x = [p + v * dt for p, v in zip(self.x, self.vx)]
+        self.y = [p + v * dt for p, v in zip(self.y, self.vy)]
+        if self.clock < self.next_death:
+            return
+        clock = self.clock
+        keep = [i for i, death in enumerate(self.death) if death > clock]
+        self.x = [self.x[i] for i in keep]
+        self.y = [self.y[i] for i in keep]
+        self.vx = [self.vx[i] for i in keep]
+        self.vy = [self.vy[i] for i in keep]
+        self.born = [self.born[i] for i in keep]
+        self.death = [self.death[i] for i in keep]
+        self.next_death = min(self.death, default=math.inf)
+
+    def clear(self) -> None:
+        """
+        清除所有粒子
+        :return: 无
+        """
+        for values in (self.x, self.y, self.vx, self.vy, self.born, self.death):
+            values.clear()
+        self.next_death = math.inf
+
+    def batches(self) -> list[tuple[pygame.Surface, list]]:
+        """
+        按图片把粒子分批
+        :return: 每项为(图片, 使用这张图片的粒子左上角坐标的列表)
+        """
+        if not self.x:
+            return []
+        positions = list(zip(self.x, self.y))
+        images = self.images
+        if len(images) == 1:
+            return [(images[0], positions)]
+        clock = self.clock
+        frame_time = self.frame_time
+        count = len(images)
+        batches = [[] for _ in images]
+        for position, born in zip(positions, self.born):
+            batches[int((clock - born) / frame_time) % count].append(position)
+        return [(image, batch) for image, batch in zip(images, batches) if batch]
+
+    def bounds(self):
+        """
+        包住所有粒子的矩形
+        :return: 矩形，没有粒子时为None
+        """
+        if not self.x:
+            return None
+        left = int(min(self.x))
+        top = int(min(self.y))
+        return pygame.Rect(left, top, int(max(self.x)) - left + self.width + 1,
+                           int(max(self.y)) - top + self.height + 1)
+
+    def cells(self) -> set[tuple[float, float]]:
+        """
+        所有粒子左上角所在的格子
+        :return: 格子坐标的集合
+        """
+        return {(x // CELL, y // CELL) for x, y in zip(self.x, self.y)}
+
+
+class ParticleSystem:
+    """
+    所有粒子缓冲区的集合，对绘制后端来说它和一个精灵组一样（有draw，clear与batches）
+    缓冲区按添加的顺序绘制，后添加的盖住先添加的
+    """
+
+    def __init__(self):
+        self.buffers = []
+        # 上一次绘制时需要擦除的区域
+        self.drawn_areas = []
+        # 上一次绘制时每种粒子整体占据的区域，更新屏幕时使用
+        self.drawn_rects = []
+
+    def add(self, buffer: ParticleBuffer) -> ParticleBuffer:
+        """
+        添加一个缓冲区
+        :param buffer: 缓冲区
+        :return: 这个缓冲区
+        """
+        self.buffers.append(buffer)
+        return buffer
+
+    def __len__(self) -> int:
+        return sum(len(buffer) for buffer in self.buffers)
+
+    def update(self, dt: float) -> None:
+        """
+        推进所有粒子
+        :param dt: 经过的时间，单位：秒
+        :return: 无
+        """
+        for buffer in self.buffers:
+            buffer.update(dt)
+
+    def empty(self) -> None:
+        """
+        清除所有粒子
+        :return: 无
+        """
+        for buffer in self.buffers:
+            buffer.clear()
+
+    def batches(self) -> list[tuple[pygame.Surface, list]]:
+        """
+        按图片把所有粒子分批，顺序即绘制的先后顺序
+        :return: 每项为(图片, 左上角坐标的列表)
+        """
+        batches = []
+        for buffer in self.buffers:
+            batches.extend(buffer.batches())
+        return batches
+
+    def draw(self, surface: pygame.Surface) -> list[pygame.Rect]:
+        """
+        绘制所有粒子，每张图片一次blits
+        :param surface: 绘制到哪里
+        :return: 需要更新的区域（这次与上次绘制的区域）
+        """
+        dirty = self.drawn_rects
+        self.drawn_rects = []
+        self.drawn_areas = []
+        clip = surface.get_clip()
+        for buffer in self.buffers:
+            rect = buffer.bounds()
+            if rect is None:
+                continue
+            for image, positions in buffer.batches():
+                resource.check_prepared(image)
+                if resource.is_premultiplied(image):
+                    sequence = zip(itertools.repeat(image), positions, itertools.repeat(None),
+                                   itertools.repeat(pygame.BLEND_PREMULTIPLIED))
+                else:
+                    sequence = zip(itertools.repeat(image), positions)
+                start = time.perf_counter_ns()
+                surface.blits(sequence, doreturn=False)
+                render.STATS.add(len(positions), start)
+            # 左上角在同一个格子里的粒子，一定都在从这个格子开始，比格子大一个粒子的区域里
+            width = CELL + buffer.width
+            height = CELL + buffer.height
+            self.drawn_areas.extend((x * CELL, y * CELL, width, height) for x, y in buffer.cells())
+            rect = rect.clip(clip)
+            if rect:
+                self.drawn_rects.append(rect)
+        dirty.extend(self.drawn_rects)
+        return dirty
+
+    def clear(self, surface: pygame.Surface, background: pygame.Surface) -> None:
+        """
+        用背景擦掉上一次绘制的粒子
+        :param surface: 在哪里擦除
+        :param background: 背景图片
+        :return: 无
+        """
+        if not self.drawn_areas:
+            return
+        sequence = [(background, area, area) for area in self.drawn_areas]
+        self.drawn_areas = []
+        start = time.perf_counter_ns()
+        surface.blits(sequence, doreturn=False)
+        render.STATS.add(len(sequence), start)
@@ -0,0 +1,123 @@
+# 弹幕
+# 以前Boss的每种弹幕都直接写在Boss的方法里：放火球时每颗火球都要算一次cos与sin，连发子弹时每一轮都要重新算一次瞄准方向
+# 现在弹幕用一个字典描述，载入时编译成每一轮里每颗子弹的发射偏移与飞行方向，发射时只需要加上Boss的位置
+# 一轮弹幕的子弹先全部创建好，再一次性加入各个精灵组
+# 添加新的弹幕只需要写一个描述，不需要修改Boss
+#
+# 描述中可用的键：
+#   kind: 弹幕的种类
+#       ring: 环形，count颗子弹均匀分布在一整圈上
+#       spread: 扇形，count颗子弹均匀分布在以angle为中心，张角为arc的扇形上
+#       aimed: 瞄准，与扇形相同，但扇形的中心是发射时玩家所在的方向
+#       spiral: 螺旋，与环形相同，但每一轮转过turn度
+#   count: 每一轮有多少个方向，默认为1
+#   speed: 子弹的速度，单位：像素/秒，默认为300
+#   angle: 环形，扇形与螺旋的起始/中心角度，单位：度。0度向右，90度向下，默认为90
+#   arc: 扇形与瞄准的张角，单位：度，默认为0，即所有子弹方向相同
+#   turn: 每一轮比上一轮多转过的角度，单位：度，螺旋默认为10，其他默认为0
+#   offsets: 发射位置相对于发射者中心的偏移列表，每个方向都从每个偏移各发射一颗子弹，默认为[(0, 0)]
+#   volleys: 一共发射多少轮，默认为1
+#   interval: 两轮之间的间隔，单位：秒，默认为0
+import math
+
+KINDS = ("ring", "spread", "aimed", "spiral")
+
+
+class BulletPattern:
+    """
+    编译好的弹幕
+    用法：
+        pattern = BulletPattern("火球", {"kind": "ring", "count": 18})
+        for volley in range(pattern.volleys):
+            bullets = pattern.spawn(volley, 发射者中心, 瞄准方向, 创建子弹的函数, *精灵组)
+            等待pattern.interval秒
+    """
+
+    def __init__(self, name: str, definition: dict):
+        """
+        :param name: 弹幕的名称，出错时显示
+        :param definition: 弹幕的描述，见文件开头
+        """
+        kind = definition.get("kind")
+        if kind not in KINDS:
+            raise ValueError(f"弹幕{name}的种类{kind}不存在，可用的有：{', '.join(KINDS)}")
+        self.name = name
+        self.kind = kind
+        self.aimed = kind == "aimed"
+        self.speed = definition.get("speed", 300)
+        self.volleys = definition.get("volleys", 1)
+        self.interval = definition.get("interval", 0)
+        count = definition.get("count", 1)
+        # 瞄准的弹幕以玩家的方向为0度，发射时再旋转
+        angle = 0 if self.aimed else definition.get("angle", 90)
+        arc = definition.get("arc", 0)
+        turn = definition.get("turn", 10 if kind == "spiral" else 0)
+        offsets = definition.get("offsets", [(0, 0)])
+
+        if kind in ("ring", "spiral"):
+            angles = [angle + 360 * i / count for i in range(count)]
+        elif count > 1:
+            angles = [angle - arc / 2 + arc * i / (count - 1) for i in range(count)]
+        else:
+            angles = [angle]
+        # 每一轮的子弹：(x偏移, y偏移, x方向, y方向)
+        self.shots = []
+        for volley in range(self.volleys):
+            shots = []
+            for one_angle in angles:
+                radians = math.radians(one_angle + turn * volley)
+                dx = math.cos(radians)
+                dy = math.sin(radians)
+                for x, y in offsets:
+                    shots.append((x, y, dx, dy))
+            self.shots.append(tuple(shots))
+
+    def spawn(self, volley: int, center, aim, create, *groups) -> list:
+        """
+        发射一轮弹幕
+        :param volley: 第几轮，从0开始
+        :param center: 发射者的中心
+        :param aim: 瞄准的弹幕发射的方向（单位向量），为None时向下发射。其他种类的弹幕忽略这个参数
+        :param create: 创建一颗子弹的函数，参数为(中心, 方向, 速度)，返回还没有加入任何组的子弹
+        :param groups: 子弹要加入的组
+        :return: 这一轮的所有子弹
+        """
+        cx, cy = center
+        shots = self.shots[volley]
+        speed = self.speed
+        if self.aimed:
+            # 把以x轴正方向为0度的方向旋转到瞄准方向
+            ax, ay = (0, 1) if aim is None else aim
+            bullets = [create((cx + x, cy + y), (dx * ax - dy * ay, dx * ay + dy * ax), speed)
+                       for x, y, dx, dy in shots]
+        else:
+            bullets = [create((cx + x, cy + y), (dx, dy), speed) for x, y, dx, dy in shots]
+        for group in groups:
+            group.add(bullets)
+        return bullets
+
+
+def compile_patterns(definitions: dict) -> dict:
+    """
+    编译一组弹幕
+    :param definitions: 弹幕名称到描述的字典
+    :return: 弹幕名称到BulletPattern的字典
+    """
+    return {name: BulletPattern(name, definition) for name, definition in definitions.items()}
+
+
+def aim_at(source, target):
+    """
+    计算从source指向target的单位向量
+    :param source: 起点
+    :param target: 终点，为None时返回None
+    :return: 单位向量，两点重合或没有终点时为None
+    """
+    if target is None:
+        return None
+    dx = target[0] - source[0]
+    dy = target[1] - source[1]
+    distance = math.hypot(dx, dy)
+    if distance == 0:
+        return None
+    return dx / distance, dy / distance
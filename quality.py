@@ -0,0 +1,135 @@
+# 画质调节器
+# 游戏卡的时候（一帧的耗时超过MAX_RATE对应的时间），自动分级降低特效质量；不卡了再逐级恢复
+# 降的只有"好看"的东西（爆炸动画之类），子弹，敌机这些影响玩法的东西一个都不会少
+from collections import deque
+
+
+# 各个画质等级的含义
+# 0: 满画质
+# 1: 爆炸特效不再轮播图片（跳过爆炸动画帧）
+# 2: 在1的基础上，重叠的爆炸特效合并为一个
+# 3: 在2的基础上，限制同时存在的纯装饰用爆炸特效的数量
+# 从1开始，每降一级，每次爆炸的碎片粒子再减少一半
+FULL_QUALITY = 0
+SKIP_ANIMATION = 1
+MERGE_EXPLOSION = 2
+CAP_COSMETIC = 3
+LOWEST_QUALITY = CAP_COSMETIC
+
+
+class QualityGovernor:
+    """
+    画质调节器，根据最近一段时间的平均帧耗时决定当前画质等级
+    用法：每帧调用一次self.feed(本帧耗时)，然后读取self.level决定特效怎么画
+    self.level是公开的，跑分之类的程序直接读它（或者self.history）就能知道画质被降到了多少
+    """
+
+    def __init__(self, max_rate, window: int = 30, down_ratio: float = 1.15, up_ratio: float = 0.75,
+                 hold_frames: int = 60, cosmetic_cap: int = 8, merge_distance: int = 30):
+        """
+        创建一个画质调节器
+        :param max_rate: 帧率上限，也就是configure.py里的MAX_RATE。为None时按60帧计算预算
+        :param window: 计算平均帧耗时所用的帧数
+        :param down_ratio: 平均帧耗时超过预算的这么多倍时降一级画质
+        :param up_ratio: 平均帧耗时低于预算的这么多倍时升一级画质
+        :param hold_frames: 每次调整画质后至少等这么多帧才能再次调整，防止画质来回横跳
+        :param cosmetic_cap: 画质为CAP_COSMETIC时，同时存在的装饰用爆炸特效的最大数量
+        :param merge_distance: 画质不低于MERGE_EXPLOSION时，中心距离小于该值（像素）的爆炸特效会被合并
+        """
+        # 每帧的时间预算，单位：毫秒
+        self.budget = 1000 / (max_rate if max_rate is not None else 60)
+        self.down_ratio = down_ratio
+        self.up_ratio = up_ratio
+        self.hold_frames = hold_frames
+        self.cosmetic_cap = cosmetic_cap
+        self.merge_distance = merge_distance
+
+        self.frame_times = deque(maxlen=window)
+        # 用累加和计算平均值，不用每帧都sum一遍
+        self.total_time = 0
+        self.hold = hold_frames
+        self.level = FULL_QUALITY
+        # 画质变化记录，每项为(第几帧, 新的画质等级)，给跑分程序用
+        self.history = [(0, FULL_QUALITY)]
+        self.frame_count = 0
+
+    @property
+    def average(self) -> float:
+        """
+        最近window帧的平均帧耗时，单位：毫秒
+        """
+        if not self.frame_times:
+            return 0
+        return self.total_time / len(self.frame_times)
+
+    def feed(self, frame_time) -> int:
+        """
+        记录一帧的耗时，并在需要时调整画质
+        :param frame_time: 这一帧的耗时，单位：毫秒（不含限制帧率时等待的时间，即clock.get_rawtime()）
+        :return: 调整后的画质等级
+        """
+        self.frame_count += 1
+        if len(self.frame_times) == self.frame_times.maxlen:
+            self.total_time -= self.frame_times[0]
+        self.frame_times.append(frame_time)
+        self.total_time += frame_time
+
+        self.hold -= 1
+        # 样本不够或刚调整过，先不动
+        if self.hold > 0 or len(self.frame_times) < self.frame_times.maxlen:
+            return self.level
+        average = self.average
+        if average > self.budget * self.down_ratio and self.level < LOWEST_QUALITY:
+            self.set_level(self.level + 1)
+        elif average < self.budget * self.up_ratio and self.level > FULL_QUALITY:
+            self.set_level(self.level - 1)
+        return self.level
+
+    def set_level(self, level: int) -> None:
+        """
+        手动设置画质等级，同时重新开始计算调整间隔
+        :param level: 新的画质等级
+        :return: 无
+        """
+        level = max(FULL_QUALITY, min(LOWEST_QUALITY, level))
+        self.hold = self.hold_frames
+        if level != self.level:
+            self.level = level
+            self.history.append((self.frame_count, level))
+
+    def explosion_images(self, images: list):
+        """
+        根据画质等级决定爆炸特效用哪些图片
+        :param images: 满画质下爆炸特效轮播的图片
+        :return: 实际应当使用的图片列表，降画质时只有一张，不再轮播
+        """
+        if self.level >= SKIP_ANIMATION:
+            return images[:1]
+        return images
+
+    def merge_target(self, center, explosions):
+        """
+        找到新的爆炸特效应当被合并进去的那个爆炸特效
+        :param center: 新的爆炸特效的中心
+        :param explosions: 目前还在显示的爆炸火光粒子（particle.ParticleBuffer）
+        :return: 应当合并进去的粒子的下标，不需要合并时返回None
+        """
+        if self.level < MERGE_EXPLOSION:
+            return None
+        return explosions.find_near(center[0], center[1], self.merge_distance)
+
+    def particle_count(self, count: int) -> int:
+        """
+        根据画质等级决定一次爆炸发射多少碎片粒子
+        :param count: 满画质下的数量
+        :return: 实际应当发射的数量
+        """
+        return count >> self.level
+
+    def over_cap(self, cosmetic_count: int) -> bool:
+        """
+        判断装饰用的爆炸特效是否已经太多了
+        :param cosmetic_count: 目前装饰用的爆炸特效的数量
+        :return: 是否不应该再显示新的爆炸特效
+        """
+        return self.level >= CAP_COSMETIC and cosmetic_count >= self.cosmetic_cap
@@ -0,0 +1,444 @@
+# 批量绘制
+# pygame自带的RenderUpdates.draw对每个精灵调用一次blit，子弹一多，Python调用本身的开销就占了绘制时间的大半
+# 这里的BatchRenderUpdates先把这一帧要画的(图片, 位置)整理成一个列表，再用Surface.blits（pygame-ce中为fblits）一次提交
+# 使用同一张图片的精灵（比如同一种子弹）会被排在一起提交
+# 经过resource.prepare预乘了透明度的图片会自动使用BLEND_PREMULTIPLIED混合，没有转换过的图片会被警告
+# 它可以直接替换RenderUpdates，返回的脏矩形与原来完全一致
+#
+# 另外这里还有两种绘制后端，它们对外提供同样的接口（reset, draw, erase, capture, present, toggle_fullscreen）：
+# SoftwareBackend：原来的做法，在display.set_mode得到的画布上blit，只更新脏区域
+# TextureBackend：用pygame._sdl2.video的Renderer与Texture绘制，每张图片只上传一次成为纹理，之后每帧整屏重画
+# NullBackend：什么都不画，分进程模式下的模拟进程使用（画面由绘制进程负责）
+# 设置环境变量SDL_RENDER_DRIVER=software或者传入driver="software"时，TextureBackend使用SDL的软件渲染器，没有显卡也能运行
+import time
+import weakref
+
+import pygame
+
+import resource
+
+
+class RenderStats:
+    """
+    绘制统计：这一帧一共提交了多少次blit，提交花了多少时间
+    每帧开始时调用reset，各个组绘制时会自动累加
+    """
+
+    def __init__(self):
+        # 这一帧的blit次数（包括擦除）
+        self.blits = 0
+        # 这一帧的提交次数，一次提交包含很多次blit
+        self.submits = 0
+        # 这一帧提交blit花的时间，单位：毫秒
+        self.submit_time = 0.0
+        # 上一帧的数据，供帧率显示等在新一帧开始后读取
+        self.last_blits = 0
+        self.last_submit_time = 0.0
+
+    def reset(self) -> None:
+        """
+        开始新的一帧
+        :return: 无
+        """
+        self.last_blits = self.blits
+        self.last_submit_time = self.submit_time
+        self.blits = 0
+        self.submits = 0
+        self.submit_time = 0.0
+
+    def add(self, blits: int, start: int) -> None:
+        """
+        记录一次提交
+        :param blits: 这次提交包含多少次blit
+        :param start: 开始提交的时间，time.perf_counter_ns()
+        :return: 无
+        """
+        self.blits += blits
+        self.submits += 1
+        self.submit_time += (time.perf_counter_ns() - start) / 1e6
+
+
+# 整个游戏共用的绘制统计
+STATS = RenderStats()
+
+
+def group_by_image(sprites) -> dict:
+    """
+    按图片把精灵分批，同一张图片的精灵在批内保持原来的先后顺序
+    :param sprites: 精灵
+    :return: 图片到使用这张图片的精灵列表的字典，字典的顺序为每张图片第一次出现的顺序
+    """
+    batches = {}
+    for sprite in sprites:
+        batch = batches.get(sprite.image)
+        if batch is None:
+            batches[sprite.image] = [sprite]
+        else:
+            batch.append(sprite)
+    return batches
+
+
+# pygame-ce中才有的fblits：不返回矩形，比blits更快
+_HAS_FBLITS = hasattr(pygame.Surface, "fblits")
+
+
+class BatchRenderUpdates(pygame.sprite.RenderUpdates):
+    """
+    批量提交blit的RenderUpdates
+    """
+
+    def draw(self, surface: pygame.Surface, bgsurf=None, special_flags: int = 0) -> list[pygame.Rect]:
+        """
+        绘制组中所有精灵
+        :param surface: 绘制到哪里
+        :param bgsurf: 没有用到，与RenderUpdates保持一致
+        :param special_flags: blit的混合模式
+        :return: 需要更新的区域
+        """
+        ordered = []
+        sequence = []
+        premultiplied = False
+        for image, sprites in group_by_image(self.sprites()).items():
+            ordered.extend(sprites)
+            resource.check_prepared(image)
+            if resource.is_premultiplied(image):
+                premultiplied = True
+                sequence.extend((image, sprite.rect, None, pygame.BLEND_PREMULTIPLIED) for sprite in sprites)
+            elif special_flags:
+                sequence.extend((image, sprite.rect, None, special_flags) for sprite in sprites)
+            else:
+                sequence.extend((image, sprite.rect) for sprite in sprites)
+
+        start = time.perf_counter_ns()
+        # fblits只能给整批图片指定同一种混合模式，有预乘透明度的图片时只能用blits
+        if _HAS_FBLITS and not premultiplied:
+            # fblits只接受(图片, 位置)，混合模式作为第二个参数统一指定
+            if special_flags:
+                sequence = [(image, dest) for image, dest, _, _ in sequence]
+            surface.fblits(sequence, special_flags)
+            # fblits不返回矩形，自己按blit的规则算出实际画到的区域
+            clip = surface.get_clip()
+            new_rects = [pygame.Rect(sprite.rect.topleft, sprite.image.get_size()).clip(clip)
+                         for sprite in ordered]
+        else:
+            new_rects = surface.blits(sequence, doreturn=True)
+        STATS.add(len(sequence), start)
+
+        dirty = self.lostsprites
+        self.lostsprites = []
+        dirty_append = dirty.append
+        spritedict = self.spritedict
+        for sprite, new_rect in zip(ordered, new_rects):
+            old_rect = spritedict[sprite]
+            if old_rect:
+                if new_rect.colliderect(old_rect):
+                    dirty_append(new_rect.union(old_rect))
+                else:
+                    dirty_append(new_rect)
+                    dirty_append(old_rect)
+            else:
+                dirty_append(new_rect)
+            spritedict[sprite] = new_rect
+        return dirty
+
+    def batches(self) -> list[tuple[pygame.Surface, list]]:
+        """
+        按图片把精灵分批，纹理绘制使用，顺序与draw相同
+        :return: 每项为(图片, 使用这张图片的精灵左上角坐标的列表)
+        """
+        return [(image, [sprite.rect.topleft for sprite in sprites])
+                for image, sprites in group_by_image(self.sprites()).items()]
+
+    def clear(self, surface: pygame.Surface, bgd) -> None:
+        """
+        用背景擦掉所有精灵上一次绘制的位置
+        :param surface: 在哪里擦除
+        :param bgd: 背景图片，或者一个接受(surface, rect)的函数
+        :return: 无
+        """
+        if callable(bgd):
+            super().clear(surface, bgd)
+            return
+        sequence = [(bgd, rect, rect) for rect in self.lostsprites]
+        sequence.extend((bgd, rect, rect) for rect in self.spritedict.values() if rect)
+        # 擦除需要指定源区域，fblits不支持，只能用blits
+        start = time.perf_counter_ns()
+        surface.blits(sequence, doreturn=False)
+        STATS.add(len(sequence), start)
+
+
+class SoftwareBackend:
+    """
+    软件绘制：所有东西画在display.set_mode得到的画布上，每帧只更新变化了的区域
+    """
+    name = "software"
+
+    def __init__(self, size: tuple[int, int], driver: str = None, vsync: bool = False):
+        """
+        创建游戏窗口
+        :param size: 窗口大小
+        :param driver: 没有用到，与TextureBackend保持一致
+        :param vsync: 没有用到，pygame只有OPENGL或SCALED窗口才支持垂直同步，由帧率控制（见pacing.py）对齐刷新
+        """
+        self.size = size
+        self.screen = pygame.display.set_mode(size, 0, pygame.display.mode_ok(size, 0, 32))
+        self.background = pygame.Surface(size)
+        self.fullscreen = False
+        # 这一帧待更新的区域
+        self.dirty_rects = []
+
+    def reset(self, background: pygame.Surface) -> None:
+        """
+        用背景盖住整个屏幕，每局游戏开始前调用
+        :param background: 与屏幕一样大的背景
+        :return: 无
+        """
+        self.background = background
+        self.screen.blit(background, (0, 0))
+        pygame.display.flip()
+        self.dirty_rects = []
+
+    def draw(self, group: BatchRenderUpdates) -> None:
+        """
+        擦掉一个组上一次画的内容，再画出它现在的样子
+        :param group: 精灵组
+        :return: 无
+        """
+        group.clear(self.screen, self.background)
+        self.dirty_rects.extend(group.draw(self.screen))
+
+    def redraw(self, group: BatchRenderUpdates) -> None:
+        """
+        不擦除，直接再画一遍这个组，切换全屏后使用
+        :param group: 精灵组
+        :return: 无
+        """
+        self.dirty_rects.extend(group.draw(self.screen))
+
+    def erase(self, group: BatchRenderUpdates) -> None:
+        """
+        擦掉一个组上一次画的内容
+        :param group: 精灵组
+        :return: 无
+        """
+        group.clear(self.screen, self.background)
+
+    def capture(self, surface: pygame.Surface) -> None:
+        """
+        把这一帧画好的画面复制到surface上，必须在present之前调用
+        :param surface: 与屏幕一样大的图片
+        :return: 无
+        """
+        surface.blit(self.screen, (0, 0))
+
+    def present(self) -> None:
+        """
+        把这一帧画的内容显示出来
+        :return: 无
+        """
+        pygame.display.update(self.dirty_rects)
+        self.dirty_rects = []
+
+    def toggle_fullscreen(self) -> None:
+        """
+        切换全屏与窗口模式，保留屏幕上已经画好的内容
+        :return: 无
+        """
+        flags = 0 if self.fullscreen else pygame.FULLSCREEN
+        screen_backup = self.screen.copy()
+        self.screen = pygame.display.set_mode(self.size, flags, pygame.display.mode_ok(self.size, flags, 32))
+        self.screen.blit(screen_backup, (0, 0))
+        self.fullscreen = not self.fullscreen
+
+
+class TextureBackend:
+    """
+    纹理绘制：用SDL的Renderer绘制，图片第一次被画时上传成纹理，之后一直复用
+    纹理绘制没有“画布上留着上一帧”的概念，所以每个组最后一次画出的内容都会被记下来，每帧按顺序整屏重画，
+    效果与软件绘制一致：不再画的组停在最后一次画的样子，erase过的组消失，后画的组盖住先画的组
+    """
+    name = "texture"
+
+    def __init__(self, size: tuple[int, int], driver: str = None, vsync: bool = False):
+        """
+        创建游戏窗口
+        :param size: 窗口大小
+        :param driver: SDL渲染器的名称，比如"software"，"opengl"，为None时由SDL选择
+        :param vsync: 是否让present等待屏幕刷新（垂直同步）
+        """
+        from pygame._sdl2 import video
+
+        self.size = size
+        # 图片的convert/convert_alpha需要display模块里有一个窗口，这里建一个隐藏的小窗口，真正的画面显示在self.window中
+        pygame.display.set_mode((1, 1), pygame.HIDDEN)
+        self.window = video.Window(pygame.display.get_caption()[0] or "pygame", size)
+        index = -1
+        if driver is not None:
+            names = [info.name for info in video.get_drivers()]
+            if driver not in names:
+                raise ValueError(f"SDL没有名为{driver}的渲染器，可用的有：{', '.join(names)}")
+            index = names.index(driver)
+        self.renderer = video.Renderer(self.window, index, vsync=vsync)
+        self.texture_class = video.Texture
+        # 图片到纹理的对应关系，图片被回收后纹理也会一起被回收
+        self.textures = weakref.WeakKeyDictionary()
+        self.background = None
+        # 每个组最后一次画出的内容，字典的顺序就是绘制的先后顺序
+        self.layers = {}
+        # 这一帧是否已经画到了渲染器上（录像时会提前画）
+        self.composed = False
+        self.fullscreen = False
+
+    def texture(self, image: pygame.Surface):
+        """
+        获取图片对应的纹理，第一次使用时上传
+        :param image: 图片
+        :return: 纹理，图片大小为0时返回None
+        """
+        texture = self.textures.get(image)
+        if texture is None:
+            if image.get_width() == 0 or image.get_height() == 0:
+                return None
+            # 纹理使用普通的透明度混合，预乘过透明度的图片要上传原图
+            texture = self.textures[image] = self.texture_class.from_surface(self.renderer,
+                                                                             resource.straight_alpha(image))
+        return texture
+
+    def reset(self, background: pygame.Surface) -> None:
+        """
+        清空所有记下的内容，只显示背景，每局游戏开始前调用
+        :param background: 与屏幕一样大的背景
+        :return: 无
+        """
+        self.background = self.texture(background)
+        self.layers = {}
+        self.present()
+
+    def draw(self, group: BatchRenderUpdates) -> None:
+        """
+        记下一个组现在的样子，并把它放到最上层
+        :param group: 精灵组，或者其他有batches方法的对象（比如粒子系统）
+        :return: 无
+        """
+        self.layers.pop(group, None)
+        layer = []
+        # 与软件绘制使用同样的顺序，两种后端画出的画面才会一样
+        for image, positions in group.batches():
+            texture = self.texture(image)
+            if texture is None:
+                continue
+            size = image.get_size()
+            layer.extend((texture, pygame.Rect(position, size)) for position in positions)
+        self.layers[group] = layer
+        self.composed = False
+
+    redraw = draw
+
+    def erase(self, group: BatchRenderUpdates) -> None:
+        """
+        不再显示一个组
+        :param group: 精灵组
+        :return: 无
+        """
+        self.layers.pop(group, None)
+        self.composed = False
+
+    def capture(self, surface: pygame.Surface) -> None:
+        """
+        把这一帧的画面复制到surface上，必须在present之前调用
+        :param surface: 与窗口一样大的图片
+        :return: 无
+        """
+        if not self.composed:
+            self._compose()
+        self.renderer.to_surface(surface)
+
+    def present(self) -> None:
+        """
+        整屏重画并显示出来
+        :return: 无
+        """
+        if not self.composed:
+            self._compose()
+        self.renderer.present()
+        self.composed = False
+
+    def _compose(self) -> None:
+        renderer = self.renderer
+        start = time.perf_counter_ns()
+        renderer.clear()
+        blits = 0
+        if self.background is not None:
+            self.background.draw()
+            blits += 1
+        for layer in self.layers.values():
+            for texture, rect in layer:
+                texture.draw(dstrect=rect)
+            blits += len(layer)
+        STATS.add(blits, start)
+        self.composed = True
+
+    def toggle_fullscreen(self) -> None:
+        """
+        切换全屏与窗口模式
+        :return: 无
+        """
+        if self.fullscreen:
+            self.window.set_windowed()
+        else:
+            self.window.set_fullscreen()
+        self.fullscreen = not self.fullscreen
+
+
+class NullBackend:
+    """
+    不绘制任何东西，也不显示窗口
+    图片转换为绘制最快的格式时需要一个显示模式，所以仍然会创建一个隐藏的1x1窗口
+    """
+    name = "null"
+
+    def __init__(self, size: tuple[int, int], driver: str = None, vsync: bool = False):
+        """
+        :param size: 游戏画面的大小，只是记下来
+        :param driver: 没有用到，与TextureBackend保持一致
+        :param vsync: 没有用到，与TextureBackend保持一致
+        """
+        self.size = size
+        self.screen = pygame.display.set_mode((1, 1), pygame.HIDDEN)
+        self.fullscreen = False
+
+    def reset(self, background: pygame.Surface) -> None:
+        pass
+
+    def draw(self, group) -> None:
+        pass
+
+    redraw = draw
+    erase = draw
+
+    def capture(self, surface: pygame.Surface) -> None:
+        pass
+
+    def present(self) -> None:
+        pass
+
+    def toggle_fullscreen(self) -> None:
+        self.fullscreen = not self.fullscreen
+
+
+# 可以使用的绘制后端
+BACKENDS = {backend.name: backend for backend in (SoftwareBackend, TextureBackend, NullBackend)}
+
+
+def create_backend(name: str, size: tuple[int, int], driver: str = None, vsync: bool = False):
+    """
+    按名称创建绘制后端
+    :param name: "software"，"texture"或"null"
+    :param size: 窗口大小
+    :param driver: 纹理绘制使用的SDL渲染器名称
+    :param vsync: 是否开启垂直同步（只有纹理绘制支持）
+    :return: 绘制后端
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"没有名为{name}的绘制后端，可用的有：{', '.join(BACKENDS)}")
+    return BACKENDS[name](size, driver, vsync)
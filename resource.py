@@ -1,5 +1,12 @@
+import weakref
+
 import pygame
 
+import log
+import tracing
+
+logger = log.get_logger("resource")
+
 
 if not pygame.get_init():
     pygame.init()
@@ -11,6 +18,15 @@ IMAGE_SUFFIX = ["bmp"] if not pygame.image.get_extended()\
 AUDIO_SUFFIX = ['wav', 'mp3', 'ogg', 'midi']
 FONT_SUFFIX = ['ttf']
 
+# 已经转换为绘制格式的图片
+_prepared = weakref.WeakSet()
+# 预乘透明度的图片到它原来的（没有预乘的）图片
+_straight = weakref.WeakKeyDictionary()
+# 已经警告过没有转换的图片，每张图片只警告一次
+_warned = weakref.WeakSet()
+# 完全不透明的图片用来当透明色的颜色，按顺序选第一个图片中没有用到的
+COLORKEY_CANDIDATES = [(255, 0, 255), (0, 255, 255), (1, 2, 3), (254, 1, 253)]
+
 
 def load_image(file, crucial: bool = 1, default=None) -> pygame.surface.Surface:
     """
@@ -21,14 +37,15 @@ def load_image(file, crucial: bool = 1, default=None) -> pygame.surface.Surface:
     :param default: 在crucial为否且文件打开失败时返回
     :return: 图片创建后的surface对象
     """
-    try:
-        result = pygame.image.load(file)
-    except (pygame.error, FileNotFoundError) as error:
-        if crucial:
-            raise
-        else:
-            print(f"缺失图片{file}: {str(error)}")
-            return default
+    with tracing.TRACER.span(f"load {file}", "asset"):
+        try:
+            result = pygame.image.load(file)
+        except (pygame.error, FileNotFoundError) as error:
+            if crucial:
+                raise
+            else:
+                logger.warning("缺失图片%s: %s", file, error)
+                return default
     return result
 
 
@@ -41,14 +58,15 @@ def load_sound(file, crucial: bool = 1, default=None) -> pygame.mixer.Sound:
     :param default: 在crucial为否且文件打开失败时返回
     :return: pygame.mixer.Sound对象
     """
-    try:
-        result = pygame.mixer.Sound(file)
-    except (pygame.error, FileNotFoundError) as error:
-        if crucial:
-            raise
-        else:
-            print(f"缺失音效{file}: {str(error)}")
-            return default
+    with tracing.TRACER.span(f"load {file}", "asset"):
+        try:
+            result = pygame.mixer.Sound(file)
+        except (pygame.error, FileNotFoundError) as error:
+            if crucial:
+                raise
+            else:
+                logger.warning("缺失音效%s: %s", file, error)
+                return default
     return result
 
 
@@ -61,14 +79,15 @@ def load_font(file, crucial: bool = 1, font_size=30, default=None) -> pygame.fon
     :param default: 在crucial为否且文件打开失败时返回
     :return: font.Font对象
     """
-    try:
-        result = pygame.font.Font(file, font_size)
-    except (FileNotFoundError, pygame.error) as error:
-        if crucial:
-            raise
-        else:
-            print(f"缺失字体{file}: {str(error)}")
-            return default
+    with tracing.TRACER.span(f"load {file}", "asset"):
+        try:
+            result = pygame.font.Font(file, font_size)
+        except (FileNotFoundError, pygame.error) as error:
+            if crucial:
+                raise
+            else:
+                logger.warning("缺失字体%s: %s", file, error)
+                return default
     return result
 
 
@@ -80,13 +99,14 @@ def load_bgm(file, crucial: bool = 1) -> None:
     :param crucial: 表示该文件是否必须。是：该文件打开失败会引发异常 否：该文件打开失败只会产生警告，不引发异常
     :return: 无
     """
-    try:
-        pygame.mixer.music.load(file)
-    except (pygame.error, FileNotFoundError) as error:
-        if crucial:
-            raise
-        else:
-            print(f"缺失背景音乐{file}: {str(error)}")
+    with tracing.TRACER.span(f"load {file}", "asset"):
+        try:
+            pygame.mixer.music.load(file)
+        except (pygame.error, FileNotFoundError) as error:
+            if crucial:
+                raise
+            else:
+                logger.warning("缺失背景音乐%s: %s", file, error)
 
 
 def load(file, crucial: bool = 1, default=None, font_size=30):
@@ -109,3 +129,92 @@ def load(file, crucial: bool = 1, default=None, font_size=30):
     if file.split('.')[-1] in FONT_SUFFIX:
         return load_font(file, crucial, font_size, default)
     return default
+
+
+def _pick_colorkey(surface: pygame.Surface, visible: pygame.mask.Mask):
+    """
+    找一个图片中可见的部分没有用到的颜色作为透明色
+    :param surface: 图片
+    :param visible: 图片中可见部分的遮罩
+    :return: 颜色，全都被用到时返回None
+    """
+    for color in COLORKEY_CANDIDATES:
+        used = pygame.mask.from_threshold(surface, color, (1, 1, 1, 255))
+        if used.overlap_area(visible, (0, 0)) == 0:
+            return color
+    return None
+
+
+def prepare(surface: pygame.Surface, opaque: bool = False, translucent: bool = False) -> pygame.Surface:
+    """
+    把图片转换为与屏幕相同的、绘制最快的格式，所有要画到屏幕上的图片都应该经过这一步
+    - 完全不透明（opaque为真，比如背景）：直接convert
+    - 每个像素要么完全透明要么完全不透明：convert后设置透明色，并使用RLE压缩，绘制时直接跳过透明的部分
+    - 有半透明的像素：convert_alpha后预乘透明度，绘制时使用BLEND_PREMULTIPLIED混合
+    必须在创建窗口之后调用。已经转换过的图片原样返回
+    需要翻转，缩放等变换时，先变换原图，再分别转换每张图，不要变换已经转换过的图片
+    :param surface: 图片
+    :param opaque: 图片是否完全不透明（忽略图片中的透明色与透明度）
+    :param translucent: 已知图片有半透明的像素（比如抗锯齿的文字）时为真，不再检查能否使用透明色，直接预乘透明度
+    :return: 转换后的图片
+    """
+    if surface in _prepared:
+        return surface
+    if opaque:
+        result = surface.convert()
+        result.set_colorkey(None)
+    elif not surface.get_flags() & pygame.SRCALPHA:
+        result = surface.convert()
+        colorkey = surface.get_colorkey()
+        if colorkey is not None:
+            result.set_colorkey(colorkey, pygame.RLEACCEL)
+    else:
+        converted = surface.convert_alpha()
+        colorkey = None
+        if not translucent:
+            visible = pygame.mask.from_surface(converted, 0)
+            solid = pygame.mask.from_surface(converted, 254)
+            if visible.count() == solid.count():
+                colorkey = _pick_colorkey(converted, visible)
+        if colorkey is not None:
+            result = pygame.Surface(converted.get_size()).convert()
+            result.fill(colorkey)
+            result.blit(converted, (0, 0))
+            result.set_colorkey(colorkey, pygame.RLEACCEL)
+        else:
+            result = converted.premul_alpha()
+            _straight[result] = converted
+    _prepared.add(result)
+    return result
+
+
+def is_premultiplied(surface: pygame.Surface) -> bool:
+    """
+    图片是否被prepare预乘了透明度，这样的图片绘制时需要使用BLEND_PREMULTIPLIED
+    :param surface: 图片
+    :return: 是否预乘了透明度
+    """
+    return surface in _straight
+
+
+def straight_alpha(surface: pygame.Surface) -> pygame.Surface:
+    """
+    获取没有预乘透明度的图片，给不支持预乘透明度的地方（比如纹理）使用
+    :param surface: 图片
+    :return: 没有预乘透明度的图片，surface没有预乘时返回它自己
+    """
+    return _straight.get(surface, surface)
+
+
+def check_prepared(surface: pygame.Surface) -> bool:
+    """
+    检查图片是否已经转换，没有转换时打印警告（每张图片只警告一次）
+    :param surface: 图片
+    :return: 是否已经转换
+    """
+    if surface in _prepared or surface.get_width() == 0 or surface.get_height() == 0:
+        return True
+    if surface not in _warned:
+        _warned.add(surface)
+        logger.warning("图片没有经过resource.prepare转换，绘制时会很慢: %s", surface)
+    return False
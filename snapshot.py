@@ -0,0 +1,245 @@
+# 游戏状态快照
+# 每隔几步模拟把场上所有会动的东西（位置，速度，各种计时器）记到一个固定大小的环形缓冲区里
+# 有了这些快照就可以：倒带回几秒前，回到Boss放技能之前的那一刻，找出从什么时候开始变卡
+# 快照只记录精灵对象本身的引用与它们的少量属性，不复制图片，所以记录一次只要几十微秒，正式版也可以一直开着
+from collections import deque
+from operator import attrgetter
+
+
+class Snapshot:
+    """
+    一次快照，记录某一步的全部模拟状态
+    """
+    __slots__ = ('tick', 'frame_time', 'boss_health', 'score', 'boss_fight', 'boss', 'entities',
+                 'label')
+
+    def __init__(self, tick, frame_time, boss_health, score, boss_fight, boss, entities, label=None):
+        """
+        :param tick: 这是第几步模拟的状态
+        :param frame_time: 上一次快照到这一次快照之间最慢的一帧的耗时，单位：毫秒
+        :param boss_health: Boss的血量
+        :param score: 玩家的得分
+        :param boss_fight: 是否处于Boss战
+        :param boss: Boss对象，不存在时为None
+        :param entities: 每个精灵的状态，见capture_sprites
+        :param label: 快照的说明，一般只有检查点才有
+        """
+        self.tick = tick
+        self.frame_time = frame_time
+        self.boss_health = boss_health
+        self.score = score
+        self.boss_fight = boss_fight
+        self.boss = boss
+        self.entities = entities
+        self.label = label
+
+
+# 每个类对应的属性读取器，第一次用到某个类时生成
+_getters = {}
+
+
+def _state_getter(cls):
+    """
+    获取一次性读出cls.state_fields中所有属性的函数
+    :param cls: 精灵的类
+    :return: 一个函数，传入精灵，返回由这些属性组成的元组
+    """
+    getter = _getters.get(cls)
+    if getter is None:
+        fields = cls.state_fields
+        if len(fields) == 0:
+            getter = lambda sprite: ()
+        elif len(fields) == 1:
+            # attrgetter只有一个属性时不返回元组，这里包装一下
+            single = attrgetter(fields[0])
+            getter = lambda sprite: (single(sprite),)
+        else:
+            getter = attrgetter(*fields)
+        _getters[cls] = getter
+    return getter
+
+
+def get_state(sprite) -> tuple:
+    """
+    读出一个精灵需要保存的属性。精灵可以自己定义get_state来处理列表之类会被原地修改的属性
+    :param sprite: 精灵
+    :return: 属性值组成的元组，顺序与sprite.state_fields一致
+    """
+    return _state_getter(type(sprite))(sprite)
+
+
+def set_state(sprite, state: tuple) -> None:
+    """
+    把get_state读出的属性写回精灵
+    :param sprite: 精灵
+    :param state: get_state的返回值
+    :return: 无
+    """
+    for field, value in zip(type(sprite).state_fields, state):
+        setattr(sprite, field, value)
+
+
+def capture_sprites(groups) -> tuple:
+    """
+    记录若干组中所有精灵的状态
+    :param groups: 需要记录的精灵组（或精灵列表），同一个精灵在多个组中出现也只会记录一次
+    :return: 每项为(精灵, 精灵所在的组, 精灵的矩形, 精灵的浮点位置, 精灵的属性)
+    """
+    entities = []
+    seen = set()
+    for group in groups:
+        for sprite in group:
+            if sprite in seen:
+                continue
+            seen.add(sprite)
+            entities.append((sprite, sprite.groups(), sprite.rect.copy(), (sprite.x, sprite.y), sprite.get_state()))
+    return tuple(entities)
+
+
+def restore_sprites(entities) -> None:
+    """
+    把capture_sprites记录的精灵恢复到记录时的状态，并放回它们当时所在的组
+    已经被kill的精灵也会复活
+    :param entities: capture_sprites的返回值
+    :return: 无
+    """
+    for sprite, groups, rect, (x, y), state in entities:
+        sprite.rect = rect.copy()
+        sprite.x = x
+        sprite.y = y
+        sprite.set_state(state)
+        sprite.add(*groups)
+
+
+class SnapshotRing:
+    """
+    固定大小的快照环形缓冲区，满了以后新的快照会覆盖最旧的快照
+    另外还单独保存少量带说明的检查点（比如Boss放技能之前），它们不会被普通快照挤掉
+    """
+
+    def __init__(self, capacity: int = 64, interval: int = 30, checkpoint_count: int = 8):
+        """
+        创建一个快照缓冲区
+        :param capacity: 最多保存多少个快照
+        :param interval: 每隔多少步模拟记录一次快照
+        :param checkpoint_count: 最多保存多少个检查点
+        """
+        self.capacity = capacity
+        self.interval = interval
+        self.slots = [None] * capacity
+        # 下一个快照要写入的位置
+        self.head = 0
+        self.count = 0
+        self.checkpoints = deque(maxlen=checkpoint_count)
+        self.tick_count = 0
+        # 上次快照以来最慢的一帧
+        self.slowest = 0
+
+    def clear(self) -> None:
+        """
+        清空所有快照与检查点，新开一局时使用
+        :return: 无
+        """
+        self.slots = [None] * self.capacity
+        self.head = 0
+        self.count = 0
+        self.checkpoints.clear()
+        self.tick_count = 0
+        self.slowest = 0
+
+    def frame(self, frame_time) -> None:
+        """
+        每帧调用一次，记录这一帧的耗时，下一个快照会带上期间最慢的一帧
+        一帧可能模拟好几步，所以不能放在tick里，不然同一帧会被记好几次
+        :param frame_time: 这一帧的耗时，单位：毫秒
+        :return: 无
+        """
+        if frame_time > self.slowest:
+            self.slowest = frame_time
+
+    def tick(self, capture) -> None:
+        """
+        每步模拟调用一次，到了该记录的时候就调用capture记录一次快照
+        :param capture: 一个函数，传入(第几步, 上次快照以来最慢的一帧的耗时)，返回Snapshot
+        :return: 无
+        """
+        self.tick_count += 1
+        if self.tick_count % self.interval == 0:
+            self.push(capture(self.tick_count, self.slowest))
+            self.slowest = 0
+
+    def push(self, snapshot: Snapshot) -> None:
+        """
+        保存一个快照
+        :param snapshot: 快照
+        :return: 无
+        """
+        self.slots[self.head] = snapshot
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def checkpoint(self, snapshot: Snapshot) -> None:
+        """
+        保存一个检查点
+        :param snapshot: 带label的快照
+        :return: 无
+        """
+        self.checkpoints.append(snapshot)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index: int) -> Snapshot:
+        """
+        按时间顺序取快照，0为最旧的，-1为最新的
+        """
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("快照不存在")
+        return self.slots[(self.head - self.count + index) % self.capacity]
+
+    def rewind(self, steps: int = 1):
+        """
+        倒带：丢掉最新的steps个快照，返回在那之前的那个快照
+        反复调用可以一直往前倒，直到只剩最旧的快照
+        :param steps: 往前倒几个快照
+        :return: 倒带后的最新快照，一个快照都没有时返回None
+        """
+        if self.count == 0:
+            return None
+        steps = min(steps, self.count - 1)
+        for _ in range(steps):
+            self.head = (self.head - 1) % self.capacity
+            self.slots[self.head] = None
+            self.count -= 1
+        return self[-1]
+
+    def last_checkpoint(self, label: str = None):
+        """
+        获取最近的检查点
+        :param label: 只找说明以label开头的检查点，为None时不限
+        :return: 检查点，找不到时返回None
+        """
+        for snapshot in reversed(self.checkpoints):
+            if label is None or snapshot.label.startswith(label):
+                return snapshot
+        return None
+
+    def find_spike_start(self, threshold: float):
+        """
+        用二分查找找出从哪个快照开始变卡（最慢的一帧超过threshold毫秒）
+        假设最旧的快照不卡，最新的快照卡，并且中间是从不卡逐渐变成卡的
+        :param threshold: 多少毫秒一帧算卡
+        :return: 第一个卡的快照，最新的快照不卡时返回None
+        """
+        if self.count == 0 or self[-1].frame_time <= threshold:
+            return None
+        low, high = 0, self.count - 1
+        while low < high:
+            middle = (low + high) // 2
+            if self[middle].frame_time > threshold:
+                high = middle
+            else:
+                low = middle + 1
+        return self[low]
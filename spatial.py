@@ -0,0 +1,110 @@
+# 最近目标查询
+# 以前追踪弹只能追Boss：Boss的位置通过all_objects.update一路传进来，场上有很多敌机时也没法挑一个最近的
+# 每颗追踪弹都把所有敌机扫一遍的话，几百颗追踪弹乘上几百个敌机就太慢了
+# 这里把所有目标的中心按格子分好（均匀网格），每一步模拟开始时重建一次
+# 查询时从查询点所在的格子开始一圈一圈向外找，找到的目标比下一圈可能的最近距离还近就停下，一般只需要看几个格子
+# 目标很少时（平时只有几架敌机）一个个比较反而更快，就不用网格了
+import math
+
+
+class NearestGrid:
+    """
+    按均匀网格存放目标，查询离某一点最近的目标
+    用法：
+        grid.rebuild(所有目标)       # 每步一次
+        target = grid.nearest(x, y)  # 每颗追踪弹一次
+    """
+
+    def __init__(self, cell: int = 32, linear_limit: int = 32):
+        """
+        :param cell: 格子的边长，单位：像素，与目标之间的典型距离差不多时最快
+        :param linear_limit: 目标不超过这么多个时，查询直接逐个比较
+        """
+        self.cell = cell
+        self.linear_limit = linear_limit
+        # 所有目标，每项为(中心x, 中心y, 目标)
+        self.items = []
+        # (格子x, 格子y) -> [(中心x, 中心y, 目标), ...]
+        self.cells = {}
+        # 所有非空格子的范围，查询时最多找到这里为止
+        self.bounds = None
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def rebuild(self, sprites) -> None:
+        """
+        用目标现在的位置重建网格
+        :param sprites: 所有可以被选作目标的精灵
+        :return: 无
+        """
+        cell = self.cell
+        self.items = [(*sprite.rect.center, sprite) for sprite in sprites]
+        cells = {}
+        if len(self.items) > self.linear_limit:
+            for item in self.items:
+                key = (item[0] // cell, item[1] // cell)
+                items = cells.get(key)
+                if items is None:
+                    cells[key] = [item]
+                else:
+                    items.append(item)
+        self.cells = cells
+        if cells:
+            xs = [key[0] for key in cells]
+            ys = [key[1] for key in cells]
+            self.bounds = (min(xs), min(ys), max(xs), max(ys))
+        else:
+            self.bounds = None
+
+    def nearest(self, x: float, y: float, max_distance: float = math.inf):
+        """
+        找出离(x, y)最近的目标（按重建时的位置）
+        :param x: x坐标
+        :param y: y坐标
+        :param max_distance: 只找这个距离以内的目标
+        :return: 最近的目标，没有时为None
+        """
+        if not self.cells:
+            best = None
+            best_distance = max_distance * max_distance
+            for tx, ty, sprite in self.items:
+                distance = (tx - x) ** 2 + (ty - y) ** 2
+                if distance < best_distance:
+                    best_distance = distance
+                    best = sprite
+            return best
+        cell = self.cell
+        cells = self.cells
+        left, top, right, bottom = self.bounds
+        cx = int(x // cell)
+        cy = int(y // cell)
+        # 最远需要找到第几圈才能覆盖所有非空格子
+        last_ring = max(cx - left, right - cx, cy - top, bottom - cy, 0)
+        best = None
+        best_distance = max_distance * max_distance
+        for ring in range(last_ring + 1):
+            if ring > 0:
+                # 第ring圈的格子都在里面几圈组成的方块之外，离查询点至少有查询点到方块边缘那么远
+                # 已经找到的目标更近的话，就不用再找了
+                gap = min(x - (cx - ring + 1) * cell, (cx + ring) * cell - x,
+                          y - (cy - ring + 1) * cell, (cy + ring) * cell - y)
+                if best_distance <= gap * gap:
+                    break
+            if ring == 0:
+                keys = ((cx, cy),)
+            else:
+                keys = [(cx + dx, cy - ring) for dx in range(-ring, ring + 1)]
+                keys += [(cx + dx, cy + ring) for dx in range(-ring, ring + 1)]
+                keys += [(cx - ring, cy + dy) for dy in range(-ring + 1, ring)]
+                keys += [(cx + ring, cy + dy) for dy in range(-ring + 1, ring)]
+            for key in keys:
+                items = cells.get(key)
+                if items is None:
+                    continue
+                for tx, ty, sprite in items:
+                    distance = (tx - x) ** 2 + (ty - y) ** 2
+                    if distance < best_distance:
+                        best_distance = distance
+                        best = sprite
+        return best
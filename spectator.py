@@ -0,0 +1,480 @@
+# 观战服务器与观战客户端
+# 服务器跟着游戏一起运行（在单独的线程里跑asyncio），把每一帧场上所有东西的位置通过TCP发给任意多个观战者
+# 为了省流量，发送的不是画面，而是：
+#   1. 量化成整数像素的位置与速度
+#   2. 只发送变化的部分：观战端会按上次收到的速度自己推算位置，只有推算的位置偏差太大（或者图片变了）时才重新发送
+#   3. 爆炸等粒子没有编号，也不做增量，每条消息都带上当时所有的粒子（最多MAX_PARTICLES个）
+# 直线飞行的子弹只需要在出现时发送一次，Boss战时每个观战者每秒只需要几KB
+# 观战端用和游戏一样的资源重新绘制画面：python spectator.py [主机] [端口]
+import asyncio
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+
+import pygame
+
+import log
+import resource
+
+logger = log.get_logger("spectator")
+
+# 消息头：时间（毫秒）, 得分, Boss血量, 标志, 更新的物体数量, 消失的物体数量, 粒子数量
+HEADER = struct.Struct("<IiiBHHH")
+# 一个物体：编号, 图片编号, x, y, x方向速度, y方向速度
+# 位置是图片左上角的位置，单位为像素；速度单位为像素/秒
+RECORD = struct.Struct("<HBhhhh")
+REMOVED = struct.Struct("<H")
+# 一个粒子：图片编号, x, y（图片左上角，单位：像素）
+PARTICLE = struct.Struct("<Bhh")
+# 每条消息最多带多少个粒子，先带火光，再带碎片与尾焰
+MAX_PARTICLES = 512
+# 物体编号在消息中只有16位，同时存在的物体不能超过这么多
+MAX_WIRE_IDS = 0x10000
+# 每条消息前面的长度
+LENGTH = struct.Struct("<I")
+
+# 标志位
+KEYFRAME = 1  # 这是一条完整的消息，观战端应当先清空已有的所有物体
+PLAYING = 2  # 游戏正在进行
+WIN = 4  # 玩家赢了
+BOSS_FIGHT = 8  # 正在打Boss
+
+
+def asset_table(app) -> list[pygame.Surface]:
+    """
+    游戏与观战端共用的图片表，消息中的图片编号就是图片在这个表中的位置
+    两边都是用MainApp加载的资源，所以顺序一定相同
+    :param app: main.MainApp对象
+    :return: 图片列表
+    """
+    return [app.plane_image, *app.enemy_images, app.boss_image, *app.explosion_images, app.shot_image,
+            *app.enemy_shot_images, app.fire_ball_image, app.large_fireball_image, app.fire_image,
+            *app.debris_images, app.exhaust_image]
+
+
+def encode_message(now: int, score: int, boss_health: int, flags: int, updates, removed, particles=()) -> bytes:
+    """
+    把一帧的变化编码成一条消息
+    :param now: 时间，单位：毫秒
+    :param score: 得分
+    :param boss_health: Boss血量
+    :param flags: 标志位
+    :param updates: 需要更新的物体，每项为(编号, 图片编号, x, y, x方向速度, y方向速度)
+    :param removed: 消失的物体的编号
+    :param particles: 现在所有的粒子，每项为(图片编号, x, y)
+    :return: 压缩后带长度前缀的消息
+    """
+    parts = [HEADER.pack(now & 0xFFFFFFFF, score, boss_health, flags, len(updates), len(removed), len(particles))]
+    parts.extend(RECORD.pack(*record) for record in updates)
+    parts.extend(REMOVED.pack(serial) for serial in removed)
+    parts.extend(PARTICLE.pack(*particle) for particle in particles)
+    payload = zlib.compress(b"".join(parts), 1)
+    return LENGTH.pack(len(payload)) + payload
+
+
+def decode_message(payload: bytes):
+    """
+    解码一条消息（不含长度前缀）
+    :param payload: 消息内容
+    :return: (时间, 得分, Boss血量, 标志, 更新的物体列表, 消失的物体编号列表, 粒子列表)
+    """
+    data = zlib.decompress(payload)
+    now, score, boss_health, flags, update_count, removed_count, particle_count = HEADER.unpack_from(data, 0)
+    offset = HEADER.size
+    updates = [RECORD.unpack_from(data, offset + i * RECORD.size) for i in range(update_count)]
+    offset += update_count * RECORD.size
+    removed = [REMOVED.unpack_from(data, offset + i * REMOVED.size)[0] for i in range(removed_count)]
+    offset += removed_count * REMOVED.size
+    particles = [PARTICLE.unpack_from(data, offset + i * PARTICLE.size) for i in range(particle_count)]
+    return now, score, boss_health, flags, updates, removed, particles
+
+
+def _clamp16(value) -> int:
+    return max(-32768, min(32767, int(round(value))))
+
+
+class SpectatorServer:
+    """
+    观战服务器
+    用法：server = SpectatorServer(端口).start()，然后在游戏循环里每帧调用server.publish(...)
+    所有观战者共用同一份增量数据，所以观战者再多，每帧的编码开销也只有一份
+    """
+
+    def __init__(self, port: int = 0, host: str = "0.0.0.0", rate: int = 20, tolerance: int = 2,
+                 max_buffer: int = 256 * 1024):
+        """
+        创建观战服务器
+        :param port: 监听的端口，为0时由系统随便分配一个（启动后从self.port读取）
+        :param host: 监听的地址
+        :param rate: 每秒最多发送多少次
+        :param tolerance: 观战端推算的位置与实际位置相差超过多少像素时重新发送该物体
+        :param max_buffer: 某个观战者积压了这么多字节还没发出去时，断开它，防止拖慢服务器
+        """
+        self.host = host
+        self.port = port
+        self.interval = 1000 / rate
+        self.tolerance = tolerance
+        self.max_buffer = max_buffer
+
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.ready = threading.Event()
+        # 启动服务器时出的错（比如端口被占用），由start在调用者的线程里重新抛出
+        self.error = None
+        # 已经收到过完整消息的观战者与刚连上来的观战者，只能在服务器线程中修改
+        self.clients = set()
+        self.pending = set()
+        # 每个观战者对应的连接处理任务，关闭服务器时等它们结束
+        self.tasks = set()
+        # 发出去的总字节数，统计带宽用
+        self.bytes_sent = 0
+
+        self.table = None
+        # 观战端目前掌握的物体状态，编号 -> [图片编号, x, y, x方向速度, y方向速度, 发送时间]
+        self.baseline = {}
+        # 消息中的编号只有16位，而精灵的serial会一直增长，所以另外给场上的精灵分配编号
+        # 精灵的serial -> 编号；精灵消失后，它的编号要等观战端收到“消失”之后（下一次发送时）才能分给别的精灵
+        self.wire_ids = {}
+        self.free_ids = []
+        self.next_id = 0
+        # 上次发送时各物体的实际位置，用来估计速度，编号 -> (x, y)
+        self.last_position = {}
+        self.last_time = None
+        self.start_time = time.perf_counter()
+
+    def start(self):
+        """
+        在后台线程中启动服务器
+        :return: 自己，方便链式调用
+        :raise OSError: 无法监听端口（比如端口已被占用）时
+        """
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        if self.error is not None:
+            self.thread.join()
+            self.loop = None
+            raise self.error
+        return self
+
+    def stop(self) -> None:
+        """
+        关闭服务器与所有连接
+        :return: 无
+        """
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop = None
+
+    async def _shutdown(self) -> None:
+        self.server.close()
+        # 关闭连接后，各个连接处理任务会读到结尾并自己退出
+        for writer in self.clients | self.pending:
+            writer.close()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.server.wait_closed()
+
+    def _run(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(asyncio.start_server(self._accept, self.host, self.port))
+            self.port = self.server.sockets[0].getsockname()[1]
+        except Exception as error:
+            self.error = error
+            self.loop.close()
+            return
+        finally:
+            self.ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # 新的观战者要等下一次发送时先收一条完整消息
+        writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        self.pending.add(writer)
+        try:
+            # 观战者不会发来任何东西，读到结尾就说明它断开了
+            await reader.read()
+        except ConnectionError:
+            pass
+        finally:
+            self.tasks.discard(task)
+            self._drop(writer)
+
+    def _drop(self, writer: asyncio.StreamWriter) -> None:
+        self.clients.discard(writer)
+        self.pending.discard(writer)
+        writer.close()
+
+    def _send(self, keyframe: bytes, delta: bytes) -> None:
+        # 在服务器线程中执行
+        for writer in list(self.clients):
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                self._drop(writer)
+                continue
+            writer.write(delta)
+            self.bytes_sent += len(delta)
+        # 这次没有准备完整消息（观战者是在准备消息之后才连上来的），等下一次
+        if not keyframe:
+            return
+        for writer in list(self.pending):
+            writer.write(keyframe)
+            self.bytes_sent += len(keyframe)
+            self.pending.discard(writer)
+            self.clients.add(writer)
+
+    def collect(self, groups):
+        """
+        收集需要发送的物体，并给新出现的精灵分配编号，回收已经消失的精灵的编号
+        :param groups: 需要发送的精灵组
+        :return: 编号 -> (图片编号, x, y)
+        """
+        index = self.table
+        wire_ids = self.wire_ids
+        entities = {}
+        seen = {}
+        for group in groups:
+            for sprite in group:
+                image = index.get(id(sprite.image))
+                serial = getattr(sprite, "serial", None)
+                if image is None or serial is None or serial in seen:
+                    continue
+                wire_id = wire_ids.get(serial)
+                if wire_id is None:
+                    if self.free_ids:
+                        wire_id = self.free_ids.pop()
+                    elif self.next_id < MAX_WIRE_IDS:
+                        wire_id = self.next_id
+                        self.next_id += 1
+                    else:
+                        continue
+                seen[serial] = wire_id
+                entities[wire_id] = (image, sprite.rect.x, sprite.rect.y)
+        # 这次没出现的精灵的编号会在这次的消息里标记为消失，下一次才能分给新的精灵
+        self.free_ids.extend(wire_id for serial, wire_id in wire_ids.items() if serial not in seen)
+        self.wire_ids = seen
+        return entities
+
+    def collect_particles(self, particles) -> list[tuple[int, int, int]]:
+        """
+        收集需要发送的粒子
+        :param particles: 粒子系统（particle.ParticleSystem）
+        :return: 每项为(图片编号, x, y)，最多MAX_PARTICLES个
+        """
+        index = self.table
+        collected = []
+        for image, positions in particles.batches():
+            number = index.get(id(image))
+            if number is None:
+                continue
+            room = MAX_PARTICLES - len(collected)
+            collected.extend((number, _clamp16(x), _clamp16(y)) for x, y in positions[:room])
+            if len(collected) >= MAX_PARTICLES:
+                break
+        return collected
+
+    def publish(self, app, playing: bool, win: bool) -> None:
+        """
+        游戏每帧调用一次，到了该发送的时候就计算增量并发给所有观战者
+        :param app: main.MainApp对象
+        :param playing: 游戏是否正在进行
+        :param win: 玩家是否赢了
+        :return: 无
+        """
+        now = (time.perf_counter() - self.start_time) * 1000
+        if self.last_time is not None and now - self.last_time < self.interval:
+            return
+        # 一个观战者都没有的时候什么都不用算
+        if not self.clients and not self.pending:
+            self.baseline.clear()
+            self.last_position.clear()
+            self.wire_ids.clear()
+            self.free_ids.clear()
+            self.next_id = 0
+            self.last_time = None
+            return
+        if self.table is None:
+            self.table = {id(image): number for number, image in enumerate(asset_table(app))}
+        dt = (now - self.last_time) / 1000 if self.last_time is not None else 0
+        self.last_time = now
+
+        entities = self.collect((app.all_objects, app.boss_render_group, app.after_player_dead,
+                                 app.after_player_win))
+        updates = []
+        baseline = self.baseline
+        last_position = self.last_position
+        for serial, (image, x, y) in entities.items():
+            previous = last_position.get(serial)
+            if previous is not None and dt > 0:
+                vx = _clamp16((x - previous[0]) / dt)
+                vy = _clamp16((y - previous[1]) / dt)
+            else:
+                vx = vy = 0
+            known = baseline.get(serial)
+            if known is not None and known[0] == image:
+                # 按观战端的方法推算位置，偏差不大就不发送
+                elapsed = (now - known[5]) / 1000
+                if abs(known[1] + known[3] * elapsed - x) <= self.tolerance and \
+                        abs(known[2] + known[4] * elapsed - y) <= self.tolerance:
+                    continue
+            baseline[serial] = [image, _clamp16(x), _clamp16(y), vx, vy, now]
+            updates.append((serial, image, _clamp16(x), _clamp16(y), vx, vy))
+        removed = [serial for serial in baseline if serial not in entities]
+        for serial in removed:
+            del baseline[serial]
+        self.last_position = {serial: (x, y) for serial, (image, x, y) in entities.items()}
+
+        flags = (PLAYING if playing else 0) | (WIN if win else 0) | (BOSS_FIGHT if app.boss_fight else 0)
+        boss_health = int(app.boss_health)
+        particles = self.collect_particles(app.particles)
+        delta = encode_message(int(now), app.score_board.score, boss_health, flags, updates, removed, particles)
+        keyframe = b""
+        if self.pending:
+            # 完整消息中的位置换算到现在，速度不变，这样观战端之后的推算与服务器一致
+            full = []
+            for serial, (image, x, y, vx, vy, sent) in baseline.items():
+                elapsed = (now - sent) / 1000
+                full.append((serial, image, _clamp16(x + vx * elapsed), _clamp16(y + vy * elapsed), vx, vy))
+                baseline[serial] = [image, full[-1][2], full[-1][3], vx, vy, now]
+            keyframe = encode_message(int(now), app.score_board.score, boss_health, flags | KEYFRAME, full, [],
+                                      particles)
+        self.loop.call_soon_threadsafe(self._send, keyframe, delta)
+
+
+class SpectatorViewer:
+    """
+    观战客户端，接收服务器发来的消息并用游戏的资源画出来
+    """
+
+    def __init__(self, app, host: str, port: int):
+        """
+        :param app: main.MainApp对象，只用它的窗口与资源，不运行游戏
+        :param host: 服务器地址
+        :param port: 服务器端口
+        """
+        self.app = app
+        self.images = asset_table(app)
+        # 每张图片绘制时使用的混合模式
+        self.blend_flags = [pygame.BLEND_PREMULTIPLIED if resource.is_premultiplied(image) else 0
+                            for image in self.images]
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # 编号 -> [图片编号, x, y, x方向速度, y方向速度]
+        self.entities = {}
+        # 最近一条消息中的粒子，每项为(图片编号, x, y)
+        self.particles = []
+        self.message_time = None
+        self.score = 0
+        self.boss_health = 0
+        self.flags = 0
+        self.bytes_received = 0
+
+    def _read_exactly(self, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("服务器断开了连接")
+            data += chunk
+        return data
+
+    def receive(self) -> None:
+        """
+        接收并应用一条消息（会阻塞）
+        :return: 无
+        """
+        length = LENGTH.unpack(self._read_exactly(LENGTH.size))[0]
+        payload = self._read_exactly(length)
+        self.bytes_received += LENGTH.size + length
+        self.apply(*decode_message(payload))
+
+    def apply(self, now, score, boss_health, flags, updates, removed, particles=()) -> None:
+        """
+        应用一条消息：先把所有物体按速度推算到这条消息的时间，再更新变化的物体
+        :return: 无
+        """
+        if flags & KEYFRAME:
+            self.entities.clear()
+        elif self.message_time is not None:
+            elapsed = (now - self.message_time) / 1000
+            for entity in self.entities.values():
+                entity[1] += entity[3] * elapsed
+                entity[2] += entity[4] * elapsed
+        self.message_time = now
+        for serial, image, x, y, vx, vy in updates:
+            self.entities[serial] = [image, x, y, vx, vy]
+        for serial in removed:
+            self.entities.pop(serial, None)
+        self.particles = particles
+        self.score = score
+        self.boss_health = boss_health
+        self.flags = flags
+
+    def draw(self) -> None:
+        """
+        重新绘制整个画面
+        :return: 无
+        """
+        screen = self.app.backend.screen
+        screen.blit(self.app.background, (0, 0))
+        for image, x, y, vx, vy in self.entities.values():
+            screen.blit(self.images[image], (x, y), None, self.blend_flags[image])
+        # 粒子画在最上面，与游戏中一致
+        for image, x, y in self.particles:
+            screen.blit(self.images[image], (x, y), None, self.blend_flags[image])
+        font = self.app.font
+        screen.blit(font.render(f"Score: {self.score}", True, (255, 0, 0)), (10, 30))
+        if self.flags & BOSS_FIGHT:
+            health = max(self.boss_health, 0) / self.app.total_boss_health * 100
+            text = font.render("Health: {:.1f}%".format(health), True, (255, 0, 0))
+            screen.blit(text, text.get_rect(midtop=(screen.get_width() / 2, 5)))
+        if not self.flags & PLAYING:
+            text = self.app.font_large.render("You Win!" if self.flags & WIN else "You Lose!", True, (255, 0, 0))
+            screen.blit(text, text.get_rect(center=screen.get_rect().center))
+        pygame.display.flip()
+
+    def run(self) -> None:
+        """
+        一直观战，直到关闭窗口或服务器断开
+        :return: 无
+        """
+        try:
+            while not pygame.event.get(pygame.QUIT):
+                self.receive()
+                self.draw()
+        except ConnectionError as error:
+            logger.error("%s", error)
+        finally:
+            self.sock.close()
+
+
+def main():
+    import main as game
+
+    host = sys.argv[1] if len(sys.argv) > 1 else "127.0.0.1"
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else game.SPECTATOR_PORT or 7788
+    # 只借用MainApp的窗口与资源：观战端自己不开观战服务器（会和要观战的游戏抢端口），不记战绩，不录像，不用自动驾驶
+    game.SPECTATOR_PORT = None
+    game.STATS_FILE = None
+    game.CAPTURE_ON_START = False
+    game.AUTOPILOT = False
+    # 观战画面直接画在窗口的画布上，只能使用软件绘制
+    app = game.MainApp("software")
+    pygame.display.set_caption("飞机大战 - 观战")
+    SpectatorViewer(app, host, port).run()
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
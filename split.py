@@ -0,0 +1,500 @@
+# 分进程模式
+# 单进程时，模拟（all_objects.update，碰撞检测）与绘制（blit，display.update）都要抢同一把GIL，多核也只能用上一个核
+# 分进程模式下：
+#   模拟进程（子进程）运行完整的游戏循环，但使用NullBackend不绘制，每帧把场上所有东西的图片编号与位置写进共享内存
+#   绘制进程（主进程）只处理输入，从共享内存读出最新的一帧画出来并显示，键盘与鼠标事件通过管道发给模拟进程
+# 两个进程各自按MAX_RATE运行，模拟与绘制重叠进行，一帧的时间由两者中较慢的一方决定，而不是两者之和
+#
+# 共享内存的布局：
+#   开头4字节：最新写完的是哪一块（0或1）
+#   之后是两块同样大小的缓冲区（双缓冲），模拟进程总是写另一块，写完再切换，绘制进程读最新的一块
+#   每块缓冲区：头部（见SLOT_HEADER），所有物体的x坐标（int16），y坐标（int16），图片编号（uint8）
+# 头部的序号在写入时是奇数，写完是偶数（顺序锁）：绘制进程读之前与读之后序号相同且为偶数，才说明没有读到写了一半的数据
+# 图片编号就是spectator.asset_table中的位置，两个进程加载的是同样的资源，所以编号一致
+import contextlib
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from array import array
+from multiprocessing import shared_memory
+
+import pygame
+
+import autopilot
+import inputs
+import log
+import render
+import resource
+import spectator
+import timestep
+import tracing
+from configure import CAPTURE_KEY, FULL_KEY, MAX_RATE
+
+logger = log.get_logger("split")
+
+# 最新写完的缓冲区
+FRONT = struct.Struct("<I")
+# 每块缓冲区的头部：序号, 物体数量, 得分, Boss血量, 标志, 模拟进程的帧率
+SLOT_HEADER = struct.Struct("<IIiiIf")
+# 每个物体占用的字节数：x, y各2字节，图片编号1字节
+ENTITY_SIZE = 5
+
+# 标志位，前几个与观战消息的相同
+PLAYING = spectator.PLAYING
+WIN = spectator.WIN
+BOSS_FIGHT = spectator.BOSS_FIGHT
+PAUSED = 16  # 游戏暂停中
+SHOW_FPS = 32  # 需要显示帧率
+
+# 最多同时传递多少个物体，超出的部分不显示
+CAPACITY = 8192
+
+
+class SharedFrames:
+    """
+    共享内存中的双缓冲，模拟进程写，绘制进程读
+    """
+
+    def __init__(self, memory: shared_memory.SharedMemory, capacity: int, owner: bool):
+        """
+        不要直接创建，使用SharedFrames.create与SharedFrames.attach
+        :param memory: 共享内存
+        :param capacity: 每块缓冲区最多容纳多少个物体
+        :param owner: 是否由自己创建，创建者负责最后删除这块共享内存
+        """
+        self.memory = memory
+        self.capacity = capacity
+        self.owner = owner
+        self.slot_size = SLOT_HEADER.size + capacity * ENTITY_SIZE
+        # 写入方：下一次写入使用的序号
+        self.sequence = 0
+        self.front = 0
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    @classmethod
+    def create(cls, capacity: int = CAPACITY) -> "SharedFrames":
+        """
+        创建一块新的共享内存
+        :param capacity: 每块缓冲区最多容纳多少个物体
+        :return: SharedFrames对象
+        """
+        size = FRONT.size + 2 * (SLOT_HEADER.size + capacity * ENTITY_SIZE)
+        return cls(shared_memory.SharedMemory(create=True, size=size), capacity, True)
+
+    @classmethod
+    def attach(cls, name: str, capacity: int) -> "SharedFrames":
+        """
+        连接到另一个进程创建的共享内存
+        :param name: 共享内存的名字，SharedFrames.name
+        :param capacity: 创建时的容量
+        :return: SharedFrames对象
+        """
+        return cls(shared_memory.SharedMemory(name=name), capacity, False)
+
+    def _slot(self, index: int) -> tuple[int, int, int, int]:
+        # 返回缓冲区头部，x坐标，y坐标与图片编号的起始位置
+        header = FRONT.size + index * self.slot_size
+        xs = header + SLOT_HEADER.size
+        ys = xs + self.capacity * 2
+        return header, xs, ys, ys + self.capacity * 2
+
+    def write(self, score: int, boss_health: int, flags: int, fps: float, images, xs: array, ys: array) -> None:
+        """
+        写入一帧
+        :param score: 得分
+        :param boss_health: Boss血量
+        :param flags: 标志位
+        :param fps: 模拟进程的帧率
+        :param images: 每个物体的图片编号，bytes或bytearray
+        :param xs: 每个物体左上角的x坐标，array("h")
+        :param ys: 每个物体左上角的y坐标，array("h")
+        :return: 无
+        """
+        count = min(len(images), self.capacity)
+        back = 1 - self.front
+        header, x_start, y_start, image_start = self._slot(back)
+        buffer = self.memory.buf
+        self.sequence += 1
+        SLOT_HEADER.pack_into(buffer, header, self.sequence, 0, 0, 0, 0, 0)
+        buffer[x_start:x_start + count * 2] = xs.tobytes()[:count * 2]
+        buffer[y_start:y_start + count * 2] = ys.tobytes()[:count * 2]
+        buffer[image_start:image_start + count] = bytes(images[:count])
+        self.sequence += 1
+        SLOT_HEADER.pack_into(buffer, header, self.sequence, count, score, boss_health, flags, fps)
+        FRONT.pack_into(buffer, 0, back)
+        self.front = back
+
+    def read(self, retries: int = 8):
+        """
+        读出最新的一帧
+        :param retries: 读到写了一半的数据时最多重试几次
+        :return: (序号, 得分, Boss血量, 标志, 模拟进程的帧率, 图片编号, x坐标, y坐标)，
+                 还没有写入过或一直没能读到完整的数据时为None
+        """
+        buffer = self.memory.buf
+        for _ in range(retries):
+            header, x_start, y_start, image_start = self._slot(FRONT.unpack_from(buffer, 0)[0])
+            sequence, count, score, boss_health, flags, fps = SLOT_HEADER.unpack_from(buffer, header)
+            if sequence == 0 or sequence % 2:
+                continue
+            xs = array("h", buffer[x_start:x_start + count * 2])
+            ys = array("h", buffer[y_start:y_start + count * 2])
+            images = bytes(buffer[image_start:image_start + count])
+            if SLOT_HEADER.unpack_from(buffer, header)[0] == sequence:
+                return sequence, score, boss_health, flags, fps, images, xs, ys
+        return None
+
+    def close(self) -> None:
+        """
+        断开共享内存，创建者还会删除它
+        :return: 无
+        """
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+class FramePublisher:
+    """
+    模拟进程使用：每帧收集场上所有东西，写进共享内存
+    MainApp每帧调用publish，与观战服务器在同一个位置
+    """
+
+    def __init__(self, frames: SharedFrames):
+        self.frames = frames
+        self.table = None
+
+    def publish(self, app, playing: bool, win: bool, paused: bool, fps: float, alpha: float) -> None:
+        """
+        写入这一帧
+        :param app: main.MainApp对象
+        :param playing: 游戏是否正在进行
+        :param win: 玩家是否赢了
+        :param paused: 是否暂停
+        :param fps: 模拟进程的帧率
+        :param alpha: 插值系数，见timestep.FixedTimestep.alpha，位置按插值后的写入，绘制进程的画面才是平滑的
+        :return: 无
+        """
+        if self.table is None:
+            self.table = {id(image): number for number, image in enumerate(spectator.asset_table(app))}
+        table = self.table
+        moved = []
+        if playing and not paused:
+            moved = timestep.interpolate_positions((app.all_objects, app.boss_render_group), alpha)
+        images = bytearray()
+        xs = array("h")
+        ys = array("h")
+        seen = set()
+        # 和单进程时同样的绘制顺序：精灵在下，粒子在上；界面上的文字不在图片表里，由绘制进程自己画
+        for group in (app.all_objects, app.boss_render_group, app.after_player_dead, app.after_player_win):
+            for sprite in group:
+                number = table.get(id(sprite.image))
+                if number is None or sprite in seen:
+                    continue
+                seen.add(sprite)
+                images.append(number)
+                xs.append(sprite.rect.x)
+                ys.append(sprite.rect.y)
+        timestep.restore_positions(moved)
+        for image, positions in app.particles.batches():
+            number = table.get(id(image))
+            if number is None:
+                continue
+            images.extend(bytes((number,)) * len(positions))
+            xs.extend([int(x) for x, _ in positions])
+            ys.extend([int(y) for _, y in positions])
+
+        flags = (PLAYING if playing else 0) | (WIN if win else 0) | (BOSS_FIGHT if app.boss_fight else 0) | \
+                (PAUSED if paused else 0) | (SHOW_FPS if app.show_fps else 0)
+        self.frames.write(app.score_board.score, int(app.boss_health), flags, fps, images, xs, ys)
+
+
+class SharedScene:
+    """
+    绘制进程使用：共享内存中读出的一帧，对绘制后端来说它和一个精灵组一样（有draw，clear与batches）
+    """
+
+    def __init__(self, images: list[pygame.Surface]):
+        """
+        :param images: 图片表，spectator.asset_table(app)
+        """
+        self.images = images
+        self.sizes = [image.get_size() for image in images]
+        # 这一帧按图片分好的批，每项为(图片编号, 左上角坐标的列表)
+        self.numbered_batches = []
+        # 上一次绘制时需要擦除的区域
+        self.drawn_areas = []
+
+    def set_frame(self, images: bytes, xs: array, ys: array) -> None:
+        """
+        换成新的一帧，同一张图片的物体排在一起，保持第一次出现的顺序
+        :param images: 每个物体的图片编号
+        :param xs: 每个物体的x坐标
+        :param ys: 每个物体的y坐标
+        :return: 无
+        """
+        batches = {}
+        for number, x, y in zip(images, xs, ys):
+            batch = batches.get(number)
+            if batch is None:
+                batches[number] = [(x, y)]
+            else:
+                batch.append((x, y))
+        self.numbered_batches = list(batches.items())
+
+    def batches(self) -> list[tuple[pygame.Surface, list]]:
+        """
+        :return: 每项为(图片, 左上角坐标的列表)
+        """
+        images = self.images
+        return [(images[number], positions) for number, positions in self.numbered_batches]
+
+    def draw(self, surface: pygame.Surface) -> list[pygame.Rect]:
+        """
+        绘制这一帧，每张图片一次blits
+        场上的东西很多而且到处都是，直接整屏更新，不再计算每个物体的脏矩形
+        :param surface: 绘制到哪里
+        :return: 需要更新的区域
+        """
+        self.drawn_areas = []
+        for number, positions in self.numbered_batches:
+            image = self.images[number]
+            width, height = self.sizes[number]
+            if resource.is_premultiplied(image):
+                sequence = [(image, position, None, pygame.BLEND_PREMULTIPLIED) for position in positions]
+            else:
+                sequence = [(image, position) for position in positions]
+            start = time.perf_counter_ns()
+            surface.blits(sequence, doreturn=False)
+            render.STATS.add(len(sequence), start)
+            self.drawn_areas.extend((x, y, width, height) for x, y in positions)
+        return [surface.get_clip()]
+
+    def clear(self, surface: pygame.Surface, background: pygame.Surface) -> None:
+        """
+        用背景擦掉上一次绘制的内容
+        :param surface: 在哪里擦除
+        :param background: 背景图片
+        :return: 无
+        """
+        if not self.drawn_areas:
+            return
+        sequence = [(background, area, area) for area in self.drawn_areas]
+        self.drawn_areas = []
+        start = time.perf_counter_ns()
+        surface.blits(sequence, doreturn=False)
+        render.STATS.add(len(sequence), start)
+
+
+@contextlib.contextmanager
+def _headless_environment():
+    # 子进程启动时继承环境变量，模拟进程不需要窗口与声音
+    saved = {name: os.environ.get(name) for name in ("SDL_VIDEODRIVER", "SDL_AUDIODRIVER")}
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _simulate(app_class, name: str, capacity: int, connection) -> None:
+    # 模拟进程的入口
+    game = sys.modules[app_class.__module__]
+    # 录像由绘制进程负责；时间线写到另一个文件，不和绘制进程的混在一起
+    game.CAPTURE_ON_START = False
+    if game.TRACE_FILE is not None:
+        root, extension = os.path.splitext(game.TRACE_FILE)
+        game.TRACE_FILE = f"{root}.simulation{extension}"
+    frames = SharedFrames.attach(name, capacity)
+    app = app_class("null")
+    app.input = inputs.RemoteInput(connection)
+    if game.AUTOPILOT:
+        app.input = autopilot.Autopilot(app, app.input, game.SCREEN_RECT)
+    app.frame_publisher = FramePublisher(frames)
+    try:
+        app.run()
+    finally:
+        app.close()
+        frames.close()
+        pygame.quit()
+
+
+class SplitRenderer:
+    """
+    绘制进程：处理输入，画出模拟进程写进共享内存的画面
+    """
+
+    def __init__(self, app, frames: SharedFrames, connection, process):
+        """
+        :param app: main.MainApp对象，只用它的窗口，资源与界面控件，不运行游戏
+        :param frames: 共享内存
+        :param connection: 发送输入的管道
+        :param process: 模拟进程
+        """
+        self.app = app
+        self.frames = frames
+        self.connection = connection
+        self.process = process
+        self.scene = SharedScene(spectator.asset_table(app))
+        # 界面上的文字与按钮，按模拟进程发来的状态决定显示哪些
+        self.hud = render.BatchRenderUpdates()
+        self.hud_state = None
+        self.score = None
+        self.boss_health = None
+        self.sequence = 0
+
+    def send_input(self, events, arrived_at: float) -> bool:
+        """
+        把这一帧的输入事件发给模拟进程，按住的键由模拟进程按事件自己维护（见inputs.InputSource）
+        :param events: 这一帧的所有事件
+        :param arrived_at: 取出这些事件的时间，time.perf_counter()
+        :return: 是否发送成功，模拟进程退出后会失败
+        """
+        forwarded = inputs.encode_events(events, arrived_at)
+        if not forwarded:
+            return True
+        try:
+            self.connection.send(forwarded)
+        except (BrokenPipeError, OSError):
+            return False
+        return True
+
+    def update_hud(self, score: int, boss_health: int, flags: int, fps: float) -> None:
+        """
+        按模拟进程发来的状态更新界面
+        :param score: 得分
+        :param boss_health: Boss血量
+        :param flags: 标志位
+        :param fps: 帧率
+        :return: 无
+        """
+        app = self.app
+        if score != self.score:
+            self.score = score
+            app.score_board.score = score
+            app.win_menu.text = f"You win! Score: {score}"
+        if boss_health != self.boss_health:
+            self.boss_health = boss_health
+            app.health_bar.health = boss_health
+        if flags & SHOW_FPS:
+            app.fps_view.fps = "{:.2f}".format(fps)
+        widgets = [app.score_board]
+        if flags & SHOW_FPS:
+            widgets.append(app.fps_view)
+        if flags & BOSS_FIGHT:
+            widgets.append(app.health_bar)
+        if not flags & PLAYING:
+            widgets.extend((app.win_menu if flags & WIN else app.lose_menu, app.replay_button))
+        if flags & PAUSED:
+            widgets.append(app.paused_menu)
+        if widgets != self.hud_state:
+            self.hud_state = widgets
+            self.hud.empty()
+            self.hud.add(*widgets)
+
+    def run(self) -> None:
+        """
+        运行绘制循环，直到玩家退出或模拟进程结束
+        :return: 无
+        """
+        app = self.app
+        backend = app.backend
+        tracer = tracing.TRACER
+        clock = app.pacer
+        backend.reset(app.background)
+        while self.process.is_alive():
+            tracer.begin("frame")
+            render.STATS.reset()
+            tracer.begin("events")
+            events = []
+            quitting = False
+            redraw = False
+            arrived_at = time.perf_counter()
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    quitting = True
+                elif event.type == pygame.KEYDOWN:
+                    # 录像在绘制进程里进行，录像键不转发
+                    if event.key == CAPTURE_KEY:
+                        app.recorder.toggle(backend.size)
+                        continue
+                    # 模拟进程也会收到全屏键，它会暂停游戏
+                    if event.key == FULL_KEY:
+                        backend.toggle_fullscreen()
+                        redraw = True
+                events.append(event)
+            if not self.send_input(events, arrived_at) or quitting:
+                tracer.end()
+                tracer.end()
+                break
+            tracer.end()
+
+            tracer.begin("draw")
+            frame = self.frames.read()
+            if frame is not None and (frame[0] != self.sequence or redraw):
+                self.sequence, score, boss_health, flags, sim_fps, images, xs, ys = frame
+                # 帧率显示的是绘制进程的帧率，也就是玩家实际看到的帧率
+                self.update_hud(score, boss_health, flags, clock.get_fps())
+                self.scene.set_frame(images, xs, ys)
+                # 界面在最上面，但要最先擦除，不然会擦掉这一帧刚画好的物体
+                backend.erase(self.hud)
+                backend.draw(self.scene)
+                backend.redraw(self.hud)
+            tracer.end()
+            tracer.counter("render", {"blits": render.STATS.blits, "submit_ms": render.STATS.submit_time})
+            tracer.begin("capture")
+            app.recorder.capture(backend)
+            tracer.end()
+            tracer.begin("present")
+            backend.present()
+            tracer.end()
+            tracer.begin("tick")
+            if MAX_RATE is not None:
+                clock.tick(MAX_RATE)
+            else:
+                clock.tick()
+            tracer.counter("pacing", {"frame_ms": clock.frame_time, "deviation_ms": clock.deviation})
+            tracer.end()
+            tracer.end()
+
+
+def run(app) -> None:
+    """
+    分进程运行游戏，直到玩家退出
+    :param app: main.MainApp对象，作为绘制进程，模拟进程会用同样的类另外创建一个
+    :return: 无
+    """
+    # 观战服务器需要游戏的状态，跟着模拟进程走
+    if app.spectators is not None:
+        app.spectators.stop()
+        app.spectators = None
+    frames = SharedFrames.create()
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_simulate, args=(type(app), frames.name, frames.capacity, receiver),
+                              name="simulation", daemon=True)
+    with _headless_environment():
+        process.start()
+    receiver.close()
+    logger.info("模拟进程已启动: pid=%d", process.pid)
+    try:
+        SplitRenderer(app, frames, sender, process).run()
+    finally:
+        # 关闭管道后模拟进程会收到QUIT，自己结束这一局并退出
+        sender.close()
+        process.join(5)
+        if process.is_alive():
+            logger.warning("模拟进程没有按时退出，强制结束")
+            process.terminate()
+            process.join()
+        frames.close()
@@ -0,0 +1,240 @@
+# 战绩统计
+# 每一局结束时记录：得分，存活时间，到达的难度，Boss剩余血量，结局（胜利/死亡/中途退出）与死因
+# 数据存放在本地的SQLite数据库里，按难度与时间建了索引，可以用来做排行榜，也可以用来分析哪里太难/太简单
+# 游戏线程只把记录放进队列，由后台线程成批写入数据库，游戏永远不会因为写磁盘而卡住
+# 查看统计：python stats.py [数据库文件]
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+import log
+
+logger = log.get_logger("stats")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    played_at REAL NOT NULL,
+    difficulty INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    survival_time REAL NOT NULL,
+    boss_fight INTEGER NOT NULL,
+    boss_health INTEGER NOT NULL,
+    outcome TEXT NOT NULL,
+    death_cause TEXT,
+    debug INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_difficulty ON runs (difficulty, score);
+CREATE INDEX IF NOT EXISTS runs_played_at ON runs (played_at);
+"""
+
+# 结局
+WIN = "win"
+DEATH = "death"
+QUIT = "quit"
+
+
+class RunRecord:
+    """
+    一局游戏的战绩
+    """
+    __slots__ = ('played_at', 'difficulty', 'score', 'survival_time', 'boss_fight', 'boss_health', 'outcome',
+                 'death_cause', 'debug')
+
+    def __init__(self, played_at, difficulty, score, survival_time, boss_fight, boss_health, outcome,
+                 death_cause=None, debug=False):
+        """
+        :param played_at: 这一局开始的时间，time.time()
+        :param difficulty: 这一局到达的难度，见main.DIFFICULTY
+        :param score: 得分
+        :param survival_time: 存活时间（不算暂停），单位：秒
+        :param boss_fight: 是否到达了Boss战
+        :param boss_health: 这一局结束时Boss剩余的血量
+        :param outcome: 结局，WIN，DEATH或QUIT
+        :param death_cause: 死因，没有死亡时为None
+        :param debug: 这一局是否开过Bug模式（无敌），统计时一般需要排除
+        """
+        self.played_at = played_at
+        self.difficulty = difficulty
+        self.score = score
+        self.survival_time = survival_time
+        self.boss_fight = boss_fight
+        self.boss_health = boss_health
+        self.outcome = outcome
+        self.death_cause = death_cause
+        self.debug = debug
+
+    def row(self) -> tuple:
+        return (self.played_at, self.difficulty, self.score, self.survival_time, int(self.boss_fight),
+                self.boss_health, self.outcome, self.death_cause, int(self.debug))
+
+
+class StatsStore:
+    """
+    战绩数据库
+    用法：
+        store = StatsStore("stats.db").start()
+        store.record(RunRecord(...))     # 不会阻塞
+        store.leaderboard()               # 查询
+        store.close()
+    """
+
+    def __init__(self, path: str = "stats.db", batch_size: int = 32, flush_interval: float = 1.0):
+        """
+        :param path: 数据库文件
+        :param batch_size: 一次最多写入多少条记录
+        :param flush_interval: 有记录等待写入时，最多等这么多秒凑够一批
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.writer = None
+        # 建表放在这里同步完成，之后查询时表一定存在
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=5)
+        # WAL模式下读写互不阻塞，查询时后台线程可以继续写
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def start(self) -> "StatsStore":
+        """
+        启动后台写入线程
+        :return: 自己
+        """
+        if self.writer is None:
+            self.writer = threading.Thread(target=self._write_loop, name="stats writer", daemon=True)
+            self.writer.start()
+        return self
+
+    def record(self, run: RunRecord) -> None:
+        """
+        记录一局游戏，只放进队列，立刻返回
+        :param run: 战绩
+        :return: 无
+        """
+        self.queue.put_nowait(run.row())
+
+    def flush(self) -> None:
+        """
+        等待目前队列中的记录全部写入
+        :return: 无
+        """
+        self.queue.join()
+
+    def close(self) -> None:
+        """
+        写完所有记录并停止后台线程
+        :return: 无
+        """
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+
+    def _write_loop(self) -> None:
+        connection = self._connect()
+        running = True
+        while running:
+            rows = [self.queue.get()]
+            # 第一条到了以后再稍等一会，尽量凑成一批一起写
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size and rows[-1] is not None:
+                try:
+                    rows.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            if rows[-1] is None:
+                running = False
+            batch = [row for row in rows if row is not None]
+            try:
+                with connection:
+                    connection.executemany(
+                        "INSERT INTO runs (played_at, difficulty, score, survival_time, boss_fight, boss_health, "
+                        "outcome, death_cause, debug) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            except sqlite3.Error as error:
+                logger.error("写入战绩失败: %s", error)
+            for _ in rows:
+                self.queue.task_done()
+        connection.close()
+
+    def _query(self, sql: str, parameters=()) -> list[tuple]:
+        connection = self._connect()
+        try:
+            return connection.execute(sql, parameters).fetchall()
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _filters(difficulty=None, since=None, include_debug=False) -> tuple[str, list]:
+        conditions = []
+        parameters = []
+        if difficulty is not None:
+            conditions.append("difficulty = ?")
+            parameters.append(difficulty)
+        if since is not None:
+            conditions.append("played_at >= ?")
+            parameters.append(since)
+        if not include_debug:
+            conditions.append("debug = 0")
+        return (" WHERE " + " AND ".join(conditions)) if conditions else "", parameters
+
+    def leaderboard(self, limit: int = 10, difficulty: int = None, since: float = None) -> list[tuple]:
+        """
+        排行榜，不包括开过Bug模式的局
+        :param limit: 最多返回多少条
+        :param difficulty: 只看到达这个难度的局，为None时不限
+        :param since: 只看这个时间（time.time()）之后的局，为None时不限
+        :return: 每项为(得分, 存活时间, 难度, 结局, 开始时间)，按得分从高到低排列
+        """
+        where, parameters = self._filters(difficulty, since)
+        return self._query(f"SELECT score, survival_time, difficulty, outcome, played_at FROM runs{where} "
+                           f"ORDER BY score DESC, survival_time ASC LIMIT ?", (*parameters, limit))
+
+    def difficulty_summary(self, since: float = None) -> list[tuple]:
+        """
+        按难度汇总，用来检查各个难度是否平衡
+        :param since: 只看这个时间之后的局，为None时不限
+        :return: 每项为(难度, 局数, 平均得分, 平均存活时间, 胜率, Boss战时Boss的平均剩余血量)
+        """
+        where, parameters = self._filters(since=since)
+        return self._query(f"SELECT difficulty, COUNT(*), AVG(score), AVG(survival_time), "
+                           f"AVG(outcome = '{WIN}'), AVG(CASE WHEN boss_fight THEN boss_health END) "
+                           f"FROM runs{where} GROUP BY difficulty ORDER BY difficulty", parameters)
+
+    def death_causes(self, difficulty: int = None, since: float = None) -> list[tuple]:
+        """
+        统计死因
+        :param difficulty: 只看到达这个难度的局，为None时不限
+        :param since: 只看这个时间之后的局，为None时不限
+        :return: 每项为(死因, 次数, 平均存活时间)，按次数从多到少排列
+        """
+        where, parameters = self._filters(difficulty, since)
+        where += (" AND " if where else " WHERE ") + f"outcome = '{DEATH}'"
+        return self._query(f"SELECT death_cause, COUNT(*), AVG(survival_time) FROM runs{where} "
+                           f"GROUP BY death_cause ORDER BY COUNT(*) DESC", parameters)
+
+
+def main():
+    store = StatsStore(sys.argv[1] if len(sys.argv) > 1 else "stats.db")
+    print("排行榜")
+    for rank, (score, survival_time, difficulty, outcome, played_at) in enumerate(store.leaderboard(), 1):
+        date = time.strftime("%Y-%m-%d %H:%M", time.localtime(played_at))
+        print(f"{rank:>3}. {score:>6} 分  {survival_time:>7.1f} 秒  难度{difficulty}  {outcome:<5}  {date}")
+    print("\n各难度统计")
+    for difficulty, count, score, survival_time, win_rate, boss_health in store.difficulty_summary():
+        boss = "-" if boss_health is None else f"{boss_health:.0f}"
+        print(f"难度{difficulty}: {count}局  平均{score:.0f}分  平均存活{survival_time:.1f}秒  "
+              f"胜率{win_rate:.0%}  Boss平均剩余血量{boss}")
+    print("\n死因")
+    for cause, count, survival_time in store.death_causes():
+        print(f"{cause}: {count}次  平均存活{survival_time:.1f}秒")
+
+
+if __name__ == '__main__':
+    main()
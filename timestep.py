@@ -0,0 +1,109 @@
+# 固定步长模拟与绘制插值
+# 以前每一帧都用这一帧的时间（diff / 1000）推进一次模拟，模拟的频率就是帧率，帧率一变，碰撞检测之类的结果也跟着变
+# 现在模拟按固定的步长（比如1/60秒）推进：
+#   每帧把这一帧的时间存进“蓄水池”，够一步就推进一步，不够就留到下一帧
+#   绘制时按蓄水池里剩下的时间，在每个物体上一步与这一步的位置之间插值，画面依然平滑
+# 这样帧率可以开到144甚至更高而不增加模拟的开销，机器差时降到30帧也不会改变游戏的手感与结果
+# 有浮点位置（x, y属性，见main.CommonSprite）的精灵按浮点位置记录与插值，没有的按rect
+
+
+class FixedTimestep:
+    """
+    固定步长计时器
+    用法：
+        for _ in range(timestep.advance(dt)):
+            模拟一步，时间为timestep.step
+        绘制时使用timestep.alpha插值
+    """
+
+    def __init__(self, rate: int = 60, max_steps: int = 5):
+        """
+        :param rate: 每秒模拟多少步
+        :param max_steps: 一帧最多追赶多少步，卡顿很久之后不会一下子模拟很多步，导致越来越卡
+        """
+        self.rate = rate
+        self.step = 1 / rate
+        self.max_steps = max_steps
+        # 还没有模拟的时间，单位：秒
+        self.accumulator = 0.0
+
+    def reset(self) -> None:
+        """
+        丢掉还没有模拟的时间，新开一局时使用
+        :return: 无
+        """
+        self.accumulator = 0.0
+
+    def advance(self, dt: float) -> int:
+        """
+        过去了dt秒，计算需要模拟多少步
+        :param dt: 这一帧的时间，单位：秒
+        :return: 这一帧需要模拟的步数
+        """
+        self.accumulator = min(self.accumulator + dt, self.step * self.max_steps)
+        steps = int(self.accumulator / self.step)
+        self.accumulator -= steps * self.step
+        return steps
+
+    @property
+    def alpha(self) -> float:
+        """
+        绘制时的插值系数：0表示画在上一步的位置，1表示画在这一步的位置
+        """
+        return self.accumulator / self.step
+
+
+def remember_positions(*groups) -> None:
+    """
+    记下每个精灵现在的位置，作为下一步之前的位置，每模拟一步之前调用
+    :param groups: 精灵组
+    :return: 无
+    """
+    for group in groups:
+        for sprite in group:
+            try:
+                sprite.previous_position = (sprite.x, sprite.y)
+            except AttributeError:
+                sprite.previous_position = sprite.rect.topleft
+
+
+def interpolate_positions(groups, alpha: float, max_distance: int = 200) -> list:
+    """
+    把每个精灵临时挪到上一步与这一步之间的位置，绘制完之后必须用restore_positions挪回去
+    没有上一步位置的精灵（这一步新出现的）与一步之间移动太远的精灵（瞬移）不插值
+    :param groups: 精灵组
+    :param alpha: 插值系数，见FixedTimestep.alpha
+    :param max_distance: 一步内移动超过这么多像素就视为瞬移
+    :return: 被挪动的精灵的矩形与原来的位置
+    """
+    moved = []
+    seen = set()
+    for group in groups:
+        for sprite in group:
+            previous = getattr(sprite, "previous_position", None)
+            if previous is None or sprite in seen:
+                continue
+            seen.add(sprite)
+            rect = sprite.rect
+            x = getattr(sprite, "x", None)
+            if x is None:
+                x, y = rect.topleft
+            else:
+                y = sprite.y
+            dx = x - previous[0]
+            dy = y - previous[1]
+            if (dx == 0 and dy == 0) or abs(dx) + abs(dy) > max_distance:
+                continue
+            moved.append((rect, rect.x, rect.y))
+            rect.topleft = (round(previous[0] + dx * alpha), round(previous[1] + dy * alpha))
+    return moved
+
+
+def restore_positions(moved: list) -> None:
+    """
+    把interpolate_positions挪过的精灵挪回模拟中的位置
+    :param moved: interpolate_positions的返回值
+    :return: 无
+    """
+    for rect, x, y in moved:
+        rect.topleft = (x, y)
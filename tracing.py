@@ -0,0 +1,239 @@
+# 时间线记录（Chrome trace-event 格式）
+# 打开后，游戏循环的每个阶段，Boss的每个技能，每次加载资源都会被记成一段时间
+# 生成的json文件可以直接拖进 chrome://tracing 或 https://ui.perfetto.dev 查看，哪一帧卡了，卡在哪一步，一目了然
+# 记录时只往内存里的缓冲区追加一条数据，真正写文件由后台线程成批完成，不会拖慢游戏
+# 没有打开时，每次记录只多一次属性判断
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class _NullSpan:
+    """
+    没有打开记录时使用的空时间段，什么都不做
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """
+    一段时间，用with语句包住需要记录的代码
+    """
+    __slots__ = ('tracer', 'name', 'category', 'start')
+
+    def __init__(self, tracer, name, category):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *args):
+        self.tracer.complete(self.name, self.category, self.start, time.perf_counter_ns())
+        return False
+
+
+class Tracer:
+    """
+    时间线记录器
+    用法：
+        TRACER.start("trace.json")
+        with TRACER.span("update"): ...      # 记录一段代码
+        TRACER.begin("draw") ... TRACER.end()  # 不方便用with时，成对调用begin与end
+        TRACER.stop()
+    """
+
+    def __init__(self):
+        # 是否正在记录，所有记录方法都先检查它
+        self.enabled = False
+        # 还没写进文件的事件，deque的append与popleft是线程安全的，记录时不需要加锁
+        self.buffer = deque()
+        self.pid = os.getpid()
+        # 每个线程自己的begin/end栈
+        self.local = threading.local()
+        self.file = None
+        self.writer = None
+        self.wake = threading.Event()
+        self.batch_size = 512
+        self.flush_interval = 0.5
+        self.origin = time.perf_counter_ns()
+        # 已经写过名字的线程
+        self.named_threads = set()
+        # 文件里是否还一个事件都没有（决定写入时要不要先加逗号）
+        self.empty = True
+
+    def start(self, path: str, batch_size: int = 512, flush_interval: float = 0.5) -> None:
+        """
+        开始记录
+        :param path: 输出的json文件路径
+        :param batch_size: 缓冲区中攒够这么多事件就写一次文件
+        :param flush_interval: 最多隔这么多秒写一次文件
+        :return: 无
+        """
+        if self.enabled:
+            return
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.file = open(path, "w", encoding="utf-8")
+        # Chrome允许数组没有结尾，这样就算游戏崩溃，已经写进去的内容也能打开
+        self.file.write("[\n")
+        self.origin = time.perf_counter_ns()
+        self.named_threads.clear()
+        self.empty = True
+        self.enabled = True
+        self.writer = threading.Thread(target=self._write_loop, name="trace writer", daemon=True)
+        self.writer.start()
+
+    def stop(self) -> None:
+        """
+        停止记录，把缓冲区中剩下的事件全部写进文件并关闭文件
+        :return: 无
+        """
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.wake.set()
+        self.writer.join()
+        self.file.write("\n]\n")
+        self.file.close()
+        self.file = None
+
+    def _write_loop(self) -> None:
+        while self.enabled:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self._flush()
+        self._flush()
+
+    def _flush(self) -> None:
+        lines = []
+        buffer = self.buffer
+        while buffer:
+            lines.append(json.dumps(buffer.popleft(), ensure_ascii=False))
+        if lines:
+            if not self.empty:
+                self.file.write(",\n")
+            self.file.write(",\n".join(lines))
+            self.file.flush()
+            self.empty = False
+
+    def _push(self, event: dict) -> None:
+        self.buffer.append(event)
+        if len(self.buffer) >= self.batch_size:
+            self.wake.set()
+
+    def _thread_id(self) -> int:
+        thread = threading.current_thread()
+        tid = thread.ident
+        if tid not in self.named_threads:
+            self.named_threads.add(tid)
+            self._push({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                        "args": {"name": thread.name}})
+        return tid
+
+    def complete(self, name: str, category: str, start: int, end: int) -> None:
+        """
+        记录一段已经结束的时间
+        :param name: 名称
+        :param category: 分类
+        :param start: 开始时间，time.perf_counter_ns()
+        :param end: 结束时间，time.perf_counter_ns()
+        :return: 无
+        """
+        if not self.enabled:
+            return
+        self._push({"name": name, "cat": category, "ph": "X", "pid": self.pid, "tid": self._thread_id(),
+                    "ts": (start - self.origin) / 1000, "dur": (end - start) / 1000})
+
+    def instant(self, name: str, category: str = "game") -> None:
+        """
+        记录一个瞬间发生的事件（在时间线上显示为一条竖线）
+        :param name: 名称
+        :param category: 分类
+        :return: 无
+        """
+        if not self.enabled:
+            return
+        self._push({"name": name, "cat": category, "ph": "i", "s": "t", "pid": self.pid,
+                    "tid": self._thread_id(), "ts": (time.perf_counter_ns() - self.origin) / 1000})
+
+    def counter(self, name: str, values: dict, category: str = "stats") -> None:
+        """
+        记录一组数值（在时间线上显示为折线图）
+        :param name: 名称
+        :param values: 数值名称到数值的字典
+        :param category: 分类
+        :return: 无
+        """
+        if not self.enabled:
+            return
+        self._push({"name": name, "cat": category, "ph": "C", "pid": self.pid, "tid": self._thread_id(),
+                    "ts": (time.perf_counter_ns() - self.origin) / 1000, "args": values})
+
+    def span(self, name: str, category: str = "loop"):
+        """
+        获取一个用with语句使用的时间段
+        :param name: 名称
+        :param category: 分类
+        :return: 时间段
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, category)
+
+    def begin(self, name: str, category: str = "loop") -> None:
+        """
+        开始一段时间，必须和end成对调用
+        :param name: 名称
+        :param category: 分类
+        :return: 无
+        """
+        if not self.enabled:
+            return
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        stack.append((name, category, time.perf_counter_ns()))
+
+    def end(self) -> None:
+        """
+        结束最近一次begin开始的时间段
+        :return: 无
+        """
+        if not self.enabled:
+            return
+        stack = getattr(self.local, "stack", None)
+        # 记录是在两次调用之间打开的，没有对应的begin
+        if not stack:
+            return
+        name, category, start = stack.pop()
+        self.complete(name, category, start, time.perf_counter_ns())
+
+    def wrap(self, function, name: str, category: str = "game"):
+        """
+        包装一个函数，让它每次执行时都被记录下来，一般用于在其他线程中执行的函数
+        :param function: 被包装的函数
+        :param name: 名称
+        :param category: 分类
+        :return: 包装后的函数
+        """
+        def wrapper(*args, **kwargs):
+            with self.span(name, category):
+                return function(*args, **kwargs)
+        return wrapper
+
+
+# 整个游戏共用的记录器
+TRACER = Tracer()
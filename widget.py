@@ -2,6 +2,8 @@
 # 所以这里自己实现一些常用组件
 import pygame
 
+import resource
+
 
 class Text(pygame.sprite.Sprite):
     """
@@ -32,7 +34,7 @@ class Text(pygame.sprite.Sprite):
             self.font = font
         self._text = ''
         # 先根据text渲染出一次图片
-        self.image = self.font.render(text, True, color, background)
+        self.image = resource.prepare(self.font.render(text, True, color, background), translucent=True)
 
         self.color = color
         self.background = background
@@ -51,15 +53,16 @@ class Text(pygame.sprite.Sprite):
     @text.setter
     def text(self, text: str):
         self._text = text
-        # 重新渲染
-        self.image = self.font.render(text, True, self.color, self.background)
+        # 重新渲染，并转换为绘制最快的格式
+        # 抗锯齿的文字没有背景时边缘一定是半透明的，不用检查能否使用透明色；有背景时渲染出来的图片本身就不透明
+        self.image = resource.prepare(self.font.render(text, True, self.color, self.background), translucent=True)
 
     def render(self) -> None:
         """
         立刻以目前的设置进行一次渲染
         :return: 无
         """
-        self.image = self.font.render(self.text, True, self.color, self.background)
+        self.image = resource.prepare(self.font.render(self.text, True, self.color, self.background), translucent=True)
 
 
 class Button(Text):
@@ -93,11 +96,18 @@ class Button(Text):
         # 按钮被按下时，调用回调函数
         self.command(*self.args, self.kwargs)
 
-    def update(self, dt=None):
-        # 每帧都检查鼠标是否按下，如果鼠标左键被按下且鼠标指针在按钮上，就触发回调
-        for event in pygame.event.get(pygame.MOUSEBUTTONUP):
-            if event.button == pygame.BUTTON_LEFT and self.rect.collidepoint(event.pos):
+    def handle(self, clicks) -> bool:
+        """
+        处理这一帧的鼠标点击，如果鼠标左键在按钮上松开，就触发回调
+        事件由游戏循环统一取出（见inputs.py），按钮自己不再从事件队列里取
+        :param clicks: 这一帧鼠标松开的按键与位置，每项为(按键, 位置)
+        :return: 是否触发了回调
+        """
+        for button, pos in clicks:
+            if button == pygame.BUTTON_LEFT and self.rect.collidepoint(pos):
                 self.push()
+                return True
+        return False
 
 
 class ImageButton(pygame.sprite.Sprite):
@@ -125,7 +135,9 @@ class ImageButton(pygame.sprite.Sprite):
     def push(self):
         self.command(*self.args, self.kwargs)
 
-    def update(self, dt=None):
-        for event in pygame.event.get(pygame.MOUSEBUTTONUP):
-            if event.button == pygame.BUTTON_LEFT and self.rect.collidepoint(event.pos):
+    def handle(self, clicks) -> bool:
+        for button, pos in clicks:
+            if button == pygame.BUTTON_LEFT and self.rect.collidepoint(pos):
                 self.push()
+                return True
+        return False